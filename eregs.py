@@ -1,5 +1,6 @@
 import logging
 from importlib import import_module
+from multiprocessing import cpu_count
 import pkgutil
 import sys
 
@@ -9,7 +10,8 @@ import ipdb
 import requests_cache   # @todo - replace with cache control
 
 from regparser import commands
-from regparser.commands.dependency_resolver import DependencyResolver
+from regparser.commands.dependency_resolver import (
+    plan_resolutions, resolve_all)
 from regparser.index import dependency
 
 
@@ -31,24 +33,28 @@ for _, command_name, _ in pkgutil.iter_modules(commands.__path__):
         cli.add_command(subcommand)
 
 
-def main(prev_dependency=None):
+def main():
     """Wrapper around cli(), providing exception handling for dependency
-    errors. When a dependency is missing, this will try to resolve that
-    dependency and then retry running cli(). When retrying, the
-    `prev_dependency` parameter indirectly tells us if we've progressed, due
-    to the dependency changing"""
-    try:
-        cli()
-    except dependency.Missing, e:
-        resolvers = [resolver(e.dependency)
-                     for resolver in DependencyResolver.__subclasses__()]
-        resolvers = [r for r in resolvers if r.has_resolution()]
-        if e.dependency == prev_dependency or len(resolvers) != 1:
-            raise e
-        else:
-            click.echo("Attempting to resolve dependency: " + e.dependency)
-            resolvers[0].resolution()
-            main(e.dependency)
+    errors. When a dependency is missing, we look through the dependency
+    graph for all of the related dependencies which are also missing, resolve
+    them (in parallel, where possible) and then retry running cli(). If the
+    same dependency is missing after resolving it, we've not progressed, so
+    give up"""
+    prev_dependency = None
+    while True:
+        try:
+            cli()
+        except dependency.Missing, e:
+            with dependency.Graph() as deps:
+                waves = plan_resolutions(e, deps)
+            planned = set(resolver.dependency_path
+                          for wave in waves for resolver in wave)
+            if e.dependency == prev_dependency or e.dependency not in planned:
+                raise e
+            click.echo("Attempting to resolve {} dependencies, including {}"
+                       .format(len(planned), e.dependency))
+            resolve_all(waves, workers=cpu_count())
+            prev_dependency = e.dependency
 
 
 if __name__ == '__main__':
@@ -1,12 +1,21 @@
+import gzip
+import hashlib
+import json
+import logging
 import os
 import os.path
+from Queue import Queue
 import shutil
+from StringIO import StringIO
+import threading
 
 from git import Repo
 from git.exc import InvalidGitRepositoryError
 import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
 
-from regparser.tree.struct import Node, NodeEncoder
+from regparser.tree.struct import FrozenNode, Node, NodeEncoder
 from regparser.notice.encoder import AmendmentEncoder
 import settings
 
@@ -16,39 +25,149 @@ class AmendmentNodeEncoder(AmendmentEncoder, NodeEncoder):
 
 
 class FSWriteContent:
-    """This writer places the contents in the file system """
+    """This writer places the contents in the file system. Set `indent` to
+    None for compact (unindented) JSON"""
 
-    def __init__(self, *path_parts):
+    def __init__(self, *path_parts, **kwargs):
         self.path = os.path.join(*path_parts)
+        self.indent = kwargs.get('indent', 4)
 
     def write(self, python_obj):
-        """Write the object as json to disk"""
-        dir_path = os.path.split(self.path)[0]
+        """Write the object as json to disk. The JSON is streamed to a
+        temporary file, which is then moved into place; we needn't hold the
+        whole document in memory and readers never see a partial file"""
+        dir_path, file_name = os.path.split(self.path)
         if not os.path.exists(dir_path):
             os.makedirs(dir_path)
 
-        with open(self.path, 'w') as out:
-            text = AmendmentNodeEncoder(
-                sort_keys=True, indent=4,
-                separators=(', ', ': ')).encode(python_obj)
-            out.write(text)
+        if self.indent is None:
+            separators = (',', ':')
+        else:
+            separators = (', ', ': ')
+        encoder = AmendmentNodeEncoder(sort_keys=True, indent=self.indent,
+                                       separators=separators)
+        tmp_path = os.path.join(
+            dir_path, '.{}.{}.tmp'.format(file_name, os.getpid()))
+        try:
+            with open(tmp_path, 'w') as out:
+                for chunk in encoder.iterencode(python_obj):
+                    out.write(chunk)
+            os.rename(tmp_path, self.path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+class APIUploader(object):
+    """Sends documents to an API via a shared, keep-alive session. Failed
+    requests (connection errors, 5XX responses) are retried with exponential
+    backoff; any which still fail are collected in `failures`. With more than
+    one worker, uploads are handed to a bounded queue, drained by that many
+    threads; call `finish` to wait for them to complete"""
+    RETRY_STATUSES = (500, 502, 503, 504)
+
+    def __init__(self, workers=1, gzip_bodies=False, retries=3,
+                 backoff_factor=0.5):
+        self.workers = workers
+        self.gzip_bodies = gzip_bodies
+        self.session = requests.Session()
+        retry = Retry(total=retries, backoff_factor=backoff_factor,
+                      status_forcelist=self.RETRY_STATUSES,
+                      # Uploads replace the document, so are safe to retry
+                      method_whitelist=False)
+        adapter = HTTPAdapter(pool_maxsize=max(workers, 1),
+                              max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.failures = []
+        self._lock = threading.Lock()
+        self._queue = Queue(maxsize=2 * workers)
+        self._threads = []
+
+    def upload(self, url, body):
+        """Upload immediately, or queue the upload if using workers"""
+        if self.workers <= 1:
+            self._upload(url, body)
+        else:
+            if not self._threads:
+                for _ in range(self.workers):
+                    thread = threading.Thread(target=self._work)
+                    thread.daemon = True
+                    thread.start()
+                    self._threads.append(thread)
+            self._queue.put((url, body))
+
+    def _upload(self, url, body):
+        headers = {'content-type': 'application/json'}
+        if self.gzip_bodies:
+            buf = StringIO()
+            with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+                f.write(body)
+            body = buf.getvalue()
+            headers['content-encoding'] = 'gzip'
+        try:
+            response = self.session.post(url, data=body, headers=headers)
+            response.raise_for_status()
+        except requests.RequestException, e:
+            logging.warning("Failed to upload %s: %s", url, e)
+            with self._lock:
+                self.failures.append((url, e))
+
+    def _work(self):
+        while True:
+            url, body = self._queue.get()
+            try:
+                if url is None:
+                    return
+                self._upload(url, body)
+            finally:
+                self._queue.task_done()
+
+    def finish(self):
+        """Wait for any queued uploads. Returns the list of (url, error)
+        pairs which failed"""
+        for _ in self._threads:
+            self._queue.put((None, None))
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        return self.failures
 
 
 class APIWriteContent:
     """This writer writes the contents to the specified API"""
-    def __init__(self, *path_parts):
+    # Used if no uploader is provided, so we still reuse connections
+    default_uploader = None
+
+    def __init__(self, *path_parts, **kwargs):
         self.path = "/".join(path_parts)
+        self.uploader = kwargs.get('uploader')
+        if self.uploader is None:
+            if APIWriteContent.default_uploader is None:
+                APIWriteContent.default_uploader = APIUploader()
+            self.uploader = APIWriteContent.default_uploader
+
+    def encode(self, python_obj):
+        """The JSON body which would be sent for this object. Keys are
+        sorted, so identical objects have identical bodies"""
+        return AmendmentNodeEncoder(sort_keys=True).encode(python_obj)
+
+    def write_encoded(self, body):
+        """Send an already-encoded body to the API"""
+        self.uploader.upload(self.path, body)
 
     def write(self, python_obj):
         """Write the object (as json) to the API"""
-        requests.post(
-            self.path,
-            data=AmendmentNodeEncoder().encode(python_obj),
-            headers={'content-type': 'application/json'})
+        self.write_encoded(self.encode(python_obj))
 
 
 class GitWriteContent:
-    """This writer places the content in a git repo on the file system"""
+    """This writer places the content in a git repo on the file system. Each
+    version is compared against the previously written one (as described by
+    a manifest of subtree hashes, kept in the .git directory), so that only
+    the files of changed nodes are written and staged"""
+    MANIFEST = 'eregs-manifest.json'
+
     def __init__(self, *path_parts):
         self.path = os.path.join(*path_parts)
 
@@ -62,12 +181,8 @@ class GitWriteContent:
         else:
             return node.label[-1]
 
-    def write_tree(self, root_path, node):
-        """Given a file system path and a node, write the node's contents and
-        recursively write its children to the provided location."""
-        if not os.path.exists(root_path):
-            os.makedirs(root_path)
-
+    def node_text(self, node):
+        """Contents of the index.md file for this node"""
         node_text = u"---\n"
         if node.title:
             node_text += 'title: "' + node.title + '"\n'
@@ -79,13 +194,52 @@ class GitWriteContent:
         node_text += ']\n'
 
         node_text += '---\n' + node.text
-        with open(root_path + os.sep + 'index.md', 'w') as f:
-            f.write(node_text.encode('utf8'))
+        return node_text.encode('utf8')
+
+    def sync_tree(self, dir_path, rel_path, node, previous, changes):
+        """Write the (frozen) node and its descendants to rel_path, within
+        dir_path. `previous` is the manifest entry from the last write to
+        this path (if any): subtrees with unchanged hashes are skipped and
+        only index.md files with new contents are written. Paths of written
+        and deleted files are added to `changes`. Returns the new manifest
+        entry"""
+        previous = previous or {}
+        if previous.get('hash') == node.hash:
+            return previous
 
-        for idx, child in enumerate(node.children):
-            child_path = root_path + os.sep + child_folders[idx]
-            shutil.rmtree(child_path, ignore_errors=True)
-            self.write_tree(child_path, child)
+        if not os.path.exists(os.path.join(dir_path, rel_path)):
+            os.makedirs(os.path.join(dir_path, rel_path))
+        node_text = self.node_text(node)
+        text_hash = hashlib.sha1(node_text).hexdigest()
+        if previous.get('text') != text_hash:
+            index_path = os.path.join(rel_path, 'index.md')
+            with open(os.path.join(dir_path, index_path), 'w') as f:
+                f.write(node_text)
+            changes['modified'].append(index_path)
+
+        prev_children = previous.get('children', {})
+        children = {}
+        for child in node.children:
+            folder = self.folder_name(child)
+            children[folder] = self.sync_tree(
+                dir_path, os.path.join(rel_path, folder), child,
+                prev_children.get(folder), changes)
+        for folder, prev_child in prev_children.items():
+            if folder not in children:
+                child_path = os.path.join(rel_path, folder)
+                changes['deleted'].extend(
+                    self.manifest_files(child_path, prev_child))
+                shutil.rmtree(os.path.join(dir_path, child_path),
+                              ignore_errors=True)
+        return {'hash': node.hash, 'text': text_hash, 'children': children}
+
+    def manifest_files(self, rel_path, manifest):
+        """All of the files described by this manifest entry"""
+        files = [os.path.join(rel_path, 'index.md')]
+        for folder, child in manifest['children'].items():
+            files.extend(self.manifest_files(os.path.join(rel_path, folder),
+                                             child))
+        return files
 
     def write(self, python_object):
         if "regulation" in self.path:
@@ -100,29 +254,45 @@ class GitWriteContent:
                 repo = Repo.init(dir_path)
                 repo.index.commit("Initial commit for " + cfr_part)
 
-            # Write all files (and delete any old ones)
-            self.write_tree(dir_path, python_object)
-            # Add and new files to git
-            repo.index.add(repo.untracked_files)
-            # Delete and modify files as needed
-            deleted, modified = [], []
-            for diff in repo.index.diff(None):
-                if diff.deleted_file:
-                    deleted.append(diff.a_blob.path)
-                else:
-                    modified.append(diff.a_blob.path)
-            if modified:
-                repo.index.add(modified)
-            if deleted:
-                repo.index.remove(deleted)
+            manifest_path = os.path.join(repo.git_dir, self.MANIFEST)
+            if os.path.exists(manifest_path):
+                with open(manifest_path) as f:
+                    previous = json.load(f)
+            else:
+                previous = None
+
+            # Write changed files (and delete any old ones)
+            changes = {'modified': [], 'deleted': []}
+            manifest = self.sync_tree(
+                dir_path, '', FrozenNode.from_node(python_object), previous,
+                changes)
+            if previous is None:
+                # Without a manifest, we don't know which files were written
+                # previously; check the git index for any no longer needed
+                current = set(self.manifest_files('', manifest))
+                for path, _ in repo.index.entries.keys():
+                    if path.endswith('index.md') and path not in current:
+                        changes['deleted'].append(path)
+                        shutil.rmtree(os.path.join(dir_path,
+                                                   os.path.dirname(path)),
+                                      ignore_errors=True)
+            # Stage all of the changes in one batch
+            if changes['modified']:
+                repo.index.add(changes['modified'])
+            if changes['deleted']:
+                repo.index.remove(changes['deleted'])
             # Commit with the notice id as the commit message
             repo.index.commit(version_id)
+            with open(manifest_path, 'w') as f:
+                json.dump(manifest, f)
 
 
 class Client:
-    """A Client for writing regulation(s) and meta data."""
+    """A Client for writing regulation(s) and meta data. When writing to an
+    API, `workers` concurrent uploads are used and `finish` should be called
+    once all documents have been written"""
 
-    def __init__(self, base=None):
+    def __init__(self, base=None, workers=1, gzip_bodies=False, indent=4):
         if base is None and settings.API_BASE:
             base = settings.API_BASE
         elif base is None and getattr(settings, 'GIT_OUTPUT_DIR', ''):
@@ -132,26 +302,38 @@ class Client:
         elif base.startswith('file://'):
             base = base[len('file://'):]
 
+        self.writer_kwargs = {}
         if base.startswith('http://') or base.startswith('https://'):
             self.writer_class = APIWriteContent
             self.base = base    # keep the protocol, etc.
+            self.writer_kwargs['uploader'] = APIUploader(workers,
+                                                         gzip_bodies)
         elif base.startswith('git://'):
             self.writer_class = GitWriteContent
             self.base = base[len('git://'):]
         else:
             self.writer_class = FSWriteContent
             self.base = base
+            self.writer_kwargs['indent'] = indent
+
+    def _writer(self, *path_parts):
+        return self.writer_class(self.base, *path_parts, **self.writer_kwargs)
 
     def regulation(self, label, doc_number):
-        return self.writer_class(self.base, "regulation", label, doc_number)
+        return self._writer("regulation", label, doc_number)
 
     def layer(self, layer_name, label, doc_number):
-        return self.writer_class(self.base, "layer", layer_name, label,
-                                 doc_number)
+        return self._writer("layer", layer_name, label, doc_number)
 
     def notice(self, doc_number):
-        return self.writer_class(self.base, "notice", doc_number)
+        return self._writer("notice", doc_number)
 
     def diff(self, label, old_version, new_version):
-        return self.writer_class(self.base, "diff", label, old_version,
-                                 new_version)
+        return self._writer("diff", label, old_version, new_version)
+
+    def finish(self):
+        """Wait for any pending writes. Returns a list of (path, error)
+        pairs for those which failed"""
+        if 'uploader' in self.writer_kwargs:
+            return self.writer_kwargs['uploader'].finish()
+        return []
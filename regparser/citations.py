@@ -1,9 +1,20 @@
-from itertools import chain
+import atexit
+from bisect import bisect_right
+from collections import OrderedDict
+import hashlib
+from itertools import chain, groupby
+import json
 import logging
+import os
+import sqlite3
+import sys
 
-from regparser.grammar import unified as grammar
+from regparser.grammar import atomic, unified as grammar, utils
+from regparser.grammar.utils import MultiSearchable
+from regparser.index import ROOT
 from regparser.tree.paragraph import p_levels
 from regparser.tree.struct import Node
+import settings
 
 
 class Label(object):
@@ -225,45 +236,228 @@ def multiple_citations(matches, initial_label, comment=False,
             label = new_label   # update the label to keep context
 
 
+# Grammars for internal citations, in the order their citations are collected:
+# (grammar, function converting its matches into citations, is a comment)
+_MARKED_GRAMMARS = (
+    (grammar.marker_comment, single_citations, True),
+    (grammar.multiple_non_comments, multiple_citations, False),
+    (grammar.multiple_appendix_section, multiple_citations, False),
+    (grammar.multiple_comments, multiple_citations, True),
+    (grammar.multiple_appendices, multiple_citations, False),
+    (grammar.multiple_period_sections, multiple_citations, False),
+    (grammar.marker_appendix, single_citations, False),
+    (grammar.appendix_with_section, single_citations, False),
+    (grammar.marker_paragraph, single_citations, False),
+    (grammar.mps_paragraph, single_citations, False),
+    (grammar.m_section_paragraph, single_citations, False),
+)
+# Only used if a marker (e.g. "paragraph") isn't required
+_UNMARKED_GRAMMARS = (
+    (grammar.section_paragraph, single_citations, False),
+    (grammar.part_section_paragraph, single_citations, False),
+    (grammar.multiple_section_paragraphs, multiple_citations, False),
+)
+_CFR_GRAMMARS = (grammar.cfr, grammar.cfr_p, grammar.multiple_cfr_p)
+
+
+def _make_scanner(grammars):
+    """All of the grammars' matches are found in a single pass over the text.
+    `appendix_with_part` and the CFR grammars follow those listed"""
+    return MultiSearchable(
+        [gram for gram, _, _ in grammars] + [grammar.appendix_with_part] +
+        list(_CFR_GRAMMARS))
+
+
+_scanners = {
+    True: (_MARKED_GRAMMARS, _make_scanner(_MARKED_GRAMMARS)),
+    False: (_MARKED_GRAMMARS + _UNMARKED_GRAMMARS,
+            _make_scanner(_MARKED_GRAMMARS + _UNMARKED_GRAMMARS)),
+}
+_cfr_scanner = MultiSearchable(_CFR_GRAMMARS)
+
+
+def _source_fingerprint(modules):
+    """Hash of the source of these modules, or None if it can't be read
+    (e.g. if only compiled files are installed)"""
+    digest = hashlib.sha1()
+    try:
+        for module in modules:
+            with open(os.path.splitext(module.__file__)[0] + '.py') as f:
+                digest.update(f.read())
+    except IOError:
+        return None
+    return digest.hexdigest()
+
+
+class CitationCache(object):
+    """The internal citations of a text depend only on that text and the
+    context it's parsed in (initial label, title, require_marker). As the
+    same text is parsed by several layers, and most paragraphs don't change
+    between versions, we keep the most recently used results in memory
+    (settings.CITATION_CACHE_SIZE of them). If
+    settings.CITATION_CACHE_PERSIST is set, results are also stored in
+    `citations.sqlite`, so that they're shared between runs and processes.
+    Cached citations are shared, so should not be modified"""
+    DB_FILE = os.path.join(ROOT, "citations.sqlite")
+    # Stored results are only valid for the grammars which produced them.
+    # Computed at import, as module paths may be relative to the current
+    # directory
+    FINGERPRINT = _source_fingerprint([atomic, grammar, utils,
+                                       sys.modules[__name__]])
+    # Number of new results to hold before writing them to the database
+    FLUSH_SIZE = 100
+
+    def __init__(self):
+        self._memory = OrderedDict()
+        self._pending = {}
+        self._connection = None
+        self._pid = None
+
+    @staticmethod
+    def key(text, initial_label, require_marker, title):
+        label_key = (initial_label.schema, initial_label.using_default_schema,
+                     tuple(sorted(initial_label.settings.items())))
+        return (text, label_key, require_marker, title)
+
+    def get(self, key):
+        if key in self._memory:
+            self._memory[key] = self._memory.pop(key)   # most recently used
+            return self._memory[key]
+        if self._persist():
+            db_key = self._db_key(key)
+            if db_key in self._pending:
+                citations = self._pending[db_key]
+            else:
+                row = self._db().execute(
+                    "SELECT citations FROM citation WHERE key = ?",
+                    (db_key,)).fetchone()
+                if row is None:
+                    return None
+                citations = deserialize_citations(row[0])
+            self._remember(key, citations)
+            return citations
+
+    def set(self, key, citations):
+        self._remember(key, citations)
+        if self._persist():
+            self._pending[self._db_key(key)] = citations
+            if len(self._pending) >= self.FLUSH_SIZE:
+                self.flush()
+
+    def flush(self):
+        """Write any pending results to the database"""
+        if self._pending:
+            with self._db():
+                self._db().executemany(
+                    "INSERT OR REPLACE INTO citation (key, citations) "
+                    "VALUES (?, ?)",
+                    [(db_key, serialize_citations(citations))
+                     for db_key, citations in self._pending.items()])
+            self._pending = {}
+
+    def clear(self):
+        """Forget everything held in memory (but not the database)"""
+        self._memory.clear()
+        self._pending = {}
+
+    def _persist(self):
+        """Without a fingerprint, we couldn't tell whether stored results
+        are still valid, so don't use the database"""
+        return settings.CITATION_CACHE_PERSIST and self.FINGERPRINT is not None
+
+    def _remember(self, key, citations):
+        self._memory[key] = citations
+        while len(self._memory) > settings.CITATION_CACHE_SIZE:
+            self._memory.popitem(last=False)
+
+    def _db(self):
+        """Connect on first use, and again in forked processes"""
+        if self._pid != os.getpid():
+            if not os.path.exists(ROOT):
+                os.makedirs(ROOT)
+            self._connection = sqlite3.connect(self.DB_FILE)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            with self._connection:
+                self._connection.execute(
+                    "CREATE TABLE IF NOT EXISTS citation ("
+                    "key TEXT PRIMARY KEY, citations TEXT NOT NULL)")
+            self._pid = os.getpid()
+        return self._connection
+
+    def _db_key(self, key):
+        """Stored results are keyed by a hash of the text and context, and
+        of the grammars' source, so that they're not used once the
+        grammars have changed"""
+        text, label_key, require_marker, title = key
+        return hashlib.sha1(json.dumps(
+            [self.FINGERPRINT, text, label_key, require_marker, title]
+        )).hexdigest()
+
+
+def serialize_citations(citations):
+    return json.dumps([
+        {'start': cit.start, 'end': cit.end, 'full_start': cit.full_start,
+         'full_end': cit.full_end, 'in_clause': cit.in_clause,
+         'schema': (None if cit.label.using_default_schema
+                    else cit.label.schema),
+         'settings': cit.label.settings}
+        for cit in citations])
+
+
+def deserialize_citations(json_str):
+    citations = []
+    for data in json.loads(json_str):
+        label_settings = {str(field): value
+                          for field, value in data['settings'].items()}
+        if data['schema']:
+            label_settings['schema'] = tuple(data['schema'])
+        citations.append(ParagraphCitation(
+            data['start'], data['end'], Label(**label_settings),
+            full_start=data['full_start'], full_end=data['full_end'],
+            in_clause=data['in_clause']))
+    return citations
+
+
+_cache = CitationCache()
+atexit.register(lambda: _cache.flush())
+
+
+def flush_cache():
+    """Write any cached citations which should be persisted. Long-lived
+    processes (e.g. layer workers) should call this periodically, as they
+    may be terminated before exiting"""
+    _cache.flush()
+
+
 def internal_citations(text, initial_label=None,
                        require_marker=False, title=None):
     """List of all internal citations in the text. require_marker helps by
     requiring text be prepended by 'comment'/'paragraphs'/etc. title
     represents the CFR title (e.g. 11 for FEC, 12 for CFPB regs) and is used
     to correctly parse citations of the the form 11 CFR 110.1 when
-    11 CFR 110 is the regulation being parsed."""
+    11 CFR 110 is the regulation being parsed. Results are cached (see
+    CitationCache)"""
     if not initial_label:
         initial_label = Label()
-    citations = []
-
-    def single(gram, comment):
-        citations.extend(single_citations(gram.scanString(text),
-                                          initial_label, comment))
+    key = CitationCache.key(text, initial_label, require_marker, title)
+    citations = _cache.get(key)
+    if citations is None:
+        citations = _internal_citations(text, initial_label, require_marker,
+                                        title)
+        _cache.set(key, citations)
+    return list(citations)
 
-    def multiple(gram, comment):
-        citations.extend(multiple_citations(gram.scanString(text),
-                                            initial_label, comment))
 
-    single(grammar.marker_comment, True)
-
-    multiple(grammar.multiple_non_comments, False)
-    multiple(grammar.multiple_appendix_section, False)
-    multiple(grammar.multiple_comments, True)
-    multiple(grammar.multiple_appendices, False)
-    multiple(grammar.multiple_period_sections, False)
+def _internal_citations(text, initial_label, require_marker, title):
+    citations = []
 
-    single(grammar.marker_appendix, False)
-    single(grammar.appendix_with_section, False)
-    single(grammar.marker_paragraph, False)
-    single(grammar.mps_paragraph, False)
-    single(grammar.m_section_paragraph, False)
-    if not require_marker:
-        single(grammar.section_paragraph, False)
-        single(grammar.part_section_paragraph, False)
-        multiple(grammar.multiple_section_paragraphs, False)
+    grammars, scanner = _scanners[require_marker]
+    all_matches = scanner.scan(text)
+    for (_, to_citations, comment), matches in zip(grammars, all_matches):
+        citations.extend(to_citations(matches, initial_label, comment))
 
     # Some appendix citations are... complex
-    for match, start, end in grammar.appendix_with_part.scanString(text):
+    for match, start, end in all_matches[len(grammars)]:
         full_start = start
         if match.marker is not '':
             start = match.marker.pos[1]
@@ -276,7 +470,7 @@ def internal_citations(text, initial_label=None,
 
     # Internal citations can sometimes be in the form XX CFR YY.ZZ
     # Check if this is a reference to the CFR title and part we are parsing
-    for cit in cfr_citations(text):
+    for cit in _cfr_citations(all_matches[len(grammars) + 1:]):
         cit_title = cit.label.settings.get('cfr_title')
         cit_part = cit.label.settings.get('part')
         initial_part = initial_label.settings.get('part')
@@ -288,33 +482,79 @@ def internal_citations(text, initial_label=None,
 
 def select_encompassing_citations(citations):
     """The same citation might be found by multiple grammars; we take the
-    most-encompassing of any overlaps"""
-    encompassing = []
-    for cit in citations:
-        if not any(cit in other for other in citations):
-            encompassing.append(cit)
-    return encompassing
-
-
-def remove_citation_overlaps(text, possible_markers):
-    """Given a list of markers, remove any that overlap with citations"""
+    most-encompassing of any overlaps. Rather than comparing each pair of
+    citations, we sweep through them sorted by start (widest first), tracking
+    the furthest end seen so far. Citations are returned in their original
+    order"""
+    def span(idx):
+        return citations[idx].full_start, citations[idx].full_end
+
+    order = sorted(range(len(citations)),
+                   key=lambda idx: (citations[idx].full_start,
+                                    -citations[idx].full_end))
+    keep = set()
+    furthest_end = None
+    # Citations with identical spans don't contain each other, so they are
+    # kept or dropped together
+    for (_, end), idxs in groupby(order, key=span):
+        if furthest_end is None or furthest_end < end:
+            keep.update(idxs)
+            furthest_end = end
+    return [cit for idx, cit in enumerate(citations) if idx in keep]
+
+
+class CitationSpans(object):
+    """The offsets of the internal citations within a text, indexed so that
+    we can quickly check whether some span of that text overlaps any of
+    them. Citations are only found once a span is checked"""
+    def __init__(self, text):
+        self.text = text
+        self._starts, self._max_ends = None, None
+
+    def _index(self):
+        """Sort the citations by start. As we track the furthest end of the
+        citations so far, citations which overlap a span must be among
+        those starting before it ends"""
+        spans = sorted((cit.start, cit.end)
+                       for cit in internal_citations(self.text))
+        self._starts, self._max_ends = [], []
+        max_end = -1
+        for start, end in spans:
+            max_end = max(max_end, end)
+            self._starts.append(start)
+            self._max_ends.append(max_end)
+
+    def overlaps(self, start, end):
+        """Whether this span overlaps (or touches) a citation"""
+        if self._starts is None:
+            self._index()
+        idx = bisect_right(self._starts, end)
+        return idx > 0 and self._max_ends[idx - 1] >= start
+
+
+def remove_citation_overlaps(text, possible_markers, spans=None):
+    """Given a list of markers, remove any that overlap with citations.
+    Provide `spans` (the text's CitationSpans) when checking several lists
+    of markers from the same text"""
+    if spans is None:
+        spans = CitationSpans(text)
     return [(m, start, end) for m, start, end in possible_markers
-            if not any((e.start <= start and e.end >= start) or
-                       (e.start <= end and e.end >= end) or
-                       (start <= e.start and end >= e.end)
-                       for e in internal_citations(text))]
+            if not spans.overlaps(start, end)]
 
 
 def cfr_citations(text, include_fill=False):
     """Find all citations which include CFR title and part"""
+    return _cfr_citations(_cfr_scanner.scan(text), include_fill)
+
+
+def _cfr_citations(matches, include_fill=False):
+    """Convert matches of each of the _CFR_GRAMMARS into citations"""
+    cfr_matches, cfr_p_matches, multiple_matches = matches
     citations = []
     initial_label = Label()
-    citations.extend(single_citations(grammar.cfr.scanString(text),
-                                      initial_label))
-    citations.extend(single_citations(grammar.cfr_p.scanString(text),
-                                      initial_label))
+    citations.extend(single_citations(cfr_matches, initial_label))
+    citations.extend(single_citations(cfr_p_matches, initial_label))
     citations.extend(multiple_citations(
-        grammar.multiple_cfr_p.scanString(text), initial_label,
-        include_fill=include_fill))
+        multiple_matches, initial_label, include_fill=include_fill))
 
     return select_encompassing_citations(citations)
@@ -33,21 +33,20 @@ def process_if_needed(cfr_title, cfr_part, last_versions):
     annual_path = entry.Annual(cfr_title, cfr_part)
     tree_path = entry.Tree(cfr_title, cfr_part)
     version_path = entry.Version(cfr_title, cfr_part)
-    deps = dependency.Graph()
-
-    for last_version in last_versions:
-        deps.add(tree_path / last_version.version_id,
-                 version_path / last_version.version_id)
-        deps.add(tree_path / last_version.version_id,
-                 annual_path / last_version.year)
-
-    for last_version in last_versions:
-        tree_entry = tree_path / last_version.version_id
-        deps.validate_for(tree_entry)
-        if deps.is_stale(tree_entry):
-            input_entry = annual_path / last_version.year
-            tree = xml_parser.reg_text.build_tree(input_entry.read().xml)
-            tree_entry.write(tree)
+    with dependency.Graph() as deps:
+        for last_version in last_versions:
+            deps.add(tree_path / last_version.version_id,
+                     version_path / last_version.version_id)
+            deps.add(tree_path / last_version.version_id,
+                     annual_path / last_version.year)
+
+        for last_version in last_versions:
+            tree_entry = tree_path / last_version.version_id
+            deps.validate_for(tree_entry)
+            if deps.is_stale(tree_entry):
+                input_entry = annual_path / last_version.year
+                tree = xml_parser.reg_text.build_tree(input_entry.read().xml)
+                tree_entry.write(tree)
 
 
 @click.command()
@@ -23,14 +23,14 @@ def process_if_needed(cfr_title, cfr_part, year):
     # directly
     sxs_entry = entry.SxS(version_id)
 
-    deps = dependency.Graph()
-    deps.add(tree_entry, annual_entry)
-    deps.validate_for(tree_entry)
-    if deps.is_stale(tree_entry):
-        tree = xml_parser.reg_text.build_tree(annual_entry.read().xml)
-        tree_entry.write(tree)
-        sxs_entry.write(build_fake_notice(
-            version_id, date.today().isoformat(), cfr_title, cfr_part))
+    with dependency.Graph() as deps:
+        deps.add(tree_entry, annual_entry)
+        deps.validate_for(tree_entry)
+        if deps.is_stale(tree_entry):
+            tree = xml_parser.reg_text.build_tree(annual_entry.read().xml)
+            tree_entry.write(tree)
+            sxs_entry.write(build_fake_notice(
+                version_id, date.today().isoformat(), cfr_title, cfr_part))
 
 
 def create_version_entry_if_needed(cfr_title, cfr_part, year):
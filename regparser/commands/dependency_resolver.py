@@ -1,6 +1,13 @@
 import abc
+from collections import defaultdict, OrderedDict
+import logging
+from multiprocessing import Process
 import os
 import re
+import sys
+import time
+
+from regparser.index import dependency
 
 
 class DependencyResolver(object):
@@ -9,9 +16,14 @@ class DependencyResolver(object):
     # The path of dependencies which this can resolve, split into components
     # which will be combined into a regex
     PATH_PARTS = tuple()
+    # When resolving many dependencies, resolutions are generally performed
+    # in parallel. Set this if they should instead be performed one after
+    # another (e.g. because a single resolution fixes several dependencies)
+    SEQUENTIAL = False
 
     def __init__(self, dependency_path):
         regex = re.compile(re.escape(os.sep).join(self.PATH_PARTS))
+        self.dependency_path = dependency_path
         self.match = regex.match(dependency_path)
 
     def has_resolution(self):
@@ -22,3 +34,122 @@ class DependencyResolver(object):
         """This will generally call a command in an effort to resolve a
         dependency"""
         raise NotImplementedError()
+
+
+def resolver_for(dependency_path):
+    """The resolver for this path, if there is exactly one"""
+    resolvers = [resolver(dependency_path)
+                 for resolver in DependencyResolver.__subclasses__()]
+    resolvers = [r for r in resolvers if r.has_resolution()]
+    if len(resolvers) == 1:
+        return resolvers[0]
+
+
+def plan_resolutions(missing, deps):
+    """Rather than resolving only the dependency which was found to be
+    missing, walk the dependency graph to find every resolvable input which
+    is missing or stale upstream of the entries near the failure (i.e. those
+    in the same directory as the entry which needed the dependency). Returns
+    a list of "waves" of resolvers; those within a wave don't depend on each
+    other, but may depend on those in earlier waves"""
+    with deps.dependency_db() as graph:
+        directory = os.path.dirname(missing.key)
+        to_visit = [output for output in graph
+                    if os.path.dirname(output) == directory]
+        to_visit.append(missing.key)
+        seen, found = set(), {}
+        while to_visit:
+            for input_ in graph.get(to_visit.pop(), ()):
+                if input_ not in seen:
+                    seen.add(input_)
+                    to_visit.append(input_)
+                    resolver = resolver_for(input_)
+                    if resolver and deps.is_stale(input_):
+                        found[input_] = resolver
+
+    levels = {}
+
+    def level(key, visiting=()):
+        """One more than the highest level of the found entries which this
+        key depends on (even indirectly)"""
+        if key not in levels:
+            result = 0
+            for input_ in graph.get(key, ()):
+                if input_ not in visiting:      # guard against cycles
+                    input_level = level(input_, visiting + (key,))
+                    if input_ in found:
+                        input_level += 1
+                    result = max(result, input_level)
+            levels[key] = result
+        return levels[key]
+
+    waves = defaultdict(list)
+    for key in sorted(found):
+        waves[level(key)].append(found[key])
+    return [waves[idx] for idx in sorted(waves)]
+
+
+def _resolve_group(resolvers, since):
+    """Run each resolution in turn, skipping those whose dependency has been
+    written (e.g. by an earlier resolution) since we started. This is the
+    entry point for resolution processes"""
+    success = True
+    for resolver in resolvers:
+        path = resolver.dependency_path
+        if os.path.exists(path) and os.path.getmtime(path) >= since:
+            continue
+        try:
+            resolver.resolution()
+        except dependency.Missing, e:
+            # We'll try again on the next pass
+            logging.warning("Could not resolve %s: %s", path, e)
+        except Exception:
+            logging.exception("Could not resolve %s", path)
+            success = False
+    dependency.flush_open_graphs()
+    sys.exit(0 if success else 1)
+
+
+def _run_in_processes(group_args, workers):
+    """Run each group of resolutions in its own process, with up to
+    `workers` running at a time. Processes are only ever started from the
+    calling thread. We don't use a `Pool` as its workers are daemonic, and
+    hence can't start processes of their own (as some resolutions do).
+    Returns whether each group succeeded"""
+    results = [None] * len(group_args)
+    pending = list(enumerate(group_args))
+    pending.reverse()
+    running = []
+    while pending or running:
+        while pending and len(running) < workers:
+            idx, args = pending.pop()
+            process = Process(target=_resolve_group, args=args)
+            process.start()
+            running.append((idx, process))
+        for idx, process in running:
+            process.join(0.05)
+            if not process.is_alive():
+                results[idx] = process.exitcode == 0
+        running = [(idx, process) for idx, process in running
+                   if results[idx] is None]
+    return results
+
+
+def resolve_all(waves, workers=1):
+    """Perform the resolutions of each wave in turn. Within a wave,
+    resolutions run in up to `workers` separate processes. Returns whether
+    all of them succeeded"""
+    since = time.time()
+    success = True
+    for wave in waves:
+        groups = OrderedDict()
+        for resolver in wave:
+            if resolver.SEQUENTIAL:
+                key = resolver.__class__
+            else:
+                key = resolver.dependency_path
+            groups.setdefault(key, []).append(resolver)
+        group_args = [(group, since) for group in groups.values()]
+        results = _run_in_processes(group_args, max(workers, 1))
+        success = success and all(results)
+    return success
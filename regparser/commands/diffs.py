@@ -1,30 +1,149 @@
+from collections import OrderedDict
+from itertools import groupby
+from multiprocessing import Pool
+
 import click
 
 from regparser.diff.tree import changes_between
 from regparser.index import dependency, entry
 
 
+def version_pairs(version_ids, adjacent):
+    """Which diffs should we compute? Either all pairs of versions or only
+    those between adjacent versions (in both directions)"""
+    if adjacent:
+        forward = zip(version_ids, version_ids[1:])
+        backward = [(rhs, lhs) for lhs, rhs in forward]
+        return forward + backward
+    else:
+        return [(lhs, rhs) for lhs in version_ids for rhs in version_ids]
+
+
+def blocks(pairs, version_ids, block_size):
+    """Split the (lhs, rhs) matrix into square blocks of at most block_size
+    rows and columns, so that each block needs at most 2*block_size trees.
+    Pairs within a block are ordered by lhs"""
+    position = {version_id: idx for idx, version_id in enumerate(version_ids)}
+
+    def block_of(pair):
+        lhs_id, rhs_id = pair
+        return (position[lhs_id] // block_size,
+                position[rhs_id] // block_size)
+
+    def sort_key(pair):
+        return block_of(pair) + (position[pair[0]], position[pair[1]])
+
+    return [list(block_pairs) for _, block_pairs
+            in groupby(sorted(pairs, key=sort_key), block_of)]
+
+
+class TreeCache(object):
+    """Bounded, least-recently-used cache of FrozenTrees. Also retains the
+    root record hash of each tree it has seen, so that identical trees can be
+    recognized without loading them"""
+    def __init__(self, tree_dir, capacity):
+        self.tree_dir = tree_dir
+        self.capacity = capacity
+        self.trees = OrderedDict()
+        self.hashes = {}
+
+    def __getitem__(self, version_id):
+        if version_id in self.trees:
+            self.trees[version_id] = self.trees.pop(version_id)
+        else:
+            self.trees[version_id] = (self.tree_dir / version_id).read()
+            while len(self.trees) > self.capacity:
+                self.trees.popitem(last=False)
+        return self.trees[version_id]
+
+    def root_hash(self, version_id):
+        if version_id not in self.hashes:
+            self.hashes[version_id] = (self.tree_dir / version_id).root_hash()
+        return self.hashes[version_id]
+
+    def identical(self, lhs_id, rhs_id):
+        """Can we tell that these two trees are identical without loading
+        them?"""
+        if lhs_id == rhs_id:
+            return True
+        lhs_hash = self.root_hash(lhs_id)
+        return lhs_hash is not None and lhs_hash == self.root_hash(rhs_id)
+
+
+def process_block(args):
+    """Compute and write the diffs for a single block of pairs. Trees are
+    loaded one row at a time, so we need to keep at most one lhs tree plus
+    the block's rhs trees in memory. This is also the entry point for worker
+    processes"""
+    cfr_title, cfr_part, pairs = args
+    tree_dir = entry.FrozenTree(cfr_title, cfr_part)
+    diff_dir = entry.Diff(cfr_title, cfr_part)
+    rhs_ids = set(rhs_id for _, rhs_id in pairs)
+    trees = TreeCache(tree_dir, capacity=len(rhs_ids) + 1)
+
+    for lhs_id, row in groupby(pairs, lambda pair: pair[0]):
+        lhs = None
+        for _, rhs_id in row:
+            path = diff_dir / lhs_id / rhs_id
+            if trees.identical(lhs_id, rhs_id):
+                path.write({})
+            else:
+                # Only touch the lhs once per row; it'll then be the least
+                # recently used tree, evicted when the next row begins
+                lhs = lhs or trees[lhs_id]
+                path.write(dict(changes_between(lhs, trees[rhs_id])))
+    return len(pairs)
+
+
+def process_blocks_in_parallel(block_args, workers):
+    """Farm blocks out to a pool of worker processes"""
+    pool = Pool(workers)
+    try:
+        for _ in pool.imap_unordered(process_block, block_args):
+            pass
+    finally:
+        pool.terminate()
+        pool.join()
+
+
 @click.command()
 @click.argument('cfr_title', type=int)
 @click.argument('cfr_part', type=int)
-def diffs(cfr_title, cfr_part):
+@click.option('--adjacent', is_flag=True, default=False,
+              help='Only compute diffs between adjacent versions. Other '
+                   'diffs can be derived from these when writing output')
+@click.option('--workers', type=int, default=1,
+              help='Number of processes to compute diffs with')
+@click.option('--block-size', type=int, default=10,
+              help='Diffs are computed in blocks of this many rows and '
+                   'columns; this bounds the number of trees in memory')
+def diffs(cfr_title, cfr_part, adjacent, workers, block_size):
     """Construct diffs between known trees."""
     tree_dir = entry.FrozenTree(cfr_title, cfr_part)
     diff_dir = entry.Diff(cfr_title, cfr_part)
-    pairs = [(lhs, rhs) for lhs in tree_dir for rhs in tree_dir]
-    deps = dependency.Graph()
-    for lhs_id, rhs_id in pairs:
-        deps.add(diff_dir / lhs_id / rhs_id, tree_dir / lhs_id)
-        deps.add(diff_dir / lhs_id / rhs_id, tree_dir / rhs_id)
-
-    trees = {}
-    for lhs_id, rhs_id in pairs:
-        path = diff_dir / lhs_id / rhs_id
-        deps.validate_for(path)
-        if deps.is_stale(path):
-            if lhs_id not in trees:
-                trees[lhs_id] = (tree_dir / lhs_id).read()
-            if rhs_id not in trees:
-                trees[rhs_id] = (tree_dir / rhs_id).read()
-
-            path.write(dict(changes_between(trees[lhs_id], trees[rhs_id])))
+    if adjacent:
+        version_ids = [version_id
+                       for version_id in entry.Version(cfr_title, cfr_part)
+                       if version_id in tree_dir]
+    else:
+        version_ids = list(tree_dir)
+    pairs = version_pairs(version_ids, adjacent)
+    with dependency.Graph() as deps:
+        for lhs_id, rhs_id in pairs:
+            deps.add(diff_dir / lhs_id / rhs_id, tree_dir / lhs_id)
+            deps.add(diff_dir / lhs_id / rhs_id, tree_dir / rhs_id)
+
+        stale = []
+        for lhs_id, rhs_id in pairs:
+            path = diff_dir / lhs_id / rhs_id
+            deps.validate_for(path)
+            if deps.is_stale(path):
+                stale.append((lhs_id, rhs_id))
+
+        block_args = [(cfr_title, cfr_part, block_pairs) for block_pairs
+                      in blocks(stale, version_ids, max(block_size, 1))]
+        if workers > 1:
+            process_blocks_in_parallel(block_args, workers)
+        else:
+            for args in block_args:
+                process_block(args)
@@ -16,7 +16,8 @@ def fetch_annual_edition(cfr_title, cfr_part, year):
     annual_entry = entry.Annual(cfr_title, cfr_part, year)
     annual_entry.write(xml)
     if xml.source_is_local:
-        dependency.Graph().add(str(annual_entry), xml.source)
+        with dependency.Graph() as deps:
+            deps.add(str(annual_entry), xml.source)
 
 
 class AnnualEditionResolver(DependencyResolver):
@@ -19,20 +19,20 @@ def fetch_sxs(document_number):
     sxs_entry = entry.SxS(document_number)
     notice_entry = entry.Notice(document_number)
 
-    deps = dependency.Graph()
-    deps.add(sxs_entry, notice_entry)
-
-    deps.validate_for(sxs_entry)
-    # We don't check for staleness as we want to always execute when given a
-    # specific file to process
-
-    # @todo - break apart processing of SxS. We don't need all of the other
-    # fields
-    notice_xml = notice_entry.read()
-    notice_meta = meta_data(document_number, FULL_NOTICE_FIELDS)
-    notice = build_notice(notice_xml.cfr_titles[0], None, notice_meta,
-                          xml_to_process=notice_xml.xml)[0]
-    sxs_entry.write(notice)
+    with dependency.Graph() as deps:
+        deps.add(sxs_entry, notice_entry)
+
+        deps.validate_for(sxs_entry)
+        # We don't check for staleness as we want to always execute when
+        # given a specific file to process
+
+        # @todo - break apart processing of SxS. We don't need all of the
+        # other fields
+        notice_xml = notice_entry.read()
+        notice_meta = meta_data(document_number, FULL_NOTICE_FIELDS)
+        notice = build_notice(notice_xml.cfr_titles[0], None, notice_meta,
+                              xml_to_process=notice_xml.xml)[0]
+        sxs_entry.write(notice)
 
 
 class RuleChangesResolver(DependencyResolver):
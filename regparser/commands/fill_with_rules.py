@@ -58,11 +58,10 @@ def fill_with_rules(cfr_title, cfr_part):
     changes in final rules. This command builds those missing trees"""
     tree_path = entry.Tree(cfr_title, cfr_part)
     version_ids = list(entry.Version(cfr_title, cfr_part))
-    deps = dependencies(tree_path, version_ids, cfr_title, cfr_part)
-
     preceeded_by = dict(zip(version_ids[1:], version_ids))
-    derived = derived_from_rules(version_ids, deps, tree_path)
-    for version_id in derived:
-        deps.validate_for(tree_path / version_id)
-        if deps.is_stale(tree_path / version_id):
-            process(tree_path, preceeded_by[version_id], version_id)
+    with dependencies(tree_path, version_ids, cfr_title, cfr_part) as deps:
+        derived = derived_from_rules(version_ids, deps, tree_path)
+        for version_id in derived:
+            deps.validate_for(tree_path / version_id)
+            if deps.is_stale(tree_path / version_id):
+                process(tree_path, preceeded_by[version_id], version_id)
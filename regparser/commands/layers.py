@@ -1,8 +1,16 @@
+from collections import OrderedDict
+from multiprocessing import Pool
+
 import click
 
+from regparser import citations
 from regparser.index import dependency, entry
 from regparser.layer import ALL_LAYERS
 
+# Number of trees each worker process keeps in memory
+TREE_CACHE_SIZE = 2
+_tree_cache = OrderedDict()
+
 
 def dependencies(tree_dir, layer_dir, version_dir):
     """Modify and return the dependency graph pertaining to layers"""
@@ -47,36 +55,86 @@ def stale_layers(deps, layer_dir):
             yield layer_name
 
 
+def build_layer(tree, layer_name, cfr_title, cfr_part, version):
+    """Build a single layer for this version of the tree and write it into
+    the index"""
+    version_dir = entry.Version(cfr_title, cfr_part)
+    layer_dir = entry.Layer(cfr_title, cfr_part)
+    notices = []
+    if layer_name == 'analyses':
+        notices = sxs_sources(version_dir, version.identifier)
+    layer_json = ALL_LAYERS[layer_name](
+        tree, cfr_title, notices=notices, version=version).build()
+    (layer_dir / version.identifier / layer_name).write(layer_json)
+    citations.flush_cache()
+
+
 def process_layers(stale, cfr_title, cfr_part, version):
     """Build all of the stale layers for this version, writing them into the
     index. Assumes all dependencies have already been checked"""
     tree = entry.Tree(cfr_title, cfr_part, version.identifier).read()
-    version_dir = entry.Version(cfr_title, cfr_part)
-    layer_dir = entry.Layer(cfr_title, cfr_part)
     for layer_name in stale:
-        notices = []
-        if layer_name == 'analyses':
-            notices = sxs_sources(version_dir, version.identifier)
-        layer_json = ALL_LAYERS[layer_name](
-            tree, cfr_title, notices=notices, version=version).build()
-        (layer_dir / version.identifier / layer_name).write(layer_json)
+        build_layer(tree, layer_name, cfr_title, cfr_part, version)
+
+
+def cached_tree(cfr_title, cfr_part, version_id):
+    """Read a tree, retaining the most recently used in memory. Used by
+    worker processes so that each reads a tree once, even though it will
+    build several layers from it"""
+    key = (cfr_title, cfr_part, version_id)
+    if key in _tree_cache:
+        _tree_cache[key] = _tree_cache.pop(key)     # most recently used
+    else:
+        _tree_cache[key] = entry.Tree(*key).read()
+        while len(_tree_cache) > TREE_CACHE_SIZE:
+            _tree_cache.popitem(last=False)
+    return _tree_cache[key]
+
+
+def process_job(job):
+    """Worker entry point. Builds a single (version, layer) pair"""
+    cfr_title, cfr_part, version_id, layer_name = job
+    version = entry.Version(cfr_title, cfr_part, version_id).read()
+    tree = cached_tree(cfr_title, cfr_part, version_id)
+    build_layer(tree, layer_name, cfr_title, cfr_part, version)
+    return version_id, layer_name
+
+
+def process_jobs_in_parallel(jobs, workers):
+    """Farm (version, layer) jobs out to a pool of worker processes. Jobs are
+    ordered by version, so consecutive jobs a worker picks up will generally
+    share a tree"""
+    pool = Pool(workers)
+    try:
+        for _ in pool.imap_unordered(process_job, jobs):
+            pass
+    finally:
+        pool.terminate()
+        pool.join()
 
 
 @click.command()
 @click.argument('cfr_title', type=int)
 @click.argument('cfr_part', type=int)
+@click.option('--workers', type=int, default=1,
+              help='Number of processes to build layers with')
 # @todo - allow layers to be passed as a parameter
-def layers(cfr_title, cfr_part):
+def layers(cfr_title, cfr_part, workers):
     """Build all layers for all known versions."""
     tree_dir = entry.Tree(cfr_title, cfr_part)
     layer_dir = entry.Layer(cfr_title, cfr_part)
     version_dir = entry.Version(cfr_title, cfr_part)
-    deps = dependencies(tree_dir, layer_dir, version_dir)
-
-    for version_id in tree_dir:
-        stale = list(stale_layers(deps, layer_dir / version_id))
-        if stale:
-            process_layers(
-                stale, cfr_title, cfr_part,
-                version=(version_dir / version_id).read()
-            )
+    with dependencies(tree_dir, layer_dir, version_dir) as deps:
+        jobs = []
+        for version_id in tree_dir:
+            stale = list(stale_layers(deps, layer_dir / version_id))
+            if stale and workers > 1:
+                jobs.extend((cfr_title, cfr_part, version_id, layer_name)
+                            for layer_name in stale)
+            elif stale:
+                process_layers(
+                    stale, cfr_title, cfr_part,
+                    version=(version_dir / version_id).read()
+                )
+        if jobs:
+            process_jobs_in_parallel(jobs, workers)
@@ -15,17 +15,17 @@ def parse_rule_changes(document_number):
     rule_entry = entry.RuleChanges(document_number)
     notice_entry = entry.Notice(document_number)
 
-    deps = dependency.Graph()
-    deps.add(rule_entry, notice_entry)
+    with dependency.Graph() as deps:
+        deps.add(rule_entry, notice_entry)
 
-    deps.validate_for(rule_entry)
-    # We don't check for staleness as we want to always execute when given a
-    # specific file to process
+        deps.validate_for(rule_entry)
+        # We don't check for staleness as we want to always execute when
+        # given a specific file to process
 
-    notice_xml = notice_entry.read()
-    notice = process_amendments({'cfr_parts': notice_xml.cfr_parts},
-                                notice_xml.xml)
-    rule_entry.write(notice)
+        notice_xml = notice_entry.read()
+        notice = process_amendments({'cfr_parts': notice_xml.cfr_parts},
+                                    notice_xml.xml)
+        rule_entry.write(notice)
 
 
 class RuleChangesResolver(DependencyResolver):
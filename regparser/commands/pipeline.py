@@ -18,8 +18,14 @@ from regparser.commands.write_to import write_to
               help="Don't derive history; use the latest annual edition")
 @click.option('--xml-ttl', type=int, default=60*60,
               help='Time to cache XML downloads, in seconds')
+@click.option('--workers', type=int, default=1,
+              help='Number of processes to build layers and diffs with')
+@click.option('--adjacent-diffs', is_flag=True, default=False,
+              help='Only compute diffs between adjacent versions, deriving '
+                   'the rest when writing output')
 @click.pass_context
-def pipeline(ctx, cfr_title, cfr_part, output, only_latest, xml_ttl):
+def pipeline(ctx, cfr_title, cfr_part, output, only_latest, xml_ttl,
+             workers, adjacent_diffs):
     """Full regulation parsing pipeline. Consists of retrieving and parsing
     annual edition, attempting to parse final rules in between, deriving
     layers and diffs, and writing them to disk or an API
@@ -38,6 +44,6 @@ def pipeline(ctx, cfr_title, cfr_part, output, only_latest, xml_ttl):
         ctx.invoke(versions, **params)
         ctx.invoke(annual_editions, **params)
         ctx.invoke(fill_with_rules, **params)
-    ctx.invoke(layers, **params)
-    ctx.invoke(diffs, **params)
+    ctx.invoke(layers, workers=workers, **params)
+    ctx.invoke(diffs, adjacent=adjacent_diffs, workers=workers, **params)
     ctx.invoke(write_to, output=output, **params)
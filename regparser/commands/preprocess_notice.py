@@ -1,25 +1,19 @@
 import click
 
 from regparser import federalregister
-from regparser.commands.dependency_resolver import DependencyResolver
 from regparser.index import dependency, entry
 from regparser.notice.build import split_doc_num
 from regparser.notice.xml import notice_xmls_for_url
 
+# Fields of the Federal Register's meta data needed to preprocess a notice
+META_FIELDS = ["effective_on", "full_text_xml_url", "publication_date",
+               "volume"]
 
-@click.command()
-@click.argument('document_number')
-def preprocess_notice(document_number):
-    """Preprocess notice XML. Either fetch from the Federal Register or read a
-    notice from disk. Apply some common transformations to it and output the
-    resulting file(s). There may be more than one as documents might be split
-    if they have multiple effective dates."""
-    meta = federalregister.meta_data(
-        document_number,
-        ["effective_on", "full_text_xml_url", "publication_date", "volume"])
-    notice_xmls = list(notice_xmls_for_url(document_number,
-                                           meta['full_text_xml_url']))
-    deps = dependency.Graph()
+
+def write_notices(document_number, meta, notice_xmls):
+    """Add the document's meta data to its (preprocessed) notice XML(s) and
+    write each to the index. Returns a list of (entry, NoticeXML) pairs"""
+    written = []
     for notice_xml in notice_xmls:
         file_name = document_number
         notice_xml.published = meta['publication_date']
@@ -38,14 +32,22 @@ def preprocess_notice(document_number):
 
         notice_entry = entry.Notice(file_name)
         notice_entry.write(notice_xml)
-        if notice_xml.source_is_local:
-            deps.add(str(notice_entry), notice_xml.source)
+        written.append((notice_entry, notice_xml))
+    return written
 
 
-class NoticeResolver(DependencyResolver):
-    PATH_PARTS = entry.Notice.PREFIX + (
-        '(?P<doc_number>[a-zA-Z0-9-_]+)',)
-
-    def resolution(self):
-        args = [self.match.group('doc_number')]
-        return preprocess_notice.main(args, standalone_mode=False)
+@click.command()
+@click.argument('document_number')
+def preprocess_notice(document_number):
+    """Preprocess notice XML. Either fetch from the Federal Register or read a
+    notice from disk. Apply some common transformations to it and output the
+    resulting file(s). There may be more than one as documents might be split
+    if they have multiple effective dates."""
+    meta = federalregister.meta_data(document_number, META_FIELDS)
+    notice_xmls = list(notice_xmls_for_url(document_number,
+                                           meta['full_text_xml_url']))
+    with dependency.Graph() as deps:
+        for notice_entry, notice_xml in write_notices(document_number, meta,
+                                                      notice_xmls):
+            if notice_xml.source_is_local:
+                deps.add(str(notice_entry), notice_xml.source)
@@ -0,0 +1,156 @@
+from collections import defaultdict
+import logging
+from multiprocessing import Pool
+
+import click
+from lxml import etree
+import requests
+
+from regparser import federalregister, web
+from regparser.commands.dependency_resolver import DependencyResolver
+from regparser.commands.preprocess_notice import (
+    preprocess_notice, write_notices)
+from regparser.index import dependency, entry
+from regparser.notice.xml import NoticeXML, xml_sources_for_url
+import settings
+
+# Number of documents to fetch before handing them off to be processed. This
+# bounds the amount of (unparsed) XML held in memory
+BATCH_SIZE = 50
+
+
+def process_document(args):
+    """Preprocess and write the XML(s) of a single document. This is also the
+    entry point for worker processes, so we return plain data: a list of
+    (entry path, source, whether the source is local) triples"""
+    document_number, meta, sources = args
+    try:
+        notice_xmls = [NoticeXML(content, source).preprocess()
+                       for content, source in sources]
+        return [(str(notice_entry), notice_xml.source,
+                 notice_xml.source_is_local)
+                for notice_entry, notice_xml
+                in write_notices(document_number, meta, notice_xmls)]
+    # A single bad notice shouldn't stop the rest
+    except (etree.XMLSyntaxError, ValueError):
+        logging.exception("Could not preprocess %s", document_number)
+        return []
+
+
+def stale_document_numbers(document_numbers, deps):
+    """Document numbers without any preprocessed notices (including split
+    notices) or whose notices are out of date, e.g. as their local XML has
+    been modified"""
+    notice_dir = entry.Notice()
+    names_by_doc = defaultdict(list)
+    for name in notice_dir:
+        names_by_doc[name.split('_')[0]].append(name)
+    for document_number in document_numbers:
+        names = names_by_doc[document_number]
+        if not names or any(deps.is_stale(notice_dir / name)
+                            for name in names):
+            yield document_number
+
+
+def batches(items, size):
+    for idx in range(0, len(items), size):
+        yield items[idx:idx + size]
+
+
+def fetch_sources(document_number, meta):
+    """The XML sources for a single document, or None if they couldn't be
+    fetched"""
+    try:
+        return xml_sources_for_url(meta['full_text_xml_url'])
+    except (requests.RequestException, IOError):
+        logging.exception("Could not fetch %s", document_number)
+
+
+def fetch_batch(metas, document_numbers):
+    """Concurrently fetch the XML for a batch of documents. Returns arguments
+    for `process_document`, skipping documents which couldn't be fetched"""
+    sources = web.map_concurrently(
+        lambda document_number: fetch_sources(document_number,
+                                              metas[document_number]),
+        document_numbers)
+    return [(document_number, metas[document_number], doc_sources)
+            for document_number, doc_sources in zip(document_numbers, sources)
+            if doc_sources is not None]
+
+
+@click.command()
+@click.argument('cfr_title', type=int)
+@click.argument('cfr_part', type=int)
+@click.option('--workers', type=int, default=1,
+              help='Number of processes to preprocess notices with')
+@click.option('--all', 'process_all', is_flag=True, default=False,
+              help='Preprocess every notice, including those which are up '
+                   'to date')
+def preprocess_notices(cfr_title, cfr_part, workers, process_all):
+    """Preprocess all final rules for a regulation, i.e. those which
+    `versions` will need. Equivalent to running `preprocess_notice` for each,
+    but notice XML is fetched concurrently and transformed in parallel"""
+    metas = {}
+    for result in federalregister.fetch_notice_json(cfr_title, cfr_part,
+                                                    only_final=True):
+        if result.get('full_text_xml_url'):
+            metas[result['document_number']] = result
+        else:
+            logging.warning("No XML for %s", result['document_number'])
+    document_numbers = sorted(metas)
+
+    with dependency.Graph() as deps:
+        if not process_all:
+            document_numbers = list(stale_document_numbers(document_numbers,
+                                                           deps))
+        click.echo("Preprocessing {} notices".format(len(document_numbers)))
+
+        pool = Pool(workers) if workers > 1 else None
+        try:
+            for batch in batches(document_numbers, BATCH_SIZE):
+                batch_args = fetch_batch(metas, batch)
+                if pool:
+                    results = pool.imap_unordered(process_document,
+                                                  batch_args)
+                else:
+                    results = map(process_document, batch_args)
+                for written in results:
+                    for notice_path, source, source_is_local in written:
+                        if source_is_local:
+                            deps.add(notice_path, source)
+                        deps.refresh(notice_path)
+        finally:
+            if pool:
+                pool.terminate()
+                pool.join()
+
+
+class NoticeResolver(DependencyResolver):
+    """Preprocesses the missing notice. Notices tend to be needed together,
+    so if settings.BULK_NOTICE_WORKERS is set, we instead preprocess all
+    final rules for the regulations it affects, falling back to the single
+    notice"""
+    PATH_PARTS = entry.Notice.PREFIX + (
+        '(?P<doc_number>[a-zA-Z0-9-_]+)',)
+
+    @property
+    def SEQUENTIAL(self):
+        """Once one bulk resolution has run, the other notices are likely
+        present"""
+        return bool(settings.BULK_NOTICE_WORKERS)
+
+    def resolution(self):
+        version_id = self.match.group('doc_number')
+        # Split notices are named after the original document
+        document_number = version_id.split('_')[0]
+        if settings.BULK_NOTICE_WORKERS:
+            meta = federalregister.meta_data(document_number,
+                                             ['cfr_references'])
+            for reference in meta.get('cfr_references') or []:
+                if reference.get('title') and reference.get('part'):
+                    preprocess_notices.main(
+                        [str(reference['title']), str(reference['part']),
+                         '--workers', str(settings.BULK_NOTICE_WORKERS)],
+                        standalone_mode=False)
+        if version_id not in entry.Notice():
+            preprocess_notice.main([document_number], standalone_mode=False)
@@ -66,13 +66,13 @@ def write_if_needed(cfr_title, cfr_part, version_ids, xmls, delays):
     because their dependency has been updated) are written to disk. If any
     dependency is missing, an exception is raised"""
     version_dir = entry.Version(cfr_title, cfr_part)
-    deps = generate_dependencies(version_dir, version_ids, delays)
-    for version_id in version_ids:
-        version_entry = version_dir / version_id
-        deps.validate_for(version_entry)
-        if deps.is_stale(version_entry):
-            write_to_disk(xmls[version_id], version_entry,
-                          delays.get(version_id))
+    with generate_dependencies(version_dir, version_ids, delays) as deps:
+        for version_id in version_ids:
+            version_entry = version_dir / version_id
+            deps.validate_for(version_entry)
+            if deps.is_stale(version_entry):
+                write_to_disk(xmls[version_id], version_entry,
+                              delays.get(version_id))
 
 
 @click.command()
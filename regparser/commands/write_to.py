@@ -1,57 +1,185 @@
+import hashlib
+
 import click
 
-from regparser.api_writer import Client
+from regparser.api_writer import APIWriteContent, Client
+from regparser.diff.compose import compose_changes
 from regparser.index import entry
+from regparser.tree.struct import walk
+
+
+class Manifest(object):
+    """Tracks the content hash of each document successfully uploaded to an
+    API, so that unchanged documents need not be sent again"""
+    def __init__(self, output, write_all=False):
+        # Outputs may be URLs, etc., so we key by their hash
+        key = hashlib.sha256(output).hexdigest()
+        self.entry = entry.WriteManifest(key)
+        if write_all or key not in entry.WriteManifest():
+            self.hashes = {}
+        else:
+            self.hashes = self.entry.read()
+        self.pending = {}
+        self.skipped = 0
+
+    def write(self, writer, content, description):
+        """Write the content unless it's unchanged since the last run. The
+        body is encoded once; we hash exactly what is sent"""
+        body = writer.encode(content)
+        digest = hashlib.sha256(body).hexdigest()
+        if self.hashes.get(writer.path) == digest:
+            self.skipped += 1
+        else:
+            click.echo("Writing " + description)
+            writer.write_encoded(body)
+            self.pending[writer.path] = digest
+
+    def save(self, failures):
+        """Record the writes which were successful"""
+        failed = set(path for path, _ in failures)
+        self.hashes.update((path, digest)
+                           for path, digest in self.pending.items()
+                           if path not in failed)
+        self.pending = {}
+        self.entry.write(self.hashes)
+
+
+class AlwaysWrite(object):
+    """Stands in for a Manifest when writing to disk (as files or a git
+    repository). Those outputs may have been modified or removed since we
+    last wrote them, so every document is written"""
+    skipped = 0
+
+    def write(self, writer, content, description):
+        click.echo("Writing " + description)
+        writer.write(content)
+
+    def save(self, failures):
+        pass
 
 
 # The write process is split into a set of functions, each responsible for
 # writing a particular type of entity
 
-def write_trees(client, cfr_title, cfr_part):
+def write_trees(client, manifest, cfr_title, cfr_part):
     tree_dir = entry.Tree(cfr_title, cfr_part)
     for version_id in entry.Version(cfr_title, cfr_part):
         if version_id in tree_dir:
-            click.echo("Writing tree " + version_id)
             tree = (tree_dir / version_id).read()
-            client.regulation(cfr_part, version_id).write(tree)
+            manifest.write(client.regulation(cfr_part, version_id), tree,
+                           "tree " + version_id)
 
 
-def write_layers(client, cfr_title, cfr_part):
+def write_layers(client, manifest, cfr_title, cfr_part):
     for version_id in entry.Version(cfr_title, cfr_part):
         layer_dir = entry.Layer(cfr_title, cfr_part, version_id)
         for layer_name in layer_dir:
-            click.echo("Writing layer {}@{}".format(layer_name, version_id))
             layer = (layer_dir / layer_name).read()
-            client.layer(layer_name, cfr_part, version_id).write(layer)
+            manifest.write(client.layer(layer_name, cfr_part, version_id),
+                           layer,
+                           "layer {}@{}".format(layer_name, version_id))
 
 
-def write_notices(client, cfr_title, cfr_part):
+def write_notices(client, manifest, cfr_title, cfr_part):
     sxs_dir = entry.SxS()
     for version_id in entry.Version(cfr_title, cfr_part):
         if version_id in sxs_dir:
-            click.echo("Writing notice " + version_id)
             tree = (sxs_dir / version_id).read()
-            client.notice(version_id).write(tree)
+            manifest.write(client.notice(version_id), tree,
+                           "notice " + version_id)
 
 
-def write_diffs(client, cfr_title, cfr_part):
+def original_lookup(cfr_title, cfr_part, version_id):
+    """Returns a function which finds nodes (by label_id) in the requested
+    tree. The tree is only loaded if needed"""
+    nodes = {}
+
+    def lookup(label_id):
+        if not nodes:
+            tree = entry.FrozenTree(cfr_title, cfr_part, version_id).read()
+            walk(tree, lambda node: nodes.setdefault(node.label_id, node))
+        return nodes.get(label_id)
+    return lookup
+
+
+def derive_diffs(cfr_title, cfr_part, tree_ids, lhs_id, adjacent_diff):
+    """When diffs are only computed between adjacent versions (i.e. `diffs
+    --adjacent`), we derive the others by composing the chain of adjacent
+    diffs between them. `tree_ids` are the version ids with trees, in order;
+    `adjacent_diff` reads the diff between two versions, returning None if
+    it's not present. Walks outward from `lhs_id` in each direction,
+    composing one more link at a time, so each chain is folded only once.
+    Returns a dict of rhs_id -> diff, which stops (in each direction) at the
+    first missing link"""
+    lookup = original_lookup(cfr_title, cfr_part, lhs_id)
+    lhs_idx = tree_ids.index(lhs_id)
+    derived = {lhs_id: {}}
+    for chain in (tree_ids[lhs_idx:], tree_ids[lhs_idx::-1]):
+        composed = {}
+        for lhs, rhs in zip(chain, chain[1:]):
+            diff = adjacent_diff(lhs, rhs)
+            if diff is None:
+                break
+            composed = compose_changes(composed, diff, lookup)
+            derived[rhs] = composed
+    return derived
+
+
+def write_diffs(client, manifest, cfr_title, cfr_part):
+    """Write all diffs between versions. Those which aren't present in the
+    index may be derivable from diffs between adjacent versions"""
     diff_dir = entry.Diff(cfr_title, cfr_part)
     version_ids = list(entry.Version(cfr_title, cfr_part))
+    tree_dir = entry.Tree(cfr_title, cfr_part)
+    tree_ids = [version_id for version_id in version_ids
+                if version_id in tree_dir]
+    adjacent = {}
+
+    def adjacent_diff(lhs_id, rhs_id):
+        """Each adjacent diff is read at most once"""
+        if (lhs_id, rhs_id) not in adjacent:
+            container = diff_dir / lhs_id
+            adjacent[(lhs_id, rhs_id)] = (
+                (container / rhs_id).read() if rhs_id in container else None)
+        return adjacent[(lhs_id, rhs_id)]
+
     for lhs_id in version_ids:
         container = diff_dir / lhs_id
+        derived = None
         for rhs_id in version_ids:
             if rhs_id in container:
-                click.echo("Writing diff {} to {}".format(lhs_id, rhs_id))
                 diff = (container / rhs_id).read()
-                client.diff(cfr_part, lhs_id, rhs_id).write(diff)
+            elif lhs_id in tree_ids and rhs_id in tree_ids:
+                if derived is None:
+                    derived = derive_diffs(cfr_title, cfr_part, tree_ids,
+                                           lhs_id, adjacent_diff)
+                diff = derived.get(rhs_id)
+            else:
+                diff = None
+            if diff is not None:
+                manifest.write(client.diff(cfr_part, lhs_id, rhs_id), diff,
+                               "diff {} to {}".format(lhs_id, rhs_id))
 
 
 @click.command()
 @click.argument('cfr_title', type=int)
 @click.argument('cfr_part', type=int)
 @click.argument('output')
-def write_to(cfr_title, cfr_part, output):
+@click.option('--workers', type=int, default=4,
+              help='Number of concurrent uploads when writing to an API')
+@click.option('--gzip', 'gzip_bodies', is_flag=True, default=False,
+              help='Compress uploads to an API. The API must accept gzipped '
+                   'request bodies')
+@click.option('--no-indent', is_flag=True, default=False,
+              help='When writing to a directory, write compact JSON')
+@click.option('--all', 'write_all', is_flag=True, default=False,
+              help='Write all documents to an API, even those which have '
+                   'not changed since they were last sent to it')
+def write_to(cfr_title, cfr_part, output, workers, gzip_bodies, no_indent,
+             write_all):
     """Export data. Sends all data in the index to an external source.
+    When writing to an API, documents which haven't changed since they were
+    last sent to OUTPUT are skipped (unless --all is given).
 
     \b
     OUTPUT can be a
@@ -59,9 +187,26 @@ def write_to(cfr_title, cfr_part, output):
     * uri (the base url of an instance of regulations-core)
     * a directory prefixed with "git://". This will export to a git
       repository"""
-    client = Client(output)
+    client = Client(output, workers, gzip_bodies,
+                    indent=None if no_indent else 4)
+    if client.writer_class is APIWriteContent:
+        manifest = Manifest(output, write_all)
+    else:
+        manifest = AlwaysWrite()
     cfr_part = str(cfr_part)
-    write_trees(client, cfr_title, cfr_part)
-    write_layers(client, cfr_title, cfr_part)
-    write_notices(client, cfr_title, cfr_part)
-    write_diffs(client, cfr_title, cfr_part)
+    failures = []
+    try:
+        write_trees(client, manifest, cfr_title, cfr_part)
+        write_layers(client, manifest, cfr_title, cfr_part)
+        write_notices(client, manifest, cfr_title, cfr_part)
+        write_diffs(client, manifest, cfr_title, cfr_part)
+    finally:
+        failures = client.finish()
+        manifest.save(failures)
+    if manifest.skipped:
+        click.echo("Skipped {} unchanged documents".format(manifest.skipped))
+    for path, error in failures:
+        click.echo("Failed to write {}: {}".format(path, error), err=True)
+    if failures:
+        raise click.ClickException(
+            "{} documents could not be written".format(len(failures)))
@@ -1,11 +1,19 @@
 """We need to modify content from time to time, e.g. image overrides and xml
 macros. To provide flexibility in future expansion, we provide a layer of
-indirection here."""
+indirection here.
+
+Each source is loaded once; the combined content is then held in memory (see
+`reload` to load it again)."""
 import itertools
 import logging
 
+from lxml import etree
+
 import settings
 
+# (combining function, settings key, source paths) -> combined content
+_cache = {}
+
 
 def _try_to_load(path, ident='module'):
     module, obj = path.rsplit('.', 1)
@@ -18,29 +26,59 @@ def _try_to_load(path, ident='module'):
         logging.warning("Could not load " + ident + " from " + path)
 
 
+def reload():
+    """Forget all loaded content, so that it's loaded again from its sources
+    when next needed"""
+    _cache.clear()
+
+
+def _load(settings_key, ident, combine):
+    """Load each of the sources listed in this setting, combining those which
+    exist via `combine`. The result is cached"""
+    paths = tuple(getattr(settings, settings_key, ()))
+    key = (combine, settings_key, paths)
+    if key not in _cache:
+        sources = [_try_to_load(path, ident) for path in paths]
+        _cache[key] = combine([source for source in sources if source])
+    return _cache[key]
+
+
+def _merge(sources):
+    """Combine dictionaries; earlier sources take precedence"""
+    merged = {}
+    for source in reversed(sources):
+        merged.update(source)
+    return merged
+
+
+def _chain(sources):
+    return list(itertools.chain(*sources))
+
+
+def _compile_macros(sources):
+    """Compile each macro's xpath and parse its replacement xml"""
+    return [(etree.XPath(path),
+             list(etree.fromstring('<ROOT>' + replacement + '</ROOT>')))
+            for path, replacement in _chain(sources)]
+
+
 class Macros(object):
     def __iter__(self):
-        iterators = []
-        for source in settings.MACROS_SOURCES:
-            macros = _try_to_load(source, 'macros')
-            if macros:
-                iterators.append(iter(macros))
-        return itertools.chain(*iterators)
+        return iter(_load('MACROS_SOURCES', 'macros', _chain))
+
+    def compiled(self):
+        """Macros as (compiled XPath, list of replacement elements) pairs.
+        The elements are shared, so should be copied rather than modified"""
+        return _load('MACROS_SOURCES', 'macros', _compile_macros)
 
 
 class ImageOverrides(object):
     def get(self, key, default=None):
-        for source in settings.OVERRIDES_SOURCES:
-            source = _try_to_load(source, 'overrides')
-            if source and key in source:
-                return source[key]
-        return default
+        return _load('OVERRIDES_SOURCES', 'overrides', _merge).get(
+            key, default)
 
 
 class RegPatches(object):
     def get(self, key, default=None):
-        for source in settings.REGPATCHES_SOURCES:
-            source = _try_to_load(source, 'regpatches')
-            if source and key in source:
-                return source[key]
-        return default
+        return _load('REGPATCHES_SOURCES', 'regpatches', _merge).get(
+            key, default)
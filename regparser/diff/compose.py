@@ -0,0 +1,310 @@
+"""Diffs between adjacent versions can be chained together to derive the diff
+between any two versions without loading either tree. This module contains
+the logic for combining two diffs (as generated by `diff.tree`) into one.
+
+Internally, an edit script is represented as a list of "pieces" describing
+the resulting sequence (text or list of child labels): either a range of the
+original sequence or a literal, newly inserted sequence. As we generally
+don't know the length of the original, the final range is open-ended."""
+import logging
+
+from regparser.diff.text import DELETE, EQUAL, get_opcodes, INSERT
+from regparser.diff.tree import ADDED, DELETED, MODIFIED, label_opcodes
+
+ORIGINAL, LITERAL = 'original', 'literal'
+
+
+def _flatten(opcodes):
+    """Replacements within text opcodes are encoded as a nested
+    [delete, insert] pair. Flatten these"""
+    for opcode in opcodes:
+        if isinstance(opcode[0], basestring):
+            yield opcode
+        else:
+            for sub_opcode in _flatten(opcode):
+                yield sub_opcode
+
+
+def _to_edits(opcodes):
+    """Convert opcodes into (start, end, inserted) triples, which replace the
+    original[start:end] with `inserted`. Inserted child labels may arrive as
+    tuples or lists (depending on whether they've been through JSON);
+    normalize them to lists so that pieces can be concatenated"""
+    for opcode in _flatten(opcodes):
+        if opcode[0] == DELETE:
+            yield (opcode[1], opcode[2], None)
+        elif opcode[0] == INSERT:
+            inserted = opcode[2]
+            if not isinstance(inserted, basestring):
+                inserted = list(inserted)
+            yield (opcode[1], opcode[1], inserted)
+
+
+def _to_pieces(edits):
+    """Describe the result of applying these edits as a list of pieces"""
+    pieces, position = [], 0
+    for start, end, inserted in edits:
+        if start > position:
+            pieces.append((ORIGINAL, position, start))
+        if inserted:
+            pieces.append((LITERAL, inserted))
+        position = max(position, end)
+    pieces.append((ORIGINAL, position, None))
+    return pieces
+
+
+def _slice(pieces, start, end):
+    """Pieces making up the [start:end] slice of the sequence described by
+    `pieces`. `end` may be None, indicating the rest of the sequence"""
+    result, offset = [], 0
+    for piece in pieces:
+        if piece[0] == LITERAL:
+            piece_end = offset + len(piece[1])
+        elif piece[2] is None:
+            piece_end = None
+        else:
+            piece_end = offset + piece[2] - piece[1]
+
+        low = max(start, offset)
+        if piece_end is None:
+            high = end
+        elif end is None:
+            high = piece_end
+        else:
+            high = min(end, piece_end)
+
+        if high is None or low < high:
+            if piece[0] == LITERAL:
+                result.append((LITERAL, piece[1][low - offset:high - offset]))
+            else:
+                result.append((
+                    ORIGINAL, piece[1] + low - offset,
+                    None if high is None else piece[1] + high - offset))
+
+        if piece_end is None or (end is not None and piece_end >= end):
+            break
+        offset = piece_end
+    return result
+
+
+def _compose_pieces(pieces, edits):
+    """Apply a second set of edits to the sequence described by pieces"""
+    result, position = [], 0
+    for start, end, inserted in edits:
+        if start > position:
+            result.extend(_slice(pieces, position, start))
+        if inserted:
+            result.append((LITERAL, inserted))
+        position = max(position, end)
+    result.extend(_slice(pieces, position, None))
+    return result
+
+
+def _from_pieces(pieces):
+    """Convert pieces back into (start, end, inserted) edits relative to the
+    original sequence"""
+    position, pending = 0, None
+    for piece in pieces:
+        if piece[0] == LITERAL:
+            pending = piece[1] if pending is None else pending + piece[1]
+        else:
+            if piece[1] > position or pending:
+                yield (position, piece[1], pending)
+            pending = None
+            position = piece[2]
+
+
+def _text_opcodes(edits):
+    """Render edits in the format of `text.get_opcodes`"""
+    for start, end, inserted in edits:
+        deletion = (DELETE, start, end)
+        insertion = (INSERT, start, inserted)
+        if end > start and inserted:
+            yield [deletion, insertion]
+        elif end > start:
+            yield deletion
+        elif inserted:
+            yield insertion
+
+
+def _child_opcodes(edits, length):
+    """Render edits in the format of `tree.label_opcodes`"""
+    position = 0
+    for start, end, inserted in edits:
+        if start > position:
+            yield (EQUAL, position, start)
+        if end > start:
+            yield (DELETE, start, end)
+        if inserted:
+            yield (INSERT, start, list(inserted))
+        position = end
+    if length > position:
+        yield (EQUAL, position, length)
+
+
+def _child_ops_length(child_ops):
+    """The child opcodes cover the full original list of children, so we
+    can determine its length"""
+    ends = [op[2] for op in child_ops if op[0] in (DELETE, EQUAL)]
+    ends.extend(op[1] for op in child_ops if op[0] == INSERT)
+    return max(ends or [0])
+
+
+def compose_text_opcodes(first, second):
+    """Given text opcodes converting A to B and B to C, derive opcodes which
+    convert A to C"""
+    pieces = _compose_pieces(_to_pieces(_to_edits(first)), _to_edits(second))
+    return list(_text_opcodes(_from_pieces(pieces)))
+
+
+def compose_child_opcodes(first, second):
+    """Given child label opcodes converting A to B and B to C, derive opcodes
+    which convert A to C"""
+    pieces = _compose_pieces(_to_pieces(_to_edits(first)), _to_edits(second))
+    return list(_child_opcodes(_from_pieces(pieces),
+                               _child_ops_length(first)))
+
+
+def apply_opcodes(sequence, opcodes):
+    """Apply text or child label opcodes to a sequence (string or list)"""
+    parts = []
+    for piece in _to_pieces(_to_edits(opcodes)):
+        if piece[0] == LITERAL:
+            parts.append(piece[1])
+        else:
+            parts.append(sequence[piece[1]:piece[2]])
+    if isinstance(sequence, list):
+        return [item for part in parts for item in part]
+    return u''.join(parts)
+
+
+def _is_noop(opcodes):
+    """Do these (text or child label) opcodes leave the sequence as is?"""
+    return all(opcode[0] == EQUAL for opcode in _flatten(opcodes))
+
+
+def _apply_modification(node_dict, modification):
+    """Modify the "node" data associated with an "added" change. Changes
+    don't describe the tagged text; if it mirrored the text, it can be kept
+    in step, but otherwise its markup can't be carried forward"""
+    node_dict = dict(node_dict)
+    if 'text' in modification:
+        text = node_dict['text'] or ''
+        node_dict['text'] = apply_opcodes(text, modification['text'])
+        if node_dict.get('tagged_text') == text:
+            node_dict['tagged_text'] = node_dict['text'] or None
+        elif node_dict.get('tagged_text'):
+            node_dict['tagged_text'] = None
+    if 'title' in modification:
+        node_dict['title'] = apply_opcodes(
+            node_dict['title'] or '', modification['title']) or None
+    if 'child_ops' in modification:
+        node_dict['child_labels'] = apply_opcodes(
+            list(node_dict['child_labels']), modification['child_ops'])
+    return node_dict
+
+
+def _compose_modifications(first, second):
+    """Combine two "modified" changes to the same node. Returns None if the
+    second undoes the first"""
+    result = {'op': MODIFIED}
+    for field, compose in (('text', compose_text_opcodes),
+                           ('title', compose_text_opcodes),
+                           ('child_ops', compose_child_opcodes)):
+        if field in first and field in second:
+            opcodes = compose(first[field], second[field])
+        else:
+            opcodes = first.get(field, second.get(field, []))
+        if not _is_noop(opcodes):
+            result[field] = opcodes
+    if len(result) > 1:
+        return result
+
+
+def _may_revert(change):
+    """Opcodes alone can't tell us whether a replacement restores the
+    original content, but only replacements of the same length could"""
+    for field in ('text', 'title', 'child_ops'):
+        edits = _from_pieces(_to_pieces(_to_edits(change.get(field, []))))
+        if any(end - start != len(inserted or ()) for start, end, inserted
+               in edits):
+            return False
+    return True
+
+
+def _readded(original, node_dict):
+    """A node was deleted and later re-added. Compare the original node to
+    the re-added version"""
+    result = {'op': MODIFIED}
+    text_ops = get_opcodes(original.text, node_dict['text'] or '')
+    if text_ops:
+        result['text'] = text_ops
+    title_ops = get_opcodes(original.title or '', node_dict['title'] or '')
+    if title_ops:
+        result['title'] = title_ops
+    child_labels = list(node_dict['child_labels'])
+    if list(original.child_labels) != child_labels:
+        result['child_ops'] = list(label_opcodes(list(original.child_labels),
+                                                 child_labels))
+    if len(result) > 1:
+        return result
+
+
+def _compose_one(label_id, first, second, original_lookup):
+    """Combine the changes to a single node. Returns None if the node is
+    unchanged"""
+    if first['op'] == ADDED and second['op'] == DELETED:
+        return None
+    elif first['op'] == ADDED and second['op'] == MODIFIED:
+        return {'op': ADDED,
+                'node': _apply_modification(first['node'], second)}
+    elif first['op'] == DELETED and second['op'] == ADDED:
+        original = original_lookup and original_lookup(label_id)
+        if original is None:
+            logging.warning("Cannot find original version of %s; treating "
+                            "as added", label_id)
+            return second
+        return _readded(original, second['node'])
+    elif first['op'] == MODIFIED and second['op'] == MODIFIED:
+        combined = _compose_modifications(first, second)
+        original = (combined and _may_revert(combined) and original_lookup and
+                    original_lookup(label_id))
+        if original:
+            # Compare against the original to catch changes which were
+            # reverted
+            node_dict = {'text': original.text, 'title': original.title,
+                         'child_labels': original.child_labels}
+            return _readded(original,
+                            _apply_modification(node_dict, combined))
+        return combined
+    else:   # e.g. MODIFIED then DELETED
+        return second
+
+
+def compose_changes(first, second, original_lookup=None):
+    """Given the changes (a dict of label_id -> change, as produced by
+    `diff.tree.changes_between`) from version A to version B and those from
+    version B to version C, derive the changes from version A to version C.
+    If a node was deleted and then re-added, we need its data from version
+    A; `original_lookup` is a function mapping a label_id to that node"""
+    result = dict(first)
+    for label_id, change in second.items():
+        if label_id in result:
+            combined = _compose_one(label_id, result[label_id], change,
+                                    original_lookup)
+            if combined is None:
+                del result[label_id]
+            else:
+                result[label_id] = combined
+        else:
+            result[label_id] = change
+    return result
+
+
+def compose_chain(changes_list, original_lookup=None):
+    """Combine a sequence of changes (e.g. between adjacent versions) into a
+    single set of changes between the first and last versions"""
+    result = {}
+    for changes in changes_list:
+        result = compose_changes(result, changes, original_lookup)
+    return result
@@ -1,35 +1,61 @@
-import requests
+from collections import OrderedDict
 
+from regparser import web
 from regparser.notice.build import build_notice
+import settings
 
 FR_BASE = "https://www.federalregister.gov"
-API_BASE = FR_BASE + "/api/v1/"
+API_BASE = settings.FEDERAL_REGISTER_API
 FULL_NOTICE_FIELDS = [
     "abstract", "action", "agency_names", "cfr_references", "citation",
     "comments_close_on", "dates", "document_number", "effective_on",
     "end_page", "full_text_xml_url", "html_url", "publication_date",
     "regulation_id_numbers", "start_page", "type", "volume"]
+# The API's maximum
+PER_PAGE = 1000
+# Number of documents whose search results we remember
+META_DATA_CACHE_SIZE = 5000
+
+# document_number -> meta data fields found in search results, least
+# recently used first. Searches return the same data as `meta_data` would,
+# so we needn't request it again
+_known_meta_data = OrderedDict()
 
 
 def fetch_notice_json(cfr_title, cfr_part, only_final=False,
                       max_effective_date=None):
-    """Search through all articles associated with this part. Right now,
-    limited to 1000; could use paging to fix this in the future."""
+    """Search through all articles associated with this part, following the
+    search results across as many pages as needed"""
     params = {
         "conditions[cfr][title]": cfr_title,
         "conditions[cfr][part]": cfr_part,
-        "per_page": 1000,
+        "per_page": PER_PAGE,
         "order": "oldest",
         "fields[]": FULL_NOTICE_FIELDS}
     if only_final:
         params["conditions[type][]"] = 'RULE'
     if max_effective_date:
         params["conditions[effective_date][lte]"] = max_effective_date
-    response = requests.get(API_BASE + "articles", params=params).json()
-    if 'results' in response:
-        return response['results']
-    else:
-        return []
+
+    results, page = [], 1
+    while True:
+        params["page"] = page
+        response = web.session().get(API_BASE + "articles", params=params)
+        response = response.json()
+        page_results = response.get('results') or []
+        results.extend(page_results)
+        if not page_results or not response.get('next_page_url'):
+            break
+        page += 1
+
+    for result in results:
+        if result.get('document_number'):
+            known = _known_meta_data.pop(result['document_number'], {})
+            known.update(result)
+            _known_meta_data[result['document_number']] = known
+    while len(_known_meta_data) > META_DATA_CACHE_SIZE:
+        _known_meta_data.popitem(last=False)
+    return results
 
 
 def fetch_notices(cfr_title, cfr_part, only_final=False):
@@ -42,11 +68,20 @@ def fetch_notices(cfr_title, cfr_part, only_final=False):
 
 def meta_data(document_number, fields=None):
     """Return the requested meta data for a specific Federal Register
-    document. Accounts for a bad document number by throwing an exception"""
+    document. Accounts for a bad document number by throwing an exception.
+    If all of the requested fields were present in earlier search results,
+    those are used rather than making a request"""
+    known = _known_meta_data.get(document_number, {})
+    if fields and all(field in known for field in fields):
+        # most recently used
+        _known_meta_data[document_number] = _known_meta_data.pop(
+            document_number)
+        return {field: known[field] for field in fields}
+
     url = "{}articles/{}".format(API_BASE, document_number)
     params = {}     # default fields are generally good
     if fields:
         params["fields[]"] = fields
-    response = requests.get(url, params=params)
+    response = web.session().get(url, params=params)
     response.raise_for_status()
     return response.json()
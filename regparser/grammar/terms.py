@@ -5,23 +5,22 @@ from pyparsing import (
 
 from regparser.grammar import atomic, unified
 from regparser.grammar.utils import (
-    DocLiteral, keep_pos, Marker, QuickSearchable)
+    DocLiteral, KeepPos, Marker, QuickSearchable)
 
 
 smart_quotes = QuickSearchable(
     Suppress(DocLiteral(u'“', "left-smart-quote")) +
-    SkipTo(
+    KeepPos(SkipTo(
         DocLiteral(
             u'”',
-            "right-smart-quote")).setParseAction(
-                keep_pos).setResultsName("term")
+            "right-smart-quote"))).setResultsName("term")
 )
 
 e_tag = (
     Suppress(Regex(r"<E[^>]*>")) +
-    OneOrMore(
+    KeepPos(OneOrMore(
         Word(srange("[a-zA-Z-]"))
-    ).setParseAction(keep_pos).setResultsName("term") +
+    )).setResultsName("term") +
     Suppress(Literal("</E>"))
 )
 
@@ -45,9 +44,9 @@ key_term_parser = QuickSearchable(
     LineStart() +
     Optional(Suppress(unified.any_depth_p)) +
     Suppress(Regex(r"<E[^>]*>")) +
-    OneOrMore(
+    KeepPos(OneOrMore(
         Word(srange("[a-zA-Z-,]"))
-    ).setParseAction(keep_pos).setResultsName("term") +
+    )).setResultsName("term") +
     Optional(Suppress(".")) +
     Suppress(Literal("</E>"))
 )
@@ -56,6 +55,6 @@ scope_term_type_parser = QuickSearchable(
     Marker("purposes") + Marker("of") + Optional(Marker("this")) +
     SkipTo(",").setResultsName("scope") + Literal(",") +
     Optional(Marker("the") + Marker("term")) +
-    SkipTo(Marker("means") |
-           (Marker("refers") +
-            Marker("to"))).setParseAction(keep_pos).setResultsName("term"))
+    KeepPos(SkipTo(Marker("means") |
+                   (Marker("refers") +
+                    Marker("to")))).setResultsName("term"))
@@ -1,15 +1,10 @@
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
+import heapq
 import re
 
 import pyparsing
 
 
-def keep_pos(source, location, tokens):
-    """Wrap the tokens with a class that also keeps track of the match's
-    location."""
-    return (WrappedResult(tokens, location, pyparsing.getTokensEndLoc()),)
-
-
 Position = namedtuple('Position', ['start', 'end'])
 
 
@@ -24,6 +19,23 @@ class WrappedResult():
         return getattr(self.tokens, attr)
 
 
+class KeepPos(pyparsing.ParseElementEnhance):
+    """Wrap the tokens matched by a grammar with a class that also keeps
+    track of the match's location. Unlike a parse action (which is only told
+    where the match starts) this sees where the match ends without needing
+    `pyparsing.getTokensEndLoc`, which is very slow as it uses
+    `inspect.stack`"""
+    def __init__(self, expr):
+        super(KeepPos, self).__init__(expr)
+        # A single wrapped result, even if the grammar returns a list
+        self.saveAsList = False
+
+    def parseImpl(self, instring, loc, doActions=True):
+        end, tokens = super(KeepPos, self).parseImpl(instring, loc,
+                                                     doActions)
+        return end, [WrappedResult(tokens, loc, end)]
+
+
 class DocLiteral(pyparsing.Literal):
     """Setting an objects name to a unicode string causes Sphinx to freak
     out. Instead, we'll replace with the provided (ascii) text."""
@@ -82,20 +94,28 @@ class QuickSearchable(pyparsing.ParseElementEnhance):
         while search_idx < len(instring):
             match = self.re.search(instring, search_idx)
             if match:
-                try:
-                    pre_loc = self.expr.preParse(instring, match.start())
-                    next_loc, tokens = self.expr._parse(
-                        instring, match.start(), callPreParse=False)
-                    if next_loc > match.start():
-                        yield tokens, pre_loc, next_loc
-                        search_idx = next_loc
-                    else:
-                        search_idx += 1
-                except pyparsing.ParseException:
+                result = self.parse_at(instring, match.start())
+                if result:
+                    yield result
+                    search_idx = result[2]
+                else:
                     search_idx = match.start() + 1
             else:
                 search_idx = len(instring)
 
+    def parse_at(self, instring, loc):
+        """Attempt to parse the grammar starting at this index. Returns a
+        (tokens, start, end) triple, as `scanString` would, or None if the
+        grammar does not match here"""
+        try:
+            pre_loc = self.expr.preParse(instring, loc)
+            next_loc, tokens = self.expr._parse(instring, loc,
+                                                callPreParse=False)
+        except pyparsing.ParseException:
+            return None
+        if next_loc > loc:
+            return tokens, pre_loc, next_loc
+
     @staticmethod
     def initial_regex(grammar):
         """Given a Pyparsing grammar, derive a set of suitable initial regular
@@ -122,7 +142,8 @@ class QuickSearchable(pyparsing.ParseElementEnhance):
         elif isinstance(grammar, (pyparsing.MatchFirst, pyparsing.Or)):
             return reduce(lambda so_far, expr: so_far | recurse(expr),
                           grammar.exprs, set())
-        elif isinstance(grammar, (pyparsing.Suppress, QuickSearchable)):
+        elif isinstance(grammar,
+                        (pyparsing.Suppress, QuickSearchable, KeepPos)):
             return recurse(grammar.expr)
         elif isinstance(grammar, (pyparsing.Regex, pyparsing.Word)):
             return set([grammar.reString])
@@ -134,3 +155,52 @@ class QuickSearchable(pyparsing.ParseElementEnhance):
         else:
             raise Exception("Unknown grammar type: {}".format(
                 grammar.__class__))
+
+
+class MultiSearchable(object):
+    """Searching a string for many QuickSearchable grammars one after another
+    means one pass over that string per grammar. This instead makes a single
+    pass, visiting candidate indices (i.e. where a grammar's initial regex
+    matches) in order. Only the grammars whose initial regex matched are
+    parsed at each candidate; grammars which share an initial regex share
+    its search."""
+    def __init__(self, grammars):
+        self.grammars = list(grammars)
+        by_regex = OrderedDict()
+        for idx, grammar in enumerate(self.grammars):
+            by_regex.setdefault(grammar.reString, []).append(idx)
+        self.regexes = [(self.grammars[idxs[0]].re, idxs)
+                        for idxs in by_regex.values()]
+
+    def scan(self, instring):
+        """Equivalent to `[list(g.scanString(instring)) for g in grammars]`,
+        i.e. a list of (tokens, start, end) triples per grammar. As with
+        `scanString`, a grammar's matches don't overlap each other, though
+        they may overlap those of other grammars"""
+        results = [[] for _ in self.grammars]
+        # Index at which each grammar may next match
+        next_locs = [0] * len(self.grammars)
+        # (candidate index, position in self.regexes)
+        candidates = []
+
+        def search(regex_idx, search_idx):
+            if search_idx < len(instring):
+                match = self.regexes[regex_idx][0].search(instring,
+                                                          search_idx)
+                if match:
+                    heapq.heappush(candidates, (match.start(), regex_idx))
+
+        for regex_idx in range(len(self.regexes)):
+            search(regex_idx, 0)
+        while candidates:
+            loc, regex_idx = heapq.heappop(candidates)
+            idxs = self.regexes[regex_idx][1]
+            for idx in idxs:
+                if next_locs[idx] <= loc:
+                    result = self.grammars[idx].parse_at(instring, loc)
+                    if result:
+                        results[idx].append(result)
+                        next_locs[idx] = result[2]
+            search(regex_idx,
+                   max(loc + 1, min(next_locs[idx] for idx in idxs)))
+        return results
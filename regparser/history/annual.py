@@ -4,11 +4,10 @@ import logging
 import os
 import re
 
-import requests
-
+from regparser import web
 from regparser.federalregister import fetch_notice_json
 from regparser.history.delays import modify_effective_dates
-from regparser.index import xml_sync
+from regparser.index import entry, xml_sync
 from regparser.notice.build import build_notice
 from regparser.tree.xml_parser.xml_wrapper import XMLWrapper
 import settings
@@ -19,23 +18,50 @@ CFR_BULK_URL = ("https://www.gpo.gov/fdsys/bulkdata/CFR/{year}/title-{title}/"
 CFR_PART_URL = ("https://www.gpo.gov/fdsys/pkg/"
                 "CFR-{year}-title{title}-vol{volume}/xml/"
                 "CFR-{year}-title{title}-vol{volume}-part{part}.xml")
+# The <PARTS> tag is near the beginning of each (very large) volume, so we
+# only read this much of it
+HEAD_BYTES = 64 * 1024
 
 
 class Volume(namedtuple('Volume', ['year', 'title', 'vol_num'])):
     def __init__(self, year, title, vol_num):
         super(Volume, self).__init__(year, title, vol_num)
         self.url = CFR_BULK_URL.format(year=year, title=title, volume=vol_num)
-        self._response, self._exists, self._part_span = None, None, None
-
-    @property
-    def response(self):
-        if self._response is None:
-            self._response = requests.get(self.url, stream=True)
-        return self._response
+        self._head, self._exists, self._part_span = None, None, None
+
+    @classmethod
+    def with_part_span(cls, year, title, vol_num, part_span):
+        """A volume which is known to exist and cover these parts (e.g. from
+        an earlier run), so we needn't request it"""
+        volume = cls(year, title, vol_num)
+        volume._exists, volume._part_span = True, part_span
+        return volume
+
+    def _fetch_head(self):
+        """Request only the beginning of the volume, closing the connection
+        once we've read it. Servers which ignore the Range header will send
+        the whole file, so we also stop reading after HEAD_BYTES"""
+        response = web.session(cached=False).get(
+            self.url, stream=True,
+            headers={'Range': 'bytes=0-{}'.format(HEAD_BYTES - 1)})
+        try:
+            self._exists = response.status_code in (200, 206)
+            chunks, size = [], 0
+            if self._exists:
+                for chunk in response.iter_content(8 * 1024):
+                    chunks.append(chunk)
+                    size += len(chunk)
+                    if size >= HEAD_BYTES:
+                        break
+            self._head = ''.join(chunks)[:HEAD_BYTES]
+        finally:
+            response.close()
 
     @property
     def exists(self):
-        return self.response.status_code == 200
+        if self._exists is None:
+            self._fetch_head()
+        return self._exists
 
     @property
     def part_span(self):
@@ -44,7 +70,9 @@ class Volume(namedtuple('Volume', ['year', 'title', 'vol_num'])):
             self._part_span = False
             part_string = ''
 
-            for line in self.response.iter_lines():
+            if self._head is None:
+                self._fetch_head()
+            for line in self._head.splitlines():
                 if '<PARTS>' in line:
                     part_string = line
                     break
@@ -89,7 +117,7 @@ class Volume(namedtuple('Volume', ['year', 'title', 'vol_num'])):
             if os.path.isfile(xml_path):
                 with open(xml_path) as f:
                     return XMLWrapper(f.read(), xml_path)
-        response = requests.get(url)
+        response = web.session().get(url)
         if response.status_code == 200:
             return XMLWrapper(response.content, url)
 
@@ -122,17 +150,50 @@ def date_of_annual_after(title, eff_date):
         return publication_date.replace(year=eff_date.year + 1)
 
 
+def _probe(volume):
+    """Fetch the beginning of the volume (if needed), returning it"""
+    if volume.exists:
+        volume.part_span
+    return volume
+
+
 def find_volume(year, title, part):
     """Annual editions have multiple volume numbers. Try to find the volume
-    that we care about"""
-    vol_num = 1
-    volume = Volume(year, title, vol_num)
-    while volume.exists:
-        if volume.should_contain(part):
-            return volume
+    that we care about. The part spans of volumes we've seen before are
+    stored in the index; others are probed several at a time"""
+    spans_entry = entry.VolumeSpans(year, title)
+    spans = {}
+    if str(title) in entry.VolumeSpans(year):
+        spans = spans_entry.read()
+    volumes = {int(vol_num): Volume.with_part_span(
+        year, title, int(vol_num), tuple(span) if span else span)
+        for vol_num, span in spans.items()}
+
+    found, vol_num, probed_any = None, 1, False
+    while found is None:
+        if vol_num not in volumes:
+            # Probe this and the next few volumes at once
+            batch = range(vol_num, vol_num + max(settings.HTTP_WORKERS, 1))
+            to_probe = [num for num in batch if num not in volumes]
+            probed = web.map_concurrently(
+                lambda num: _probe(Volume(year, title, num)), to_probe)
+            for num, volume in zip(to_probe, probed):
+                volumes[num] = volume
+                # Only existing volumes are recorded; missing volumes may
+                # yet be published
+                if volume.exists:
+                    spans[str(num)] = volume.part_span
+                    probed_any = True
+
+        if not volumes[vol_num].exists:
+            found = False
+        elif volumes[vol_num].should_contain(part):
+            found = volumes[vol_num]
         vol_num += 1
-        volume = Volume(year, title, vol_num)
-    return None
+
+    if probed_any:
+        spans_entry.write(spans)
+    return found or None
 
 
 def first_notice_and_xml(title, part):
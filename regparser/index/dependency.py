@@ -1,8 +1,11 @@
+import atexit
+from collections import defaultdict
 from contextlib import contextmanager
+import hashlib
 import os
 import shelve
-
-from dagger import dagger
+import sqlite3
+import whichdb
 
 from . import ROOT
 
@@ -16,59 +19,300 @@ class Missing(Exception):
         self.key = key
 
 
+# Graphs which may have unsaved dependencies. These are strong references:
+# a graph which hasn't been closed must survive until it has been flushed
+_open_graphs = set()
+
+
+@atexit.register
+def flush_open_graphs():
+    """Save the buffered dependencies of all graphs in this process"""
+    for graph in list(_open_graphs):
+        graph.flush()
+
+
+def written(entry):
+    """Notify the graphs open in this process that an entry has been
+    (re-)written"""
+    for graph in list(_open_graphs):
+        graph.built(entry)
+
+
+def file_digest(path):
+    """Hash a file's contents"""
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
 class Graph(object):
     """Track dependencies between input and output files, storing them in
-    `dependencies.db` for later retrieval. This lets us know that an output
-    with dependencies needs to be updated if those dependencies have been
-    updated"""
-    DB_FILE = os.path.join(ROOT, "dependencies.db")
+    `dependencies.sqlite` for later retrieval. This lets us know that an
+    output with dependencies needs to be updated if those dependencies have
+    been updated.
+
+    A single database connection is held for the lifetime of the graph. New
+    dependencies are buffered and written in a single transaction before the
+    graph is next queried (or when `flush` is called).
+
+    Staleness is computed lazily: only the files upstream of a queried entry
+    are inspected, and results (including file modification times) are
+    cached. Adding a dependency only invalidates the results downstream of
+    the new edge.
+
+    "Updated" refers to content rather than modification time. Whenever an
+    output is known to be up to date, we record digests of its inputs; it
+    only becomes stale if one of those digests changes. Outputs without such
+    a record (or which have been modified since it was made) fall back to
+    comparing modification times"""
+    DB_FILE = os.path.join(ROOT, "dependencies.sqlite")
+    # Dependencies used to be stored in a shelve file; these are imported
+    LEGACY_DB_FILE = os.path.join(ROOT, "dependencies.db")
 
     def __init__(self):
         if not os.path.exists(ROOT):
             os.makedirs(ROOT)
-        self.dag = dagger()
-        self._ran = False
+        self._dependencies = defaultdict(set)
+        self._dependents = defaultdict(set)
+        self._mtimes = {}
+        self._stale = {}
+        self._pending = []
+        # path -> (mtime, size, digest) for files we've hashed
+        self._digests, self._pending_digests = {}, {}
+        # (output, input) -> (output's mtime, input's digest) from when the
+        # output was last known to be up to date
+        self._built, self._pending_built = {}, {}
+        # Forked (worker) processes open their own connection
+        self._pid = self._connection_pid = os.getpid()
+        self._connection = self._connect()
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS dependency ("
+                "output TEXT NOT NULL, input TEXT NOT NULL, "
+                "PRIMARY KEY (output, input))")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS digest ("
+                "path TEXT PRIMARY KEY, mtime REAL NOT NULL, "
+                "size INTEGER NOT NULL, digest TEXT NOT NULL)")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS built ("
+                "output TEXT NOT NULL, input TEXT NOT NULL, "
+                "output_mtime REAL NOT NULL, input_digest TEXT NOT NULL, "
+                "PRIMARY KEY (output, input))")
+        self._import_legacy()
+
+        rows = self._connection.execute("SELECT output, input FROM dependency")
+        for output, input_ in rows:
+            self._dependencies[output].add(input_)
+            self._dependents[input_].add(output)
+        rows = self._connection.execute(
+            "SELECT path, mtime, size, digest FROM digest")
+        for path, mtime, size, digest in rows:
+            self._digests[path] = (mtime, size, digest)
+        rows = self._connection.execute(
+            "SELECT output, input, output_mtime, input_digest FROM built")
+        for output, input_, output_mtime, input_digest in rows:
+            self._built[(output, input_)] = (output_mtime, input_digest)
+        _open_graphs.add(self)
+
+    def _connect(self):
+        connection = sqlite3.connect(self.DB_FILE)
+        # Write-ahead logging allows concurrent readers (and workers)
+        connection.execute("PRAGMA journal_mode=WAL")
+        return connection
+
+    def _db(self):
+        """The database connection for this process. A connection can't be
+        shared with forked processes, so workers open their own"""
+        if self._connection_pid != os.getpid():
+            self._connection = self._connect()
+            self._connection_pid = os.getpid()
+        return self._connection
 
-        with self.dependency_db() as db:
-            for key, dependencies in db.items():
-                self.dag.add(key, dependencies)
+    def _import_legacy(self):
+        """If the dependencies are only present in the old, shelve-based
+        format, copy them over"""
+        empty = not self._connection.execute(
+            "SELECT 1 FROM dependency LIMIT 1").fetchall()
+        # shelve's backend may add its own file suffixes
+        if empty and whichdb.whichdb(self.LEGACY_DB_FILE):
+            legacy = shelve.open(self.LEGACY_DB_FILE, 'r')
+            try:
+                self._pending.extend(
+                    (output, input_) for output, inputs in legacy.items()
+                    for input_ in inputs)
+            finally:
+                legacy.close()
+            self.flush()
+
+    def flush(self):
+        """Write all buffered dependencies and digests in a single
+        transaction"""
+        if self._pending or self._pending_digests or self._pending_built:
+            connection = self._db()
+            with connection:
+                connection.executemany(
+                    "INSERT OR IGNORE INTO dependency (output, input) "
+                    "VALUES (?, ?)", self._pending)
+                connection.executemany(
+                    "INSERT OR REPLACE INTO digest (path, mtime, size, "
+                    "digest) VALUES (?, ?, ?, ?)",
+                    [(path,) + value
+                     for path, value in self._pending_digests.items()])
+                connection.executemany(
+                    "INSERT OR REPLACE INTO built (output, input, "
+                    "output_mtime, input_digest) VALUES (?, ?, ?, ?)",
+                    [key + value
+                     for key, value in self._pending_built.items()])
+            self._pending = []
+            self._pending_digests, self._pending_built = {}, {}
+
+    def close(self):
+        """Save any remaining dependencies and release the database"""
+        self.flush()
+        self._db().close()
+        _open_graphs.discard(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
     @contextmanager
     def dependency_db(self):
-        """Python 2 doesn't have a context manager for shelve.open, so we've
-        created one"""
-        db = shelve.open(self.DB_FILE)
-        try:
-            yield db
-        finally:
-            db.close()
+        """Provides a snapshot of all known dependencies, as a dict of output
+        to the set of its inputs"""
+        self.flush()
+        graph = defaultdict(set)
+        rows = self._db().execute("SELECT output, input FROM dependency")
+        for output, input_ in rows:
+            graph[output].add(input_)
+        yield dict(graph)
 
     def add(self, output_entry, input_entry):
         """Add a dependency where output tuple relies on input_tuple"""
-        self._ran = False
         from_str, to_str = str(output_entry), str(input_entry)
+        if to_str in self._dependencies.get(from_str, ()):
+            return
+
+        self._dependencies[from_str].add(to_str)
+        self._dependents[to_str].add(from_str)
+        self._pending.append((from_str, to_str))
+        self._invalidate(from_str)
+
+    def _invalidate(self, key):
+        """Forget the staleness of this key and everything which depends on
+        it"""
+        to_visit = [key]
+        while to_visit:
+            key = to_visit.pop()
+            if key in self._stale:
+                del self._stale[key]
+                to_visit.extend(self._dependents.get(key, ()))
+
+    def refresh(self, entry=None):
+        """Forget cached file information, e.g. because a file has been
+        modified outside of this graph. If no entry is provided, all cached
+        information is dropped"""
+        if entry is None:
+            self._mtimes, self._stale = {}, {}
+        else:
+            key = str(entry)
+            self._mtimes.pop(key, None)
+            # The key may not be cached itself, but its dependents may be
+            self._stale[key] = None
+            self._invalidate(key)
+
+    def built(self, entry):
+        """An entry has just been (re-)written, presumably from its current
+        inputs. Record their digests. Worker processes may be terminated
+        without flushing, so they save these records immediately"""
+        key = str(entry)
+        if key in self._dependencies or key in self._dependents:
+            self.refresh(key)
+            self._record(key)
+            if os.getpid() != self._pid:
+                self.flush()
+
+    def _record(self, key):
+        """Note the digests of this key's inputs, as the key is known to be
+        up to date"""
+        mtime = self._mtime(key)
+        for dependency in self._dependencies.get(key, ()):
+            digest = self._digest(dependency)
+            if mtime is not None and digest is not None:
+                value = (mtime, digest)
+                if self._built.get((key, dependency)) != value:
+                    self._built[(key, dependency)] = value
+                    self._pending_built[(key, dependency)] = value
+
+    def _mtime(self, key):
+        """Modification time of a file, or None if it does not exist"""
+        if key not in self._mtimes:
+            try:
+                self._mtimes[key] = os.path.getmtime(key)
+            except OSError:
+                self._mtimes[key] = None
+        return self._mtimes[key]
+
+    def _digest(self, key):
+        """Digest of a file's contents, or None if it does not exist. Digests
+        are only recomputed if the file's modification time or size have
+        changed"""
+        mtime = self._mtime(key)
+        if mtime is None:
+            return None
+        cached_mtime, cached_size, digest = self._digests.get(
+            key, (None, None, None))
+        try:
+            size = os.path.getsize(key)
+            if (cached_mtime, cached_size) != (mtime, size):
+                digest = file_digest(key)
+        except (IOError, OSError):
+            # Removed since we looked at its modification time
+            return None
+        if (cached_mtime, cached_size) != (mtime, size):
+            value = (mtime, size, digest)
+            self._digests[key] = self._pending_digests[key] = value
+        return digest
 
-        self.dag.add(from_str, [to_str])
-        with self.dependency_db() as db:
-            deps = db.get(from_str, set())
-            deps.add(to_str)
-            db[from_str] = deps
+    def _input_changed(self, key, dependency):
+        """Has this input changed since the (existing) output was built? If
+        we know which version of the input the output was built from, compare
+        contents; otherwise, compare modification times"""
+        mtime = self._mtime(key)
+        output_mtime, digest = self._built.get((key, dependency), (None, None))
+        if output_mtime == mtime:
+            return self._digest(dependency) != digest
+        return mtime < self._mtime(dependency)
 
-    def _run_if_needed(self):
-        if not self._ran:
-            self.dag.run()
-            self._ran = True
+    def _is_stale(self, key):
+        """A file is stale if it is missing, if any of its dependencies are
+        stale, or if any of its dependencies have changed since it was
+        built"""
+        if key not in self._stale:
+            self._stale[key] = False    # guard against cycles
+            stale = self._mtime(key) is None or any(
+                self._is_stale(dependency) or
+                self._input_changed(key, dependency)
+                for dependency in self._dependencies.get(key, ()))
+            if not stale:
+                self._record(key)
+            self._stale[key] = stale
+        return self._stale[key]
 
     def validate_for(self, entry):
         """Raise an exception if a particular output has stale dependencies"""
-        self._run_if_needed()
+        self.flush()
         key = str(entry)
-        with self.dependency_db() as db:
-            for dependency in db[key]:
-                if self.dag.get(dependency).stale:
-                    raise Missing(key, dependency)
+        for dependency in self._dependencies.get(key, ()):
+            if self._is_stale(dependency):
+                raise Missing(key, dependency)
 
     def is_stale(self, entry):
         """Determine if a file needs to be rebuilt"""
-        self._run_if_needed()
-        return bool(self.dag.get(str(entry)).stale)
+        self.flush()
+        return self._is_stale(str(entry))
@@ -1,14 +1,18 @@
+import hashlib
 import json
 import logging
 import os
+import weakref
 
 from regparser.history.versions import Version as VersionStruct
 from regparser.notice.encoder import AmendmentEncoder
 from regparser.notice.xml import NoticeXML
 from regparser.tree.struct import (
-    frozen_node_decode_hook, full_node_decode_hook, FullNodeEncoder)
+    frozen_node_decode_hook, FrozenNode, full_node_decode_hook,
+    FullNodeEncoder, LazyXML, Node, serialized_source_xml)
 from regparser.tree.xml_parser.xml_wrapper import XMLWrapper
-from . import ROOT
+import settings
+from . import dependency, formats, ROOT
 
 
 class Entry(object):
@@ -32,13 +36,46 @@ class Entry(object):
         """Create the requisite directories if needed"""
         path = os.path.join(*(self.PREFIX + self._path[:-1]))
         if not os.path.exists(path):
-            os.makedirs(path)
+            try:
+                os.makedirs(path)
+            except OSError:
+                # Another process may have created it in the meantime
+                if not os.path.isdir(path):
+                    raise
 
     def write(self, content):
+        """Write to a temporary file and then move it into place, so that
+        readers (possibly in other processes) never see a partial entry. If
+        the entry already has identical contents, the file (including its
+        modification time) is left alone, so entries which depend on it stay
+        up to date. Either way, open dependency graphs record that the entry
+        has been built from its current inputs"""
         self._create_parent_dir()
-        with open(str(self), "w") as f:
-            f.write(self.serialize(content))
-            logging.info("Wrote {}".format(str(self)))
+        path = str(self)
+        serialized = self.serialize(content)
+        if self._has_contents(serialized):
+            logging.info("Unchanged {}".format(path))
+        else:
+            dirname, filename = os.path.split(path)
+            tmp_path = os.path.join(
+                dirname, '.{}.{}.tmp'.format(filename, os.getpid()))
+            with open(tmp_path, "w") as f:
+                f.write(serialized)
+            os.rename(tmp_path, path)
+            logging.info("Wrote {}".format(path))
+        dependency.written(self)
+
+    def _has_contents(self, serialized):
+        """Does the existing file match these serialized contents?"""
+        path = str(self)
+        if not os.path.exists(path):
+            return False
+        if isinstance(serialized, unicode):
+            serialized = serialized.encode('utf-8')
+        if os.path.getsize(path) != len(serialized):
+            return False
+        with open(path) as f:
+            return f.read() == serialized
 
     def serialize(self, content):
         """Default implementation; treat content as a string"""
@@ -54,11 +91,13 @@ class Entry(object):
         return content
 
     def __iter__(self):
-        """All sub-entries, i.e. the directory contents, as strings"""
+        """All sub-entries, i.e. the directory contents, as strings. Hidden
+        files (e.g. in-progress writes) are skipped"""
         if not os.path.exists(str(self)):
             return iter([])
         else:
-            return iter(sorted(os.listdir(str(self))))
+            return iter(sorted(name for name in os.listdir(str(self))
+                               if not name.startswith('.')))
 
     def __len__(self):
         return len(list(self.__iter__()))
@@ -105,28 +144,136 @@ class Version(Entry):
 
 
 class _JSONEntry(Entry):
-    """Base class for importing/exporting JSON"""
+    """Base class for importing/exporting JSON-like data. This is stored in
+    the format configured by settings.INDEX_FORMAT"""
     JSON_ENCODER = json.JSONEncoder
     JSON_DECODER = None
 
     def serialize(self, content):
-        return self.JSON_ENCODER(
-            sort_keys=True, indent=4, separators=(', ', ': ')).encode(content)
+        return formats.dumps(content, self.JSON_ENCODER)
+
+    def deserialize(self, content):
+        return formats.loads(content, object_hook=self.JSON_DECODER)
+
+
+class NodeRecord(Entry):
+    """Content-addressed storage of individual nodes, keyed by node_record.
+    Each record is keyed by a hash of its contents, which include the hashes
+    of its children (i.e. this is a Merkle tree). Nodes which do not change
+    between versions are therefore stored only once. In the compact format,
+    records are arrays of FIELDS (a fixed ordering keeps hashes stable)"""
+    PREFIX = (ROOT, 'node_record')
+    FIELDS = ('children', 'label', 'node_type', 'source_xml', 'tagged_text',
+              'text', 'title')
 
     def deserialize(self, content):
-        return json.loads(content, object_hook=self.JSON_DECODER)
+        record = formats.loads(content)
+        if isinstance(record, list):
+            record = dict(zip(self.FIELDS, record))
+        return record
+
+    @classmethod
+    def for_hash(cls, record_hash):
+        """Records are spread across subdirectories to keep directory sizes
+        manageable"""
+        return cls(record_hash[:2], record_hash)
+
+    @classmethod
+    def store(cls, node):
+        """Store this node and all of its descendants, returning the root's
+        hash. Records which already exist are not re-written"""
+        record = {
+            'children': [cls.store(child) for child in node.children],
+            'label': node.label,
+            'node_type': node.node_type,
+            'source_xml': serialized_source_xml(node),
+            'tagged_text': getattr(node, 'tagged_text', None),
+            'text': node.text,
+            'title': node.title,
+        }
+        if settings.INDEX_FORMAT == 'json':
+            content = json.dumps(record, sort_keys=True,
+                                 separators=(',', ':'))
+        else:
+            content = formats.dumps([record[field] for field in cls.FIELDS])
+        record_hash = hashlib.sha256(content).hexdigest()
+        path = cls.for_hash(record_hash)
+        if not os.path.exists(str(path)):
+            path.write(content)
+        return record_hash
+
+    @classmethod
+    def load_node(cls, record_hash):
+        """Load a full (mutable) Node and its descendants"""
+        record = cls.for_hash(record_hash).read()
+        children = [cls.load_node(child) for child in record['children']]
+        source_xml = record['source_xml']
+        if source_xml:
+            # Parsing is deferred until the XML is needed
+            source_xml = LazyXML(source_xml.encode('utf-8'))
+        node = Node(record['text'], children, record['label'],
+                    record['title'], record['node_type'], source_xml)
+        if record['tagged_text']:
+            node.tagged_text = record['tagged_text']
+        return node
+
+    # Recently loaded FrozenNodes, keyed by record hash. As these are weak
+    # references, subtrees shared between loaded versions need not be
+    # re-read, but nodes are dropped once no longer in use
+    _frozen_nodes = weakref.WeakValueDictionary()
+
+    @classmethod
+    def load_frozen_node(cls, record_hash):
+        """Load a FrozenNode and its descendants, reusing any which are still
+        in memory"""
+        node = cls._frozen_nodes.get(record_hash)
+        if node is None:
+            record = cls.for_hash(record_hash).read()
+            node = FrozenNode(
+                text=record['text'],
+                children=[cls.load_frozen_node(child)
+                          for child in record['children']],
+                label=record['label'], title=record['title'],
+                node_type=record['node_type'],
+                tagged_text=record['tagged_text']).prototype()
+            cls._frozen_nodes[record_hash] = node
+        return node
 
 
 class Tree(_JSONEntry):
-    """Processes Nodes, keyed by tree"""
+    """Processes Nodes, keyed by tree. The nodes themselves are kept in the
+    NodeRecord store; tree entries only reference the root's record. Trees
+    serialized as full JSON documents can still be read"""
     PREFIX = (ROOT, 'tree')
     JSON_ENCODER = FullNodeEncoder
     JSON_DECODER = staticmethod(full_node_decode_hook)
+    load_root = NodeRecord.load_node
+
+    def serialize(self, content):
+        if isinstance(content, (Node, FrozenNode)):
+            return json.dumps({'root_record': NodeRecord.store(content)})
+        return formats.JSONFormat.dumps(content, self.JSON_ENCODER)
+
+    def deserialize(self, content):
+        result = super(Tree, self).deserialize(content)
+        if isinstance(result, dict) and 'root_record' in result:
+            result = self.load_root(result['root_record'])
+        return result
+
+    def root_hash(self):
+        """Hash of the root's record, found without loading the tree. Trees
+        with identical hashes are identical. None for trees serialized as
+        full JSON documents"""
+        with open(str(self)) as f:
+            content = f.read()
+        if content.startswith('{"root_record"'):
+            return json.loads(content)['root_record']
 
 
 class FrozenTree(Tree):
     """Like Tree, but decodes as FrozenNodes"""
     JSON_DECODER = staticmethod(frozen_node_decode_hook)
+    load_root = NodeRecord.load_frozen_node
 
 
 class RuleChanges(_JSONEntry):
@@ -149,3 +296,15 @@ class Layer(_JSONEntry):
 class Diff(_JSONEntry):
     """Processes diffs, keyed by diff"""
     PREFIX = (ROOT, 'diff')
+
+
+class VolumeSpans(_JSONEntry):
+    """The range of parts in each volume of an annual edition, keyed by
+    volume_spans"""
+    PREFIX = (ROOT, 'volume_spans')
+
+
+class WriteManifest(_JSONEntry):
+    """Content hashes of the documents written to each output, keyed by
+    write_manifest"""
+    PREFIX = (ROOT, 'write_manifest')
@@ -0,0 +1,58 @@
+"""Serialization formats for entries in the index. Entries are written in the
+format named by settings.INDEX_FORMAT, but entries in any known format can be
+read. JSON remains the format for output (see `write_to`)"""
+import json
+
+import msgpack
+
+import settings
+
+
+class JSONFormat(object):
+    """Human readable, but verbose and relatively slow to parse"""
+    @staticmethod
+    def dumps(content, encoder=json.JSONEncoder):
+        return encoder(sort_keys=True, indent=4,
+                       separators=(', ', ': ')).encode(content)
+
+    @staticmethod
+    def loads(content, object_hook=None):
+        return json.loads(content, object_hook=object_hook)
+
+
+class CompactFormat(object):
+    """msgpack-based. Decodes to the same structures as JSON would (e.g.
+    tuples become lists, strings become unicode). Custom types are converted
+    via the `default` method of the provided JSONEncoder"""
+    # msgpack never uses this byte and it cannot begin a JSON document, so
+    # it identifies compact entries
+    MARKER = b'\xc1'
+
+    @staticmethod
+    def dumps(content, encoder=json.JSONEncoder):
+        return CompactFormat.MARKER + msgpack.packb(
+            content, default=encoder().default, use_bin_type=False)
+
+    @staticmethod
+    def loads(content, object_hook=None):
+        return msgpack.unpackb(content[len(CompactFormat.MARKER):],
+                               object_hook=object_hook, raw=False)
+
+
+FORMATS = {'json': JSONFormat, 'compact': CompactFormat}
+
+
+def is_compact(content):
+    return content.startswith(CompactFormat.MARKER)
+
+
+def dumps(content, encoder=json.JSONEncoder):
+    """Serialize content in the configured format"""
+    return FORMATS[settings.INDEX_FORMAT].dumps(content, encoder)
+
+
+def loads(content, object_hook=None):
+    """Deserialize content, regardless of which format it was written in"""
+    if is_compact(content):
+        return CompactFormat.loads(content, object_hook)
+    return JSONFormat.loads(content, object_hook)
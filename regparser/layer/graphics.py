@@ -1,25 +1,176 @@
 from collections import defaultdict
+import json
+import logging
+import os
 import re
+import sqlite3
+import time
 
 import requests
 
-from regparser import content
+from regparser import content, web
+from regparser.index import ROOT
 from regparser.layer.layer import Layer
+from regparser.tree.struct import walk
 import settings
 
 
+class ThumbnailCache(object):
+    """Persistent record of the thumbnail (or lack thereof) found for each
+    image URL, stored in `thumbnails.sqlite` so that it's shared between
+    versions, runs and processes. Records expire after
+    settings.THUMBNAIL_CACHE_TTL seconds"""
+    DB_FILE = os.path.join(ROOT, "thumbnails.sqlite")
+    # Stay under SQLite's limit on the number of variables in a query
+    CHUNK_SIZE = 500
+
+    def __init__(self):
+        if not os.path.exists(ROOT):
+            os.makedirs(ROOT)
+        self._connection = sqlite3.connect(self.DB_FILE)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS thumbnail ("
+                "url TEXT PRIMARY KEY, thumb_url TEXT, "
+                "checked REAL NOT NULL)")
+
+    def get_many(self, urls):
+        """Of these URLs, map those with unexpired records to their thumb
+        URL (None if they have no thumbnail)"""
+        urls = sorted(set(urls))
+        oldest = time.time() - settings.THUMBNAIL_CACHE_TTL
+        thumb_urls = {}
+        for idx in range(0, len(urls), self.CHUNK_SIZE):
+            chunk = urls[idx:idx + self.CHUNK_SIZE]
+            rows = self._connection.execute(
+                "SELECT url, thumb_url FROM thumbnail WHERE checked >= ? "
+                "AND url IN ({})".format(', '.join('?' * len(chunk))),
+                [oldest] + chunk)
+            thumb_urls.update(rows)
+        return thumb_urls
+
+    def set_many(self, thumb_urls):
+        """Record a dict of URL -> thumb URL (or None)"""
+        now = time.time()
+        with self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO thumbnail (url, thumb_url, checked) "
+                "VALUES (?, ?, ?)",
+                [(url, thumb_url, now)
+                 for url, thumb_url in thumb_urls.items()])
+
+    def close(self):
+        self._connection.close()
+
+
+def check_for_thumb(url):
+    """Return the URL of the image's thumbnail, if it exists. Raises a
+    RequestException if we can't tell"""
+    thumb_url = re.sub(r'(.(png|gif|jpg))$', '.thumb' + '\\1', url)
+    session = web.session()
+    response = session.head(thumb_url)
+
+    if response.status_code == requests.codes.not_implemented:
+        response = session.get(thumb_url)
+
+    if response.status_code == requests.codes.ok:
+        return thumb_url
+
+
+# Returned when a thumbnail couldn't be checked
+_UNKNOWN = object()
+
+
+def _check_or_unknown(url):
+    try:
+        return check_for_thumb(url)
+    except requests.RequestException, e:
+        logging.warning("Could not check for a thumbnail of %s: %s", url, e)
+        return _UNKNOWN
+
+
+_manifests = {}
+
+
+def _manifest(path):
+    """Load (and memoize) a JSON manifest of image URL -> thumb URL"""
+    if path not in _manifests:
+        with open(path) as f:
+            _manifests[path] = json.load(f)
+    return _manifests[path]
+
+
+def find_thumbs(urls, cache=None):
+    """Map each of these image URLs to the URL of its thumbnail (or None).
+    If settings.THUMBNAIL_MANIFEST is set, thumbnails are only looked up in
+    that local file; no requests are made. Otherwise, URLs without a cached
+    result are checked concurrently. If a check fails (e.g. as the network
+    is down), we assume there's no thumbnail, but don't record that. Uses
+    (and leaves open) the provided ThumbnailCache, if any"""
+    urls = set(urls)
+    if settings.THUMBNAIL_MANIFEST:
+        manifest = _manifest(settings.THUMBNAIL_MANIFEST)
+        return {url: manifest.get(url) for url in urls}
+
+    own_cache = cache is None
+    if own_cache:
+        cache = ThumbnailCache()
+    try:
+        thumb_urls = cache.get_many(urls)
+        to_check = sorted(urls - set(thumb_urls))
+        checked = dict(zip(to_check,
+                           web.map_concurrently(_check_or_unknown, to_check)))
+        checked = {url: thumb_url for url, thumb_url in checked.items()
+                   if thumb_url is not _UNKNOWN}
+        cache.set_many(checked)
+    finally:
+        if own_cache:
+            cache.close()
+    thumb_urls.update(checked)
+    return {url: thumb_urls.get(url) for url in urls}
+
+
 class Graphics(Layer):
     gid = re.compile(ur'!\[([\w\s]*)\]\(([a-zA-Z0-9.\-]+?)\)')
 
-    def check_for_thumb(self, url):
-        thumb_url = re.sub(r'(.(png|gif|jpg))$', '.thumb' + '\\1', url)
-        response = requests.head(thumb_url)
+    def __init__(self, *args, **kwargs):
+        super(Graphics, self).__init__(*args, **kwargs)
+        self.thumb_urls = {}
+        # Open while building, so that lookups share a connection
+        self.thumb_cache = None
+
+    @staticmethod
+    def image_url(image_id):
+        return content.ImageOverrides().get(
+            image_id, settings.DEFAULT_IMAGE_URL % image_id)
 
-        if response.status_code == requests.codes.not_implemented:
-            response = requests.get(thumb_url)
+    def pre_process(self):
+        """Find the thumbnails for all of the images in the tree at once"""
+        urls = set()
 
-        if response.status_code == requests.codes.ok:
-            return thumb_url
+        def collect_urls(node):
+            for match in Graphics.gid.finditer(node.text):
+                urls.add(self.image_url(match.group(2)))
+        walk(self.tree, collect_urls)
+        if not settings.THUMBNAIL_MANIFEST:
+            self.thumb_cache = ThumbnailCache()
+        self.thumb_urls = find_thumbs(urls, self.thumb_cache)
+
+    def build(self, cache=None):
+        try:
+            return super(Graphics, self).build(cache)
+        finally:
+            if self.thumb_cache:
+                self.thumb_cache.close()
+                self.thumb_cache = None
+
+    def check_for_thumb(self, url):
+        """Return the URL of the image's thumbnail, if it exists. Results are
+        shared with the rest of the layer (and its ThumbnailCache)"""
+        if url not in self.thumb_urls:
+            self.thumb_urls.update(find_thumbs([url], self.thumb_cache))
+        return self.thumb_urls.get(url)
 
     def process(self, node):
         """If this node has a marker for an image in it, note where to get
@@ -31,8 +182,7 @@ class Graphics(Layer):
         layer_el = []
         for text in matches_by_text:
             match = matches_by_text[text][0]
-            url = content.ImageOverrides().get(
-                match.group(2), settings.DEFAULT_IMAGE_URL % match.group(2))
+            url = self.image_url(match.group(2))
             layer_el_vals = {
                 'text': match.group(0),
                 'url': url,
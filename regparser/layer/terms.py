@@ -1,5 +1,6 @@
 # vim: set fileencoding=utf-8
-from collections import defaultdict
+from bisect import bisect_left, bisect_right
+from collections import defaultdict, OrderedDict
 import re
 
 import inflection
@@ -19,6 +20,151 @@ import settings
 
 
 MAX_TERM_LENGTH = 100
+# Number of TermMatchers each Terms layer keeps
+MATCHER_CACHE_SIZE = 100
+
+_WORD_BOUNDARY = re.compile(r'\b')
+_inflected_forms = {}
+
+
+def inflected_forms(term):
+    """The singular and plural forms of a term"""
+    if term not in _inflected_forms:
+        _inflected_forms[term] = set([inflection.singularize(term),
+                                      inflection.pluralize(term)])
+    return _inflected_forms[term]
+
+
+class TermMatcher(object):
+    """Finds each occurrence of a set of terms (in their singular and plural
+    forms) within a text. Rather than searching for each term in turn, we
+    walk a trie of the terms from every word boundary of the text, so the
+    work depends on the text rather than the number of terms. Occurrences
+    must end at a word boundary, as if we'd searched for `\bterm\b`"""
+    def __init__(self, applicable_terms):
+        """applicable_terms is a list of (term, ref) pairs. If two terms
+        share an inflected form, that form belongs to the term it matches
+        exactly"""
+        self.refs = {}
+        for term, ref in sorted(applicable_terms, key=lambda pair: pair[0]):
+            for form in inflected_forms(term):
+                if form not in self.refs or form == term:
+                    self.refs[form] = ref
+        self.trie = {}
+        for form in self.refs:
+            trie_node = self.trie
+            for char in form:
+                trie_node = trie_node.setdefault(char, {})
+            trie_node[None] = form  # end of a form
+
+    def occurrences(self, text):
+        """Map each form found in the text to the (start, end) of its
+        occurrences, which may overlap"""
+        boundaries = [match.start() for match in
+                      _WORD_BOUNDARY.finditer(text)]
+        boundary_set = set(boundaries)
+        found = defaultdict(list)
+        for start in boundaries:
+            trie_node, idx = self.trie, start
+            while trie_node is not None:
+                if None in trie_node and idx in boundary_set:
+                    found[trie_node[None]].append((start, idx))
+                if idx == len(text):
+                    break
+                trie_node = trie_node.get(text[idx])
+                idx += 1
+        return found
+
+
+class OffsetIntervals(object):
+    """A set of (inclusive) intervals of text offsets, merged and sorted so
+    that we can check whether an offset falls within any of them with a
+    binary search"""
+    def __init__(self, intervals=()):
+        self.starts, self.ends = [], []
+        for start, end in intervals:
+            self.add(start, end)
+
+    def add(self, start, end):
+        if start > end:
+            return
+        # Intervals which overlap this one
+        lo = bisect_left(self.ends, start)
+        hi = bisect_right(self.starts, end)
+        if lo < hi:
+            start = min(start, self.starts[lo])
+            end = max(end, self.ends[hi - 1])
+        self.starts[lo:hi] = [start]
+        self.ends[lo:hi] = [end]
+
+    def __contains__(self, offset):
+        idx = bisect_right(self.starts, offset) - 1
+        return idx >= 0 and self.ends[idx] >= offset
+
+
+class ScopeIndex(object):
+    """The definitions found in a regulation (i.e. Terms.scoped_terms),
+    indexed for the per-node work of the Terms layer: a trie of scopes, each
+    holding the terms applicable within it (including those inherited from
+    enclosing scopes), and the definitions made in each paragraph"""
+    def __init__(self, scoped_terms):
+        self.scoped_terms = scoped_terms
+        # label component -> child trie; the None key holds the terms
+        # applicable within that scope
+        self.trie = {}
+        self.no_terms = {}
+        for scope in sorted((scope for scope in scoped_terms
+                             if isinstance(scope, tuple)), key=len):
+            trie_node, inherited = self.trie, self.no_terms
+            for component in scope:
+                inherited = trie_node.get(None, inherited)
+                trie_node = trie_node.setdefault(component, {})
+            terms = dict(inherited)
+            for ref in scoped_terms[scope]:
+                terms[ref.term] = ref   # overwrites
+            trie_node[None] = terms
+
+        self.refs_by_label = defaultdict(list)
+        for reflist in scoped_terms.values():
+            for ref in reflist:
+                self.refs_by_label[ref.label].append(ref)
+        self._matchers = OrderedDict()
+
+    def applicable_terms(self, label):
+        """Equivalent to Terms.applicable_terms. The returned dict is shared,
+        so should not be modified"""
+        trie_node, terms = self.trie, self.no_terms
+        for component in label:
+            trie_node = trie_node.get(component)
+            if trie_node is None:
+                break
+            terms = trie_node.get(None, terms)
+        return terms
+
+    def definition_positions(self, label):
+        """Positions of the terms defined in the paragraph with this label"""
+        return [ref.position for ref in self.refs_by_label.get(label, [])]
+
+    def term_matcher(self, label, label_id):
+        """A TermMatcher for the terms applicable to this node, excluding
+        those defined within it. Nodes within the same scope share their
+        terms, so we reuse the most recently built matchers"""
+        terms = self.applicable_terms(label)
+        defined_here = tuple(sorted(
+            ref.term for ref in self.refs_by_label.get(label_id, [])
+            if terms.get(ref.term) is ref))
+        # The terms dicts live as long as this index, so their ids are
+        # stable
+        key = (id(terms), defined_here)
+        if key in self._matchers:
+            self._matchers[key] = self._matchers.pop(key)   # recently used
+        else:
+            self._matchers[key] = TermMatcher([
+                (term, ref) for term, ref in terms.iteritems()
+                if ref.label != label_id])
+            while len(self._matchers) > MATCHER_CACHE_SIZE:
+                self._matchers.popitem(last=False)
+        return self._matchers[key]
 
 
 class ParentStack(PriorityStack):
@@ -41,6 +187,7 @@ class Terms(Layer):
         #   scope -> List[(term, definition_ref)]
         self.scoped_terms = defaultdict(list)
         self.scope_finder = ScopeFinder()
+        self._scope_index = None
 
     def look_for_defs(self, node, stack=None):
         """Check a node and recursively check its children for terms which are
@@ -64,6 +211,7 @@ class Terms(Layer):
         """
         self.scope_finder.add_subparts(self.tree)
         self.look_for_defs(self.tree)
+        self._scope_index = ScopeIndex(self.scoped_terms)
 
         referenced = self.layer['referenced']
         for scope in self.scoped_terms:
@@ -78,10 +226,20 @@ class Terms(Layer):
                         'position': ref.position
                     }
 
+    def scope_index(self):
+        """The index of the definitions found, which is built in
+        `pre_process` (or when first needed). It isn't updated if
+        scoped_terms is modified in place"""
+        if (self._scope_index is None or
+                self._scope_index.scoped_terms is not self.scoped_terms):
+            self._scope_index = ScopeIndex(self.scoped_terms)
+        return self._scope_index
+
     def applicable_terms(self, label):
         """Find all terms that might be applicable to nodes with this label.
         Note that we don't have to deal with subparts as subpart_scope simply
-        applies the definition to all sections in a subpart"""
+        applies the definition to all sections in a subpart. As this is used
+        while definitions are being found, it doesn't use the scope index"""
         applicable_terms = {}
         for segment_length in range(1, len(label) + 1):
             scope = tuple(label[:segment_length])
@@ -93,10 +251,11 @@ class Terms(Layer):
         """Some definitions are exceptions/exclusions of a previously
         defined term. At the moment, we do not want to include these as they
         would replace previous (correct) definitions."""
-        applicable_terms = self.applicable_terms(node.label)
-        if term in applicable_terms:
+        text = node.text.lower()
+        if 'does not include' in text and term in self.applicable_terms(
+                node.label):
             regex = 'the term .?' + re.escape(term) + '.? does not include'
-            return bool(re.search(regex, node.text.lower()))
+            return bool(re.search(regex, text))
         return False
 
     def node_definitions(self, node, stack=None):
@@ -113,21 +272,19 @@ class Terms(Layer):
             references.extend(finder.find(node))
 
         references = [r for r in references if len(r.term) <= MAX_TERM_LENGTH]
+        exclusions = [self.is_exclusion(r.term, node) for r in references]
 
         return (
-            [r for r in references if not self.is_exclusion(r.term, node)],
-            [r for r in references if self.is_exclusion(r.term, node)])
+            [r for r, excl in zip(references, exclusions) if not excl],
+            [r for r, excl in zip(references, exclusions) if excl])
 
     def process(self, node):
         """Determine which (if any) definitions would apply to this node,
         then find if any of those terms appear in this node"""
-        applicable_terms = self.applicable_terms(node.label)
-
         layer_el = []
-        #   Remove any definitions defined in this paragraph
-        term_list = [
-            (term, ref) for term, ref in applicable_terms.iteritems()
-            if ref.label != node.label_id()]
+        #   Definitions defined in this paragraph are excluded
+        matcher = self.scope_index().term_matcher(node.label,
+                                                  node.label_id())
 
         exclusions = self.excluded_offsets(node.label_id(), node.text)
         exclusions = self.per_regulation_ignores(
@@ -137,7 +294,7 @@ class Terms(Layer):
         inclusions = self.per_regulation_includes(
             inclusions, node.label, node.text)
 
-        matches = self.calculate_offsets(node.text, term_list, exclusions)
+        matches = self.match_terms(node.text, matcher, exclusions)
         for term, ref, offsets in matches:
             layer_el.append({
                 "ref": ref.term + ':' + ref.label,
@@ -162,10 +319,7 @@ class Terms(Layer):
         """We explicitly exclude certain chunks of text (for example, words
         we are defining shouldn't have links appear within the defined
         term.) More will be added in the future"""
-        exclusions = []
-        for reflist in self.scoped_terms.values():
-            exclusions.extend(
-                ref.position for ref in reflist if ref.label == label)
+        exclusions = self.scope_index().definition_positions(label)
         for ignore_term in settings.IGNORE_DEFINITIONS_IN['ALL']:
             exclusions.extend(self._word_matches(ignore_term, text))
         return exclusions
@@ -192,39 +346,32 @@ class Terms(Layer):
         """Search for defined terms in this text, including singular and
         plural forms of these terms, with a preference for all larger
         (i.e. containing) terms."""
+        return self.match_terms(text, TermMatcher(applicable_terms),
+                                exclusions)
 
-        # don't modify the original
-        exclusions = list(exclusions)
-        inclusions = list(inclusions)
-
-        # add singulars and plurals to search terms
-        search_terms = set((inflection.singularize(t[0]), t[1])
-                           for t in applicable_terms)
-        search_terms |= set((inflection.pluralize(t[0]), t[1])
-                            for t in applicable_terms)
-
-        # longer terms first
-        search_terms = sorted(search_terms, key=lambda x: len(x[0]),
-                              reverse=True)
+    def match_terms(self, text, matcher, exclusions=[]):
+        """As calculate_offsets, but searching for the terms of a (likely
+        shared) TermMatcher"""
+        occurrences = matcher.occurrences(text.lower())
+        exclusions = OffsetIntervals(exclusions)
 
         matches = []
-        for term, ref in search_terms:
-            re_term = ur'\b' + re.escape(term) + ur'\b'
-            offsets = [
-                (m.start(), m.end())
-                for m in re.finditer(re_term, text.lower())]
-            safe_offsets = []
-            for start, end in offsets:
-                #   Start is contained in an existing def
-                if any(start >= e[0] and start <= e[1] for e in exclusions):
+        # longer terms first
+        for term in sorted(occurrences, key=lambda t: (-len(t), t)):
+            safe_offsets, prev_end = [], None
+            for start, end in sorted(occurrences[term]):
+                # A term's matches don't overlap each other
+                if prev_end is not None and start < prev_end:
                     continue
-                #   End is contained in an existing def
-                if any(end >= e[0] and end <= e[1] for e in exclusions):
+                prev_end = end
+                #   Start or end is contained in an existing def
+                if start in exclusions or end in exclusions:
                     continue
                 safe_offsets.append((start, end))
             if not safe_offsets:
                 continue
 
-            exclusions.extend(safe_offsets)
-            matches.append((term, ref, safe_offsets))
+            for start, end in safe_offsets:
+                exclusions.add(start, end)
+            matches.append((term, matcher.refs[term], safe_offsets))
         return matches
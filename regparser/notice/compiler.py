@@ -8,7 +8,7 @@ import itertools
 import logging
 
 from regparser.grammar.tokens import Verb
-from regparser.tree.struct import Node, find, find_parent
+from regparser.tree.struct import Node
 from regparser.tree.xml_parser import interpretations
 from regparser.tree.xml_parser import tree_utils
 from regparser.utils import roman_nums
@@ -136,11 +136,98 @@ def is_interp_placeholder(node):
 
 class RegulationTree(object):
     """ This encapsulates a regulation tree, and methods to change that tree.
+    The previous tree is never modified; instead, its nodes are shared with
+    the new tree until they need to change (copy-on-write). At that point,
+    the node and its ancestors are copied, leaving unchanged subtrees
+    shared between the two versions.
     """
 
     def __init__(self, previous_tree):
-        self.tree = copy.deepcopy(previous_tree)
+        self.tree = previous_tree
         self._kept__by_parent = defaultdict(list)
+        # Lookup tables so that we needn't walk the whole tree for every
+        # change: label_id -> node and child label_id -> parent node
+        self._by_label = {}
+        self._parent_of = {}
+        # id(node) -> parent node, used when copying a node's ancestors
+        self._parents = {}
+        # id(node) -> node, for nodes which belong to the previous tree. We
+        # keep references so that the ids remain valid
+        self._shared = {}
+        if self.tree is not None:
+            self._index(self.tree, shared=True)
+
+    def _index(self, node, parent=None, shared=False):
+        """Register this node and all of its descendants in the lookup
+        tables. If a label is already present, the existing entry wins,
+        mirroring `struct.find`'s first-match behavior"""
+        label_id = node.label_id()
+        self._by_label.setdefault(label_id, node)
+        if parent is not None:
+            self._parent_of.setdefault(label_id, parent)
+            self._parents[id(node)] = parent
+        if shared:
+            self._shared[id(node)] = node
+        for child in node.children:
+            self._index(child, node, shared)
+
+    def _unindex(self, node, parent=None):
+        """Remove this node and all of its descendants from the lookup
+        tables. Entries pointing at other nodes with the same label are left
+        alone"""
+        label_id = node.label_id()
+        if self._by_label.get(label_id) is node:
+            del self._by_label[label_id]
+        if parent is not None and self._parent_of.get(label_id) is parent:
+            del self._parent_of[label_id]
+        if self._parents.get(id(node)) is parent:
+            del self._parents[id(node)]
+        for child in node.children:
+            self._unindex(child, node)
+
+    def _writable(self, node):
+        """Nodes from the previous tree must not be modified. Return a copy of
+        the node (swapped into the tree in place of the original) if it is
+        shared; copies its ancestors as needed. Nodes which aren't shared are
+        returned as-is"""
+        if id(node) not in self._shared:
+            return node
+
+        clone = copy.copy(node)
+        clone.children = list(node.children)
+        parent = self._parents.pop(id(node), None)
+        if node is self.tree:
+            self.tree = clone
+        elif parent is not None:
+            parent = self._writable(parent)
+            parent.children = [clone if c is node else c
+                               for c in parent.children]
+            self._parents[id(clone)] = parent
+
+        label_id = clone.label_id()
+        if self._by_label.get(label_id) is node:
+            self._by_label[label_id] = clone
+        for child in clone.children:
+            self._parents[id(child)] = clone
+            if self._parent_of.get(child.label_id()) is node:
+                self._parent_of[child.label_id()] = clone
+        return clone
+
+    def _set_children(self, parent, children):
+        """All modifications to a node's children should go through this
+        method so that the lookup tables stay in sync with the tree. As the
+        parent may be copied, returns the node which is now in the tree"""
+        parent = self._writable(parent)
+        retained = set(id(child) for child in children)
+        previous = set(id(child) for child in parent.children)
+        for child in parent.children:
+            if id(child) not in retained:
+                self._unindex(child, parent)
+        parent.children = children
+        for child in children:
+            if id(child) not in previous:
+                self._index(child, parent)
+        return parent
 
     def keep(self, labels):
         """The 'KEEP' verb tells us that a node should not be removed
@@ -148,16 +235,17 @@ class RegulationTree(object):
         parent). "Keeping" those nodes makes sure they do not disappear when
         editing their parent"""
         for label in labels:
-            node = self.find_node(label)
+            # Make a private copy now so the reference remains valid
+            node = self._writable(self.find_node(label))
             parent_label = get_parent_label(node)
             self._kept__by_parent[parent_label].append(node)
 
     def get_parent(self, node):
         """ Get the parent of a node. Returns None if parent not found. """
-        parent = find_parent(self.tree, node)
+        parent = self._parent_of.get(node.label_id())
         if not parent:  # e.g. because the node doesn't exist in the tree yet
             parent_label_id = get_parent_label(node)
-            parent = find(self.tree, parent_label_id)
+            parent = self.find_node(parent_label_id)
         if not parent:
             logging.error("Could not find parent of %s. Misparsed amendment?",
                           node.label_id())
@@ -165,15 +253,10 @@ class RegulationTree(object):
 
     def add_to_root(self, node):
         """ Add a child to the root of the tree. """
-        self.tree.children.append(node)
-
-        for c in self.tree.children:
-            c.sortable = make_root_sortable(c.label, c.node_type)
-
-        self.tree.children.sort(key=lambda x: x.sortable)
-
-        for c in self.tree.children:
-            del c.sortable
+        children = sorted(
+            self.tree.children + [node],
+            key=lambda c: make_root_sortable(c.label, c.node_type))
+        self._set_children(self.tree, children)
 
     def add_child(self, children, node, order=None):
         """ Add a child to the children, and sort appropriately. This is used
@@ -218,11 +301,11 @@ class RegulationTree(object):
 
         parent = self.get_parent(node)
         other_children = [c for c in parent.children if c.label != node.label]
-        parent.children = other_children
+        self._set_children(parent, other_children)
 
     def delete(self, label_id):
         """ Delete the node with label_id from the tree. """
-        node = find(self.tree, label_id)
+        node = self.find_node(label_id)
         if node is None:
             logging.warning("Attempting to delete %s failed", label_id)
         else:
@@ -234,7 +317,7 @@ class RegulationTree(object):
         represented in the FR XML. We simply use that representation here
         instead of doing something else. """
 
-        existing_node = find(self.tree, label_id)
+        existing_node = self.find_node(label_id)
         if existing_node is None:
             self.add_node(node)
         else:
@@ -242,7 +325,7 @@ class RegulationTree(object):
 
     def move(self, origin, destination):
         """ Move a node from one part in the tree to another. """
-        origin = find(self.tree, origin)
+        origin = self._writable(self.find_node(origin))
         self.delete_from_parent(origin)
 
         origin = overwrite_marker(origin, destination[-1])
@@ -259,22 +342,20 @@ class RegulationTree(object):
         if prev_idx:
             # replace existing element in place
             prev_idx = prev_idx[0]
-            parent.children = (parent.children[:prev_idx] + [node] +
+            self._set_children(parent, parent.children[:prev_idx] + [node] +
                                parent.children[prev_idx + 1:])
         else:
             # actually adding a new element
-            parent.children = self.add_child(parent.children, node,
-                                             getattr(parent, 'child_labels',
-                                                     []))
+            self._set_children(parent, self.add_child(
+                parent.children, node, getattr(parent, 'child_labels', [])))
 
         # Finally, we see if this node is the parent of any 'kept' children.
         # If so, add them back
         label_id = node.label_id()
         if label_id in self._kept__by_parent:
             for kept in self._kept__by_parent[label_id]:
-                node.children = self.add_child(node.children, kept,
-                                               getattr(node, 'child_labels',
-                                                       []))
+                self._set_children(node, self.add_child(
+                    node.children, kept, getattr(node, 'child_labels', [])))
 
     def create_empty_node(self, node_label):
         """ In rare cases, we need to flush out the tree by adding
@@ -290,8 +371,8 @@ class RegulationTree(object):
         parent = self.get_parent(node)
         if not parent:
             parent = self.create_empty_node(get_parent_label(node))
-        parent.children = self.add_child(parent.children, node,
-                                         getattr(parent, 'child_labels', []))
+        self._set_children(parent, self.add_child(
+            parent.children, node, getattr(parent, 'child_labels', [])))
         return node
 
     def contains(self, label):
@@ -302,15 +383,16 @@ class RegulationTree(object):
     def find_node(self, label):
         if isinstance(label, list):
             label = '-'.join(label)
-        return find(self.tree, label)
+        return self._by_label.get(label)
 
     def add_node(self, node, parent_label=None):
         """ Add an entirely new node to the regulation tree. """
-        existing = find(self.tree, node.label_id())
+        existing = self.find_node(node.label_id())
         if existing and is_reserved_node(existing):
             logging.warning('Replacing reserved node: %s' % node.label_id())
             return self.replace_node_and_subtree(node)
         elif existing and is_interp_placeholder(existing):
+            existing = self._writable(existing)
             existing.title = node.title
             existing.text = node.text
             if hasattr(node, 'tagged_text'):
@@ -349,9 +431,9 @@ class RegulationTree(object):
                 if (parent.children and
                         parent.children[0].node_type == Node.EMPTYPART):
                     parent = parent.children[0]
-                parent.children = self.add_child(
+                self._set_children(parent, self.add_child(
                     parent.children, node, getattr(parent, 'child_labels',
-                                                   []))
+                                                   [])))
 
     def insert_in_order(self, node):
         """Add a new node, but determine its position in its parent by looking
@@ -359,24 +441,25 @@ class RegulationTree(object):
         parent = self.get_parent(node)
         texts = [child.text for child in parent.children]
         insert_idx = bisect(texts, node.text)
-        parent.children.insert(insert_idx, node)
+        self._set_children(parent, parent.children[:insert_idx] + [node] +
+                           parent.children[insert_idx:])
 
     def replace_node_text(self, label, change):
         """ Replace just a node's text. """
 
-        node = find(self.tree, label)
+        node = self._writable(self.find_node(label))
         node.text = change['node']['text']
 
     def replace_node_title(self, label, change):
         """ Replace just a node's title. """
 
-        node = find(self.tree, label)
+        node = self._writable(self.find_node(label))
         node.title = change['node']['title']
 
     def replace_node_heading(self, label, change):
         """ A node's heading is it's keyterm. We handle this here, but not
         well, I think. """
-        node = find(self.tree, label)
+        node = self._writable(self.find_node(label))
         node.text = replace_first_sentence(node.text, change['node']['text'])
 
         if hasattr(node, 'tagged_text') and 'tagged_text' in change['node']:
@@ -400,19 +483,26 @@ class RegulationTree(object):
                 label, subpart_label)
             return
 
-        destination = find(self.tree, '-'.join(subpart_label))
+        destination = self.find_node(subpart_label)
 
         if destination is None:
             destination = self.create_new_subpart(subpart_label)
 
-        subpart_with_node = find_parent(self.tree, label)
+        subpart_with_node = self._parent_of.get(label)
 
         if destination and subpart_with_node:
-            node = find(subpart_with_node, label)
+            if subpart_with_node.label_id() == destination.label_id():
+                return  # already in the right subpart
+            node = self.find_node(label)
             other_children = [c for c in subpart_with_node.children
                               if c.label_id() != label]
-            subpart_with_node.children = other_children
-            destination.children = self.add_child(destination.children, node)
+            subpart_with_node = self._set_children(subpart_with_node,
+                                                   other_children)
+            # Copying the source may have copied shared ancestors; look up
+            # the destination again so we don't modify a stale node
+            destination = self.find_node(subpart_label)
+            self._set_children(destination, self.add_child(
+                destination.children, node))
 
             if not subpart_with_node.children:
                 self.delete('-'.join(subpart_with_node.label))
@@ -6,8 +6,8 @@ import os
 from urlparse import urlparse
 
 from lxml import etree
-import requests
 
+from regparser import web
 from regparser.grammar.unified import notice_cfr_p
 from regparser.history.delays import delays_in_sentence
 from regparser.index import xml_sync
@@ -44,7 +44,7 @@ class NoticeXML(XMLWrapper):
         if it cannot. Also sets the field. Returns a datetime.date"""
         dates = fetch_dates(self.xml) or {}
         if 'effective' not in dates:
-            raise Exception(
+            raise ValueError(
                 "Could not derive effective date for notice {}".format(
                     self.version_id))
         effective = datetime.strptime(dates['effective'][0], "%Y-%m-%d").date()
@@ -147,19 +147,27 @@ def local_copies(url):
     return []
 
 
-def notice_xmls_for_url(doc_num, notice_url):
-    """Find, preprocess, and return the XML(s) associated with a particular FR
-    notice url"""
+def xml_sources_for_url(notice_url):
+    """Find the raw XML(s) associated with a particular FR notice url, without
+    parsing them. Returns a list of (content, source) pairs"""
     local_notices = local_copies(notice_url)
     if local_notices:
         logging.info("using local xml for %s", notice_url)
+        sources = []
         for local_notice_file in local_notices:
             with open(local_notice_file, 'r') as f:
-                yield NoticeXML(f.read(), local_notice_file).preprocess()
+                sources.append((f.read(), local_notice_file))
+        return sources
     else:
         logging.info("fetching notice xml for %s", notice_url)
-        content = requests.get(notice_url).content
-        yield NoticeXML(content, notice_url).preprocess()
+        return [(web.session().get(notice_url).content, notice_url)]
+
+
+def notice_xmls_for_url(doc_num, notice_url):
+    """Find, preprocess, and return the XML(s) associated with a particular FR
+    notice url"""
+    for content, source in xml_sources_for_url(notice_url):
+        yield NoticeXML(content, source).preprocess()
 
 
 def xmls_for_url(notice_url):
@@ -1,10 +1,16 @@
 import re
 from json import JSONEncoder
 import hashlib
+import weakref
 
 from lxml import etree
 
 
+class LazyXML(str):
+    """Serialized XML, to be parsed when a Node's source_xml is first
+    accessed"""
+
+
 class Node(object):
     APPENDIX = u'appendix'
     INTERP = u'interp'
@@ -32,6 +38,19 @@ class Node(object):
         self.node_type = node_type
         self.source_xml = source_xml
 
+    @property
+    def source_xml(self):
+        """Stored in __dict__ (as with other attributes), but may be a
+        LazyXML, in which case we parse it now"""
+        value = self.__dict__.get('source_xml')
+        if isinstance(value, LazyXML):
+            value = self.__dict__['source_xml'] = etree.fromstring(value)
+        return value
+
+    @source_xml.setter
+    def source_xml(self, value):
+        self.__dict__['source_xml'] = value
+
     def __repr__(self):
         return (("Node( text = %s, children = %s, label = %s, title = %s, " +
                  "node_type = %s)") % (repr(self.text), repr(self.children),
@@ -95,13 +114,22 @@ class FullNodeEncoder(JSONEncoder):
     def default(self, obj):
         if isinstance(obj, Node):
             result = {field: getattr(obj, field, None)
-                      for field in self.FIELDS}
-            if obj.source_xml is not None:
-                result['source_xml'] = etree.tostring(obj.source_xml)
+                      for field in self.FIELDS - set(['source_xml'])}
+            result['source_xml'] = serialized_source_xml(obj)
             return result
         return super(FullNodeEncoder, self).default(obj)
 
 
+def serialized_source_xml(node):
+    """A node's source_xml as a string (or None), avoiding parsing it if
+    it hasn't been parsed yet"""
+    source_xml = vars(node).get('source_xml')
+    if isinstance(source_xml, LazyXML):
+        return str(source_xml)
+    elif source_xml is not None:
+        return etree.tostring(source_xml)
+
+
 def node_decode_hook(d):
     """Convert a JSON object into a Node"""
     if all(field in d for field in ('text', 'children', 'label', 'node_type')):
@@ -120,7 +148,7 @@ def full_node_decode_hook(d):
         if d['tagged_text']:
             node.tagged_text = d['tagged_text']
         if node.source_xml:
-            node.source_xml = etree.fromstring(node.source_xml)
+            node.source_xml = LazyXML(node.source_xml.encode('utf-8'))
         return node
     return d
 
@@ -238,7 +266,9 @@ def treeify(nodes):
 
 class FrozenNode(object):
     """Immutable interface for nodes. No guarantees about internal state."""
-    _pool = {}    # collection of all FrozenNodes, keyed by hash
+    # collection of all live FrozenNodes, keyed by hash. Weak references, so
+    # nodes are dropped once nothing else refers to them
+    _pool = weakref.WeakValueDictionary()
 
     def __init__(self, text='', children=(), label=(), title='',
                  node_type=Node.REGTEXT, tagged_text=''):
@@ -251,8 +281,7 @@ class FrozenNode(object):
         self._child_labels = tuple(c.label_id for c in self.children)
         self._label_id = '-'.join(self.label)
         self._hash = self._generate_hash()
-        if self.hash not in FrozenNode._pool:
-            FrozenNode._pool[self.hash] = self
+        FrozenNode._pool.setdefault(self.hash, self)
 
     @property
     def text(self):
@@ -338,8 +367,9 @@ class FrozenNode(object):
         """When we instantiate a FrozenNode, we add it to _pool if we've not
         seen an identical FrozenNode before. If we have, we want to work with
         that previously seen version instead. This method returns the _first_
-        FrozenNode with identical fields"""
-        return FrozenNode._pool[self.hash]  # note this may not be self
+        (still living) FrozenNode with identical fields"""
+        # note this may not be self
+        return FrozenNode._pool.setdefault(self.hash, self)
 
     def clone(self, **kwargs):
         """Implement a namedtuple `_replace` style functionality, copying all
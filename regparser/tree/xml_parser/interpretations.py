@@ -3,7 +3,8 @@ import itertools
 import logging
 import re
 
-from regparser.citations import Label, remove_citation_overlaps
+from regparser.citations import (
+    CitationSpans, Label, remove_citation_overlaps)
 from regparser.layer.key_terms import KeyTerms
 from regparser.tree.depth import heuristics, rules, markers as mtypes
 from regparser.tree.depth.derive import derive_depths
@@ -61,10 +62,12 @@ def collapsed_markers_matches(node_text, tagged_text):
         node_text = node_text.replace(keyterm, '.'*len(keyterm))
 
     collapsed_markers = []
+    citation_spans = CitationSpans(node_text)
     for marker in _first_markers:
         possible = ((m, m.start(), m.end())
                     for m in marker.finditer(node_text) if m.start() > 0)
-        possible = remove_citation_overlaps(node_text, possible)
+        possible = remove_citation_overlaps(node_text, possible,
+                                            citation_spans)
         # If certain characters follow, kill it
         for following in ("e.", ")", u"”", '"', "'"):
             possible = [(m, s, end) for m, s, end in possible
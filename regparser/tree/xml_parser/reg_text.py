@@ -1,8 +1,7 @@
 # vim: set encoding=utf-8
+from copy import deepcopy
 import re
 
-from lxml import etree
-
 from regparser import content
 from regparser.tree import reg_text
 from regparser.tree.depth import markers as mtypes, optional_rules
@@ -52,15 +51,15 @@ def get_title(reg_doc):
 
 def preprocess_xml(xml):
     """This transforms the read XML through macros. Each macro consists of
-    an xpath and a replacement xml string"""
-    for path, replacement in content.Macros():
-        replacement = etree.fromstring('<ROOT>' + replacement + '</ROOT>')
-        for node in xml.xpath(path):
+    an xpath and a replacement xml string. Macros are parsed once; each
+    match receives a copy of the replacement"""
+    for xpath, replacement in content.Macros().compiled():
+        for node in xpath(xml):
             parent = node.getparent()
             idx = parent.index(node)
             parent.remove(node)
             for repl in replacement:
-                parent.insert(idx, repl)
+                parent.insert(idx, deepcopy(repl))
                 idx += 1
 
 
@@ -85,7 +85,9 @@ def get_collapsed_markers(text):
     if matches and matches[0][1] == 0:
         matches = matches[1:]
 
-    #   remove any that overlap with citations
+    #   remove any that overlap with citations. All candidates are checked
+    #   against a single CitationSpans, so citations are found at most once
+    #   (and not at all if there are no candidates)
     matches = [m for m, _, _ in remove_citation_overlaps(text, matches)]
 
     #   get the letters; poor man's flatten
@@ -0,0 +1,65 @@
+"""Shared HTTP session for fetching data from external services, such as the
+Federal Register. If requests_cache has been installed (see eregs.py), the
+session's responses are cached locally"""
+from multiprocessing.pool import ThreadPool
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+import settings
+
+RETRY_STATUSES = (500, 502, 503, 504)
+# requests_cache replaces requests.Session when it is installed (which
+# happens after our modules are imported); keep the original for requests
+# which shouldn't be cached
+_UncachedSession = requests.Session
+
+_lock = threading.Lock()
+_state = {}
+
+
+def session(cached=True):
+    """A keep-alive session with a connection pool sized for
+    settings.HTTP_WORKERS concurrent requests. Failed requests (connection
+    errors, 5XX responses) are retried with exponential backoff. The session
+    is created on first use (and again in forked processes), so it is an
+    instance of whatever `requests.Session` is at that point; requests_cache
+    replaces that class when installed. Use `cached=False` for requests
+    which shouldn't be cached, e.g. those only reading part of a response"""
+    with _lock:
+        if _state.get('pid') != os.getpid():
+            _state.clear()
+            _state['pid'] = os.getpid()
+        if cached not in _state:
+            retry = Retry(total=3, backoff_factor=0.5,
+                          status_forcelist=RETRY_STATUSES)
+            adapter = HTTPAdapter(pool_maxsize=max(settings.HTTP_WORKERS, 1),
+                                  max_retries=retry)
+            if cached:
+                new_session = requests.Session()
+            else:
+                new_session = _UncachedSession()
+            new_session.mount('http://', adapter)
+            new_session.mount('https://', adapter)
+            _state[cached] = new_session
+        return _state[cached]
+
+
+def map_concurrently(fn, items, workers=None):
+    """Like `map`, but running up to `workers` (default:
+    settings.HTTP_WORKERS) calls at once, in threads. Meant for functions
+    which spend their time waiting on the network. The first exception
+    raised by `fn` is re-raised"""
+    items = list(items)
+    workers = min(workers or settings.HTTP_WORKERS, len(items))
+    if workers <= 1:
+        return map(fn, items)
+    pool = ThreadPool(workers)
+    try:
+        return pool.map(fn, items)
+    finally:
+        pool.terminate()
+        pool.join()
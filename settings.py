@@ -64,6 +64,21 @@ DEFAULT_IMAGE_URL = (
     'https://s3.amazonaws.com/images.federalregister.gov/' +
     '%s/original.gif')
 
+# Whether each image has a thumbnail is remembered for this many seconds
+THUMBNAIL_CACHE_TTL = 60*60*24*7    # one week
+
+# Path to a JSON file mapping image URLs to the URLs of their thumbnails (or
+# null). If set, thumbnails are only looked up there, e.g. to build the
+# graphics layer without network access
+THUMBNAIL_MANIFEST = None
+
+# Number of texts whose internal citations are kept in memory
+CITATION_CACHE_SIZE = 10000
+
+# Whether to also store internal citations in the index (see
+# regparser.citations.CitationCache), sharing them between runs
+CITATION_CACHE_PERSIST = False
+
 # list of strings: phrases which shouldn't be broken by definition links
 IGNORE_DEFINITIONS_IN = {'ALL': []}
 
@@ -105,6 +120,24 @@ APPENDIX_IGNORE_SUBHEADER_LABEL = {}
 # defines where it should find those edits
 XML_REPO = 'https://github.com/eregs/fr-notices.git'
 
+# Format for (JSON-like) entries within the index. 'compact' (msgpack-based)
+# is smaller and faster to read; 'json' is easier to inspect. Entries in
+# either format can be read regardless of this setting
+INDEX_FORMAT = 'compact'
+
+# Base URL of the Federal Register's API. This may point to a local server
+# (e.g. one serving recorded responses) to run without network access
+FEDERAL_REGISTER_API = 'https://www.federalregister.gov/api/v1/'
+
+# Maximum number of concurrent requests to external services (e.g. when
+# fetching meta data and XML for many notices)
+HTTP_WORKERS = 4
+
+# When `eregs` finds a notice missing, it preprocesses only that notice. Set
+# this to a number of worker processes to instead preprocess all final rules
+# for the regulations the notice affects (see `preprocess_notices`)
+BULK_NOTICE_WORKERS = 0
+
 # A dictionary of agency-specific external citations
 # @todo - move ATF citations to an extension
 CUSTOM_CITATIONS = {
@@ -11,12 +11,12 @@ setup(
     install_requires=[
         "click",
         "coloredLogs",
-        "dagger",
         "GitPython",
         "inflection",
         "ipdb",
         "json-delta",
         "lxml",
+        "msgpack",
         "pyparsing",
         "python-constraint",
         "requests",
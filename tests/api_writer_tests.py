@@ -1,11 +1,17 @@
+import gzip
 import json
 import os
 import shutil
+from StringIO import StringIO
 import tempfile
 from unittest import TestCase
 
+import httpretty
+from mock import patch
+
 from regparser.api_writer import (
-    APIWriteContent, Client, FSWriteContent, GitWriteContent, Repo)
+    APIUploader, APIWriteContent, Client, FSWriteContent, GitWriteContent,
+    Repo)
 from regparser.tree.struct import Node
 from regparser.notice.diff import Amendment, DesignateAmendment
 import settings
@@ -65,6 +71,22 @@ class FSWriteContentTest(TestCase):
         self.assertEqual(self.read("replace", "it"),
                          ['action', [['label']], 'destination'])
 
+    def test_write_no_indent(self):
+        writer = FSWriteContent(self.tmpdir, "compact", indent=None)
+        writer.write({"testing": ["body", 1, 2]})
+        with open(os.path.join(self.tmpdir, "compact")) as f:
+            self.assertEqual(f.read(), '{"testing":["body",1,2]}')
+
+    def test_write_failure(self):
+        """If encoding fails part way through, the existing file should be
+        untouched and no temporary files left behind"""
+        writer = FSWriteContent(self.tmpdir, "failure")
+        writer.write({"key": "value"})
+        with self.assertRaises(TypeError):
+            writer.write({"key": ["value", object()]})
+        self.assertEqual(self.read("failure"), {"key": "value"})
+        self.assertEqual(os.listdir(self.tmpdir), ["failure"])
+
 
 class APIWriteContentTest(HttpMixin, TestCase):
     def test_write(self):
@@ -77,6 +99,52 @@ class APIWriteContentTest(HttpMixin, TestCase):
                          'application/json')
         self.assertEqual(self.last_http_body(), data)
 
+    def test_write_retries(self):
+        """Server errors should be retried; failures are collected"""
+        uploader = APIUploader(backoff_factor=0)
+        writer = APIWriteContent("http://example.com", "a", uploader=uploader)
+        httpretty.register_uri(
+            httpretty.POST, 'http://example.com/a',
+            responses=[httpretty.Response('', status=503),
+                       httpretty.Response('', status=200)])
+        writer.write({'key': 'value'})
+        self.assertEqual(len(httpretty.httpretty.latest_requests), 2)
+        self.assertEqual(uploader.finish(), [])
+
+        self.expect_json_http(method='POST', uri='http://example.com/b',
+                              status=400)
+        APIWriteContent("http://example.com", "b",
+                        uploader=uploader).write({})
+        failures = uploader.finish()
+        self.assertEqual(len(failures), 1)
+        self.assertEqual(failures[0][0], 'http://example.com/b')
+
+    def test_write_gzip(self):
+        """Bodies can optionally be compressed"""
+        uploader = APIUploader(gzip_bodies=True)
+        writer = APIWriteContent("http://example.com", "a", uploader=uploader)
+        self.expect_json_http(method='POST', uri='http://example.com/a')
+        writer.write({'key': 'value'})
+
+        self.assertEqual(self.last_http_headers()['content-encoding'],
+                         'gzip')
+        body = gzip.GzipFile(
+            fileobj=StringIO(httpretty.last_request().body)).read()
+        self.assertEqual(json.loads(body), {'key': 'value'})
+
+    def test_write_workers(self):
+        """With multiple workers, all documents should be uploaded by the
+        time `finish` completes"""
+        client = Client('http://example.com', workers=3)
+        self.expect_json_http(method='POST')
+        for idx in range(10):
+            client.notice(str(idx)).write({'idx': idx})
+        self.assertEqual(client.finish(), [])
+        requests = httpretty.httpretty.latest_requests
+        self.assertEqual(
+            sorted(request.path for request in requests),
+            sorted('/notice/{}'.format(idx) for idx in range(10)))
+
 
 class GitWriteContentTest(TestCase):
     def setUp(self):
@@ -173,6 +241,51 @@ class GitWriteContentTest(TestCase):
         self.assertTrue('1111' in commit.message)
         self.assertEqual(0, len(commit.parents))
 
+    def small_tree(self, a_text, b_text=None):
+        children = [Node(a_text, label=['1111', '1', 'a'])]
+        if b_text:
+            children.append(Node(b_text, label=['1111', '1', 'b']))
+        sect = Node('Section', label=['1111', '1'], children=children)
+        return Node('Root', label=['1111'], children=[sect])
+
+    def test_write_incremental(self):
+        """Only the files of changed nodes should be written and
+        committed"""
+        dir_path = os.path.join(self.tmpdir, "regulation", "1111")
+        GitWriteContent(self.tmpdir, "regulation", "1111", "v1").write(
+            self.small_tree('(a) A', '(b) B'))
+        with patch.object(GitWriteContent, 'node_text', autospec=True,
+                          side_effect=GitWriteContent.node_text) as node_text:
+            GitWriteContent(self.tmpdir, "regulation", "1111", "v2").write(
+                self.small_tree('(a) Changed', '(b) B'))
+            # root, section, and paragraph a
+            self.assertEqual(3, node_text.call_count)
+        commit = Repo(dir_path).head.commit
+        self.assertEqual(['1/a/index.md'], list(commit.stats.files.keys()))
+        with open(os.path.join(dir_path, '1', 'a', 'index.md')) as f:
+            self.assertTrue(f.read().endswith('(a) Changed'))
+
+        GitWriteContent(self.tmpdir, "regulation", "1111", "v3").write(
+            self.small_tree('(a) Changed'))
+        commit = Repo(dir_path).head.commit
+        self.assertEqual(set(['1/index.md', '1/b/index.md']),
+                         set(commit.stats.files.keys()))
+        self.assertFalse(os.path.exists(os.path.join(dir_path, '1', 'b')))
+
+    def test_write_no_manifest(self):
+        """If the manifest is missing, stale files should still be
+        removed"""
+        dir_path = os.path.join(self.tmpdir, "regulation", "1111")
+        GitWriteContent(self.tmpdir, "regulation", "1111", "v1").write(
+            self.small_tree('(a) A', '(b) B'))
+        os.remove(os.path.join(dir_path, '.git', GitWriteContent.MANIFEST))
+        GitWriteContent(self.tmpdir, "regulation", "1111", "v2").write(
+            self.small_tree('(a) A'))
+        self.assertFalse(os.path.exists(os.path.join(dir_path, '1', 'b')))
+        entries = [path for path, _ in Repo(dir_path).index.entries.keys()]
+        self.assertEqual(set(['index.md', '1/index.md', '1/a/index.md']),
+                         set(entries))
+
 
 class ClientTest(TestCase):
     def setUp(self):
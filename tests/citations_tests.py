@@ -1,8 +1,19 @@
 # vim: set encoding=utf-8
+import os
+import subprocess
+import sys
 from unittest import TestCase
 
-from regparser.citations import cfr_citations, internal_citations, Label
+from click.testing import CliRunner
+from mock import patch
+
+from regparser import citations as citations_module
+from regparser.citations import (
+    cfr_citations, CitationCache, CitationSpans, deserialize_citations,
+    internal_citations, Label, ParagraphCitation, remove_citation_overlaps,
+    select_encompassing_citations, serialize_citations)
 from regparser.tree.struct import Node
+import settings
 
 
 def to_text(citation, original_text):
@@ -371,6 +382,151 @@ class CitationsTest(TestCase):
             [dict(cfr_title='27', part='479', section=str(i))
              for i in (112, 114, 115, 116, 117, 118, 119)])
 
+    def test_select_encompassing_citations(self):
+        """Citations contained within others should be removed; those with
+        identical spans are kept. Order should be retained"""
+        def cit(full_start, full_end):
+            return ParagraphCitation(full_start, full_end, Label())
+        a, b, c, d = cit(10, 20), cit(0, 5), cit(12, 20), cit(10, 15)
+        e, f, g = cit(3, 8), cit(0, 5), cit(21, 30)
+        self.assertEqual(
+            select_encompassing_citations([a, b, c, d, e, f, g]),
+            [a, b, e, f, g])
+        self.assertEqual(select_encompassing_citations([]), [])
+
+    @patch('regparser.citations.internal_citations')
+    def test_citation_spans(self, internal_citations):
+        internal_citations.return_value = [
+            ParagraphCitation(20, 30, Label()),
+            ParagraphCitation(5, 10, Label()),
+            ParagraphCitation(7, 8, Label())]
+        spans = CitationSpans('text')
+        self.assertFalse(internal_citations.called)
+        for start, end, overlaps in ((0, 4, False), (0, 5, True),
+                                     (6, 7, True), (10, 12, True),
+                                     (11, 19, False), (12, 40, True),
+                                     (25, 26, True), (31, 40, False)):
+            self.assertEqual(overlaps, spans.overlaps(start, end))
+        self.assertEqual(1, internal_citations.call_count)
+
+        internal_citations.return_value = []
+        self.assertFalse(CitationSpans('text').overlaps(0, 100))
+
+    def test_remove_citation_overlaps(self):
+        text = 'Paragraph (a)(1) of this section; (b) something (1) or (c)'
+        markers = [('a', 10, 13), ('b', 34, 37), ('1', 48, 51),
+                   ('c', 55, 58)]
+        self.assertEqual(
+            [('b', 34, 37), ('1', 48, 51), ('c', 55, 58)],
+            remove_citation_overlaps(text, markers))
+
+        # Citations are found once and reused
+        spans = CitationSpans(text)
+        remove_citation_overlaps(text, markers, spans)
+        with patch('regparser.citations.internal_citations') as citations:
+            self.assertEqual(
+                [('b', 34, 37)],
+                remove_citation_overlaps(text, markers[:2], spans))
+            self.assertFalse(citations.called)
+
+
+class CitationCacheTests(TestCase):
+    def setUp(self):
+        citations_module._cache = CitationCache()
+
+    def tearDown(self):
+        citations_module._cache = CitationCache()
+
+    @patch('regparser.citations._internal_citations')
+    def test_memory(self, _internal_citations):
+        """Results should be reused when the text and context match"""
+        _internal_citations.return_value = ['result']
+        label = Label(part='111')
+        self.assertEqual(['result'], internal_citations('text', label))
+        self.assertEqual(['result'],
+                         internal_citations('text', Label(part='111')))
+        self.assertEqual(1, _internal_citations.call_count)
+
+        internal_citations('text', Label(part='222'))
+        internal_citations('text', label, require_marker=True)
+        internal_citations('text', label, title='12')
+        internal_citations('other text', label)
+        self.assertEqual(5, _internal_citations.call_count)
+
+    @patch('regparser.citations._internal_citations')
+    def test_memory_bounded(self, _internal_citations):
+        """Only the most recently used results should be kept"""
+        _internal_citations.return_value = []
+        with patch.object(settings, 'CITATION_CACHE_SIZE', 2):
+            for text in ('a', 'b', 'a', 'c', 'a', 'b'):
+                internal_citations(text)
+        # "b" was evicted by "c"
+        self.assertEqual(
+            ['a', 'b', 'c', 'b'],
+            [args[0] for args, _ in _internal_citations.call_args_list])
+
+    def test_serialization(self):
+        text = 'See paragraph (b) and comment 22(a)-3 and 12 CFR 111.22'
+        citations = internal_citations(text, Label(part='111', section='2'),
+                                       title='12')
+        citations += cfr_citations(text)
+        result = deserialize_citations(serialize_citations(citations))
+        self.assertEqual(len(citations), len(result))
+        for original, loaded in zip(citations, result):
+            self.assertEqual(original.label, loaded.label)
+            self.assertEqual(original.label.to_list(), loaded.label.to_list())
+            self.assertEqual(
+                (original.start, original.end, original.full_start,
+                 original.full_end, original.in_clause),
+                (loaded.start, loaded.end, loaded.full_start,
+                 loaded.full_end, loaded.in_clause))
+
+    def test_persist(self):
+        """If configured, results should be shared via the database"""
+        text = 'See paragraph (b)'
+        label = Label(part='111', section='2')
+        with CliRunner().isolated_filesystem(), patch.object(
+                settings, 'CITATION_CACHE_PERSIST', True):
+            expected = internal_citations(text, label, require_marker=True)
+            citations_module.flush_cache()
+
+            citations_module._cache = CitationCache()
+            with patch('regparser.citations._internal_citations') as parse:
+                result = internal_citations(text, label, require_marker=True)
+                self.assertFalse(parse.called)
+                internal_citations(text, label)
+                self.assertTrue(parse.called)
+        self.assertEqual([c.label for c in expected],
+                         [c.label for c in result])
+
+    def test_persist_other_directory(self):
+        """Persisting shouldn't depend on the working directory, even if the
+        parser was imported by relative paths"""
+        script = (
+            "import os, sys\n"
+            "from regparser.citations import flush_cache, "
+            "internal_citations, Label\n"
+            "import settings\n"
+            "settings.CITATION_CACHE_PERSIST = True\n"
+            "os.chdir(sys.argv[1])\n"
+            "internal_citations('See paragraph (b)', Label(part='111'))\n"
+            "flush_cache()\n")
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        with CliRunner().isolated_filesystem():
+            subprocess.check_call(
+                [sys.executable, '-c', script, os.getcwd()], cwd=root)
+            self.assertTrue(os.path.exists(CitationCache.DB_FILE))
+
+    def test_persist_without_source(self):
+        """If the grammars' source can't be found, results shouldn't be
+        stored"""
+        with CliRunner().isolated_filesystem(), patch.object(
+                settings, 'CITATION_CACHE_PERSIST', True), patch.object(
+                CitationCache, 'FINGERPRINT', None):
+            internal_citations('See paragraph (b)', Label(part='111'))
+            citations_module.flush_cache()
+            self.assertFalse(os.path.exists(CitationCache.DB_FILE))
+
 
 class CitationsLabelTest(TestCase):
     def test_using_default_schema(self):
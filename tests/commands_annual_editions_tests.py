@@ -78,6 +78,8 @@ class CommandsAnnualEditionsTests(TestCase):
             self.assertFalse(build_tree.called)
 
             # Simulate a change to an input file
+            entry.Entry('annual', '12', '1000', 2000).write(
+                '<ROOT>Changed</ROOT>')
             os.utime(str(entry.Annual('12', '1000', '2000')),
                      (time() + 1000, time() + 1000))
             annual_editions.process_if_needed('12', '1000', last_versions)
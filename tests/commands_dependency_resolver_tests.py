@@ -0,0 +1,118 @@
+from multiprocessing import Pool
+import os
+from unittest import TestCase
+
+from click.testing import CliRunner
+
+from regparser.commands import dependency_resolver
+# Register the resolvers for notices and rule changes
+from regparser.commands import parse_rule_changes, preprocess_notices
+from regparser.index import dependency, entry
+from regparser.notice.xml import NoticeXML
+
+
+class FileResolver(object):
+    """Stand-in for a DependencyResolver; "resolves" by writing files"""
+    SEQUENTIAL = False
+
+    def __init__(self, dependency_path, writes=None):
+        self.dependency_path = dependency_path
+        self.writes = writes or [dependency_path]
+
+    def resolution(self):
+        for path in self.writes:
+            with open(path, 'w') as f:
+                f.write('resolved')
+        with open('resolutions', 'a') as f:
+            f.write(self.dependency_path + '\n')
+
+
+class SequentialFileResolver(FileResolver):
+    SEQUENTIAL = True
+
+
+class PoolFileResolver(FileResolver):
+    """Resolutions may run processes of their own"""
+    def resolution(self):
+        pool = Pool(2)
+        try:
+            pool.map(abs, [-1, -2])
+        finally:
+            pool.close()
+            pool.join()
+        super(PoolFileResolver, self).resolution()
+
+
+class DependencyResolverTests(TestCase):
+    def test_plan_resolutions(self):
+        """All missing inputs near the failure should be found. Those with
+        missing inputs of their own should be resolved after them"""
+        tree_dir, rule_dir = entry.Tree('12', '1000'), entry.RuleChanges()
+        notice_dir = entry.Notice()
+        with CliRunner().isolated_filesystem():
+            (notice_dir / '3').write(NoticeXML('<ROOT />'))
+            with dependency.Graph() as deps:
+                for version_id in ('1', '2', '3'):
+                    deps.add(tree_dir / version_id, rule_dir / version_id)
+                    deps.add(rule_dir / version_id, notice_dir / version_id)
+                # Not related to the failure
+                deps.add(entry.Tree('12', '2000') / '4', notice_dir / '4')
+
+                missing = dependency.Missing(str(tree_dir / '1'),
+                                             str(rule_dir / '1'))
+                waves = dependency_resolver.plan_resolutions(missing, deps)
+
+            self.assertEqual(
+                [[str(notice_dir / '1'), str(notice_dir / '2'),
+                  str(rule_dir / '3')],
+                 [str(rule_dir / '1'), str(rule_dir / '2')]],
+                [[r.dependency_path for r in wave] for wave in waves])
+            self.assertTrue(isinstance(
+                waves[0][0], preprocess_notices.NoticeResolver))
+            self.assertTrue(isinstance(
+                waves[1][0], parse_rule_changes.RuleChangesResolver))
+            self.assertTrue(isinstance(
+                waves[0][2], parse_rule_changes.RuleChangesResolver))
+
+    def test_resolve_all(self):
+        """Resolutions should run (in separate processes) and their results
+        should be visible afterwards"""
+        with CliRunner().isolated_filesystem():
+            waves = [[FileResolver('a'), FileResolver('b')],
+                     [FileResolver('c')]]
+            self.assertTrue(dependency_resolver.resolve_all(waves, workers=2))
+            for path in ('a', 'b', 'c'):
+                self.assertTrue(os.path.exists(path))
+
+    def test_resolve_all_subprocesses(self):
+        """Resolutions which start processes of their own should work"""
+        with CliRunner().isolated_filesystem():
+            waves = [[PoolFileResolver('a'), PoolFileResolver('b'),
+                      FileResolver('c')]]
+            self.assertTrue(dependency_resolver.resolve_all(waves, workers=2))
+            for path in ('a', 'b', 'c'):
+                self.assertTrue(os.path.exists(path))
+
+    def test_resolve_all_sequential(self):
+        """Sequential resolutions should be skipped if an earlier resolution
+        already wrote their dependency"""
+        with CliRunner().isolated_filesystem():
+            with open('b', 'w') as f:
+                f.write('stale')
+            os.utime('b', (0, 0))
+            waves = [[SequentialFileResolver('a', ['a', 'b']),
+                      SequentialFileResolver('b')]]
+            self.assertTrue(dependency_resolver.resolve_all(waves, workers=2))
+            with open('resolutions') as f:
+                self.assertEqual('a\n', f.read())
+
+    def test_resolve_all_failure(self):
+        """Failing resolutions should be reported"""
+        class Failing(FileResolver):
+            def resolution(self):
+                raise ValueError()
+
+        with CliRunner().isolated_filesystem():
+            waves = [[Failing('a'), FileResolver('b')]]
+            self.assertFalse(dependency_resolver.resolve_all(waves))
+            self.assertTrue(os.path.exists('b'))
@@ -1,10 +1,13 @@
 from contextlib import contextmanager
+from datetime import date
 from time import time
 import os
 from unittest import TestCase
 
 from click.testing import CliRunner
-from regparser.commands.diffs import diffs
+from mock import patch
+from regparser.commands.diffs import blocks, diffs, TreeCache, version_pairs
+from regparser.history.versions import Version
 from regparser.index import entry
 from regparser.tree.struct import Node
 
@@ -47,7 +50,84 @@ class CommandsDiffsTests(TestCase):
 
             self.assert_diff_keys('v1', 'v2', ['update'])
 
-            # declare an input tree stale
+            # merely touching an input tree doesn't make it stale...
             os.utime(str(self.tree_dir / 'v1'), (time() + 1000, time() + 1000))
             self.cli.invoke(diffs, ['12', '1000'])
+            self.assert_diff_keys('v1', 'v2', ['update'])
+
+            # ...but changing its contents does
+            (self.tree_dir / 'v1').write(Node(text='Other', label=['1000']))
+            self.cli.invoke(diffs, ['12', '1000'])
             self.assert_diff_keys('v1', 'v2', ['1000'])
+
+    def test_diffs_adjacent(self):
+        """In adjacent mode, only diffs between neighboring versions are
+        computed"""
+        with self.integration_setup():
+            (self.tree_dir / 'v3').write(Node(text='V3V3V3', label=['1000']))
+            for idx, version_id in enumerate(('v1', 'v2', 'v3')):
+                entry.Version('12', '1000', version_id).write(Version(
+                    version_id, date(2001 + idx, 1, 1),
+                    date(2001 + idx, 1, 1)))
+            self.cli.invoke(diffs, ['12', '1000', '--adjacent'])
+
+            self.assert_diff_keys('v1', 'v2', ['1000'])
+            self.assert_diff_keys('v2', 'v1', ['1000'])
+            self.assert_diff_keys('v2', 'v3', ['1000'])
+            self.assert_diff_keys('v3', 'v2', ['1000'])
+            self.assertEqual(['v2'], list(self.diff_dir / 'v1'))
+            self.assertEqual(['v2'], list(self.diff_dir / 'v3'))
+
+    def test_version_pairs(self):
+        self.assertEqual(
+            [('v1', 'v2'), ('v2', 'v3'), ('v2', 'v1'), ('v3', 'v2')],
+            version_pairs(['v1', 'v2', 'v3'], adjacent=True))
+        self.assertEqual(9, len(version_pairs(['v1', 'v2', 'v3'], False)))
+
+    def test_blocks(self):
+        """Pairs should be split into blocks which need a bounded number of
+        trees"""
+        version_ids = ['v1', 'v2', 'v3', 'v4', 'v5']
+        pairs = version_pairs(version_ids, adjacent=False)
+        result = blocks(pairs, version_ids, 2)
+        self.assertEqual(9, len(result))
+        self.assertItemsEqual(pairs, sum(result, []))
+        self.assertEqual(
+            [('v1', 'v1'), ('v1', 'v2'), ('v2', 'v1'), ('v2', 'v2')],
+            result[0])
+        for block in result:
+            self.assertTrue(len(set(sum(block, ()))) <= 4)
+
+    def test_tree_cache(self):
+        """Trees should be evicted when over capacity"""
+        with self.integration_setup():
+            (self.tree_dir / 'v3').write(Node(text='V1V1V1', label=['1000']))
+            cache = TreeCache(entry.FrozenTree('12', '1000'), 2)
+            for version_id in ('v1', 'v2', 'v3'):
+                cache[version_id]
+            self.assertEqual(['v2', 'v3'], list(cache.trees))
+            self.assertTrue(cache.identical('v1', 'v3'))
+            self.assertFalse(cache.identical('v1', 'v2'))
+
+    def test_tree_cache_identical(self):
+        """Identical trees should be recognized without loading them"""
+        with self.integration_setup():
+            (self.tree_dir / 'v3').write(Node(text='V1V1V1', label=['1000']))
+            cache = TreeCache(entry.FrozenTree('12', '1000'), 2)
+            with patch.object(entry.FrozenTree, 'load_root') as load_root:
+                self.assertTrue(cache.identical('v1', 'v1'))
+                self.assertTrue(cache.identical('v1', 'v3'))
+                self.assertFalse(cache.identical('v1', 'v2'))
+                self.assertFalse(load_root.called)
+            self.assertEqual([], list(cache.trees))
+
+    def test_diffs_workers(self):
+        """Diffs should be computed when using multiple processes"""
+        with self.integration_setup():
+            self.cli.invoke(
+                diffs, ['12', '1000', '--workers', '2', '--block-size', '1'])
+
+            self.assert_diff_keys('v1', 'v1', [])
+            self.assert_diff_keys('v2', 'v2', [])
+            self.assert_diff_keys('v1', 'v2', ['1000'])
+            self.assert_diff_keys('v2', 'v1', ['1000'])
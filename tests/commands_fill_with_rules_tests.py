@@ -24,10 +24,10 @@ class CommandsFillWithRulesTests(TestCase):
             (tree_dir / '222').write(Node())
             (tree_dir / '555').write(Node())
 
-            deps = fill_with_rules.dependencies(
-                tree_dir, version_ids, '12', '1000')
-            with deps.dependency_db() as db:
-                graph = dict(db)    # copy
+            with fill_with_rules.dependencies(
+                    tree_dir, version_ids, '12', '1000') as deps:
+                with deps.dependency_db() as db:
+                    graph = dict(db)    # copy
 
             # First is skipped, as we can't build it from a rule
             self.assertNotIn(str(tree_dir / '111'), graph)
@@ -60,11 +60,11 @@ class CommandsFillWithRulesTests(TestCase):
         with self.cli.isolated_filesystem():
             tree_dir = entry.Tree('12', '1000')
 
-            deps = dependency.Graph()
-            deps.add(tree_dir / 111, entry.Annual(12, 1000, 2001))
-            deps.add(tree_dir / 222, entry.RuleChanges(222))
-            deps.add(tree_dir / 333, entry.RuleChanges(333))
-            deps.add(tree_dir / 333, entry.Version(333))
-            derived = fill_with_rules.derived_from_rules(
-                ['111', '222', '333', '444'], deps, tree_dir)
+            with dependency.Graph() as deps:
+                deps.add(tree_dir / 111, entry.Annual(12, 1000, 2001))
+                deps.add(tree_dir / 222, entry.RuleChanges(222))
+                deps.add(tree_dir / 333, entry.RuleChanges(333))
+                deps.add(tree_dir / 333, entry.Version(333))
+                derived = fill_with_rules.derived_from_rules(
+                    ['111', '222', '333', '444'], deps, tree_dir)
             self.assertEqual(derived, ['222', '333'])
@@ -32,14 +32,14 @@ class CommandsLayersTests(TestCase):
             (tree_dir / '3333').write('tree3')
             sxs_source_names.return_value = ['1111']
 
-            deps = layers.dependencies(tree_dir, layer_dir, version_dir)
+            with layers.dependencies(tree_dir, layer_dir,
+                                     version_dir) as deps:
+                with deps.dependency_db() as db:
+                    graph = dict(db)    # copy
             simple_layers = [
                 'external-citations', 'internal-citations', 'toc',
                 'interpretations', 'terms', 'paragraph-markers', 'keyterms',
                 'formatting', 'graphics']
-
-            with deps.dependency_db() as db:
-                graph = dict(db)    # copy
             for version_id in ('1111', '2222', '3333'):
                 for layer_name in simple_layers:
                     self.assertEqual(
@@ -98,3 +98,53 @@ class CommandsLayersTests(TestCase):
             self.assertEqual(meta.call_args[1].get('notices'), [])
             self.assertEqual(analyses.call_args[1].get('notices'),
                              "Fake Notices")
+
+    @patch('regparser.commands.layers.entry.Tree')
+    def test_cached_tree(self, Tree):
+        """Trees should be read once, with only the most recently used
+        retained"""
+        Tree.return_value.read.side_effect = lambda: Mock()
+        with patch.dict(layers._tree_cache, clear=True):
+            first = layers.cached_tree('12', '1000', '1111')
+            self.assertTrue(first is layers.cached_tree('12', '1000', '1111'))
+            self.assertEqual(Tree.return_value.read.call_count, 1)
+
+            for version_id in ('2222', '3333', '4444'):
+                layers.cached_tree('12', '1000', version_id)
+            self.assertEqual(len(layers._tree_cache), layers.TREE_CACHE_SIZE)
+            self.assertFalse(
+                first is layers.cached_tree('12', '1000', '1111'))
+
+    def test_layers_workers(self):
+        """When run with multiple workers, all stale layers for all versions
+        should be written"""
+        with self.cli.isolated_filesystem():
+            for version_id in ('1111', '2222'):
+                entry.Version('12', '1000', version_id).write(Version(
+                    version_id, date(2000, 1, 1), date(2000, 1, 1)))
+                entry.Tree('12', '1000', version_id).write(
+                    Node(version_id, label=['1000']))
+
+            with patch.dict(layers.ALL_LAYERS, clear=True):
+                layers.ALL_LAYERS['first'] = FakeLayer
+                layers.ALL_LAYERS['second'] = FakeLayer
+                result = self.cli.invoke(
+                    layers.layers, ['12', '1000', '--workers', '2'])
+            self.assertEqual(result.exit_code, 0)
+
+            layer_dir = entry.Layer('12', '1000')
+            for version_id in ('1111', '2222'):
+                self.assertEqual(['first', 'second'],
+                                 list(layer_dir / version_id))
+                self.assertEqual(
+                    (layer_dir / version_id / 'first').read(),
+                    {'text': version_id})
+
+
+class FakeLayer(object):
+    """Module-level (and hence picklable) stand-in for a layer"""
+    def __init__(self, tree, *args, **kwargs):
+        self.tree = tree
+
+    def build(self):
+        return {'text': self.tree.text}
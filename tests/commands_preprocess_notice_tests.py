@@ -92,12 +92,12 @@ class CommandsPreprocessNoticeTests(HttpMixin, XMLBuilderMixin, TestCase):
         with cli.isolated_filesystem():
             cli.invoke(preprocess_notice, ['1234-5678'])
             entry_str = str(entry.Notice() / '1234-5678')
-            with dependency.Graph().dependency_db() as db:
+            with dependency.Graph() as deps, deps.dependency_db() as db:
                 self.assertTrue(entry_str in db)
 
         notice_xmls_for_url.return_value[0].source = 'http://example.com'
         with cli.isolated_filesystem():
             cli.invoke(preprocess_notice, ['1234-5678'])
             entry_str = str(entry.Notice() / '1234-5678')
-            with dependency.Graph().dependency_db() as db:
+            with dependency.Graph() as deps, deps.dependency_db() as db:
                 self.assertFalse(entry_str in db)
@@ -0,0 +1,155 @@
+from datetime import date
+from unittest import TestCase
+
+from click.testing import CliRunner
+from mock import patch
+import requests
+
+from regparser.commands import preprocess_notices
+from regparser.index import dependency, entry
+from regparser.notice.xml import NoticeXML
+from tests.xml_builder import LXMLBuilder, XMLBuilderMixin
+import settings
+
+
+class CommandsPreprocessNoticesTests(XMLBuilderMixin, TestCase):
+    def setUp(self):
+        super(CommandsPreprocessNoticesTests, self).setUp()
+        self.cli = CliRunner()
+        fetch_p = patch('regparser.commands.preprocess_notices.'
+                        'federalregister.fetch_notice_json')
+        self.fetch_notice_json = fetch_p.start()
+        self.addCleanup(fetch_p.stop)
+        sources_p = patch('regparser.commands.preprocess_notices.'
+                          'xml_sources_for_url')
+        self.xml_sources_for_url = sources_p.start()
+        self.addCleanup(sources_p.stop)
+        self.xml_sources_for_url.side_effect = lambda url: [
+            (self.example_xml(), url)]
+
+    def example_xml(self, effdate_str=""):
+        self.tree = LXMLBuilder()
+        with self.tree.builder("ROOT") as root:
+            root.CONTENT()
+            root.P()
+            with root.EFFDATE() as effdate:
+                effdate.P(effdate_str)
+        return self.tree.render_string()
+
+    def expect_notices(self, *document_numbers):
+        self.fetch_notice_json.return_value = [
+            {'document_number': document_number,
+             'effective_on': '2008-08-08', 'publication_date': '2007-07-07',
+             'full_text_xml_url': 'http://example.com/' + document_number,
+             'volume': 45}
+            for document_number in document_numbers]
+
+    def test_writes_all(self):
+        """Each final rule should be written"""
+        self.expect_notices('111-11', '222-22', '333-33')
+        with self.cli.isolated_filesystem():
+            result = self.cli.invoke(preprocess_notices.preprocess_notices,
+                                     ['12', '1000'])
+            self.assertEqual(0, result.exit_code)
+            self.assertEqual(['111-11', '222-22', '333-33'],
+                             list(entry.Notice()))
+            notice = entry.Notice('222-22').read()
+            self.assertEqual(date(2008, 8, 8), notice.effective)
+            self.assertEqual(date(2007, 7, 7), notice.published)
+
+    def test_workers(self):
+        """Notices can be processed in multiple processes"""
+        self.expect_notices('111-11', '222-22', '333-33')
+        with self.cli.isolated_filesystem():
+            result = self.cli.invoke(preprocess_notices.preprocess_notices,
+                                     ['12', '1000', '--workers', '2'])
+            self.assertEqual(0, result.exit_code)
+            self.assertEqual(['111-11', '222-22', '333-33'],
+                             list(entry.Notice()))
+
+    def test_skips_existing(self):
+        """Notices which are already present (including split notices)
+        shouldn't be fetched again, unless requested"""
+        self.expect_notices('111-11', '222-22')
+        with self.cli.isolated_filesystem():
+            entry.Notice('111-11_20010101').write(
+                NoticeXML(self.example_xml()))
+            self.cli.invoke(preprocess_notices.preprocess_notices,
+                            ['12', '1000'])
+            self.assertEqual(['http://example.com/222-22'],
+                             [args[0] for args, _
+                              in self.xml_sources_for_url.call_args_list])
+
+            self.xml_sources_for_url.reset_mock()
+            self.cli.invoke(preprocess_notices.preprocess_notices,
+                            ['12', '1000', '--all'])
+            self.assertEqual(2, self.xml_sources_for_url.call_count)
+
+    def test_local_dependencies(self):
+        """Notices from local XML should depend on that XML"""
+        self.expect_notices('111-11')
+        self.xml_sources_for_url.side_effect = lambda url: [
+            (self.example_xml(), './here.xml')]
+        with self.cli.isolated_filesystem():
+            self.cli.invoke(preprocess_notices.preprocess_notices,
+                            ['12', '1000'])
+            with dependency.Graph() as deps, deps.dependency_db() as db:
+                self.assertEqual(set(['./here.xml']),
+                                 db[str(entry.Notice('111-11'))])
+
+    def test_bad_notice(self):
+        """A notice which can't be processed shouldn't prevent the others"""
+        self.expect_notices('111-11', '222-22')
+        self.fetch_notice_json.return_value[0]['effective_on'] = None
+        with self.cli.isolated_filesystem():
+            self.cli.invoke(preprocess_notices.preprocess_notices,
+                            ['12', '1000'])
+            self.assertEqual(['222-22'], list(entry.Notice()))
+
+    def test_fetch_failure(self):
+        """A notice which can't be fetched shouldn't prevent the others"""
+        self.expect_notices('111-11', '222-22')
+
+        def sources(url):
+            if '111-11' in url:
+                raise requests.ConnectionError()
+            return [(self.example_xml(), url)]
+        self.xml_sources_for_url.side_effect = sources
+        with self.cli.isolated_filesystem():
+            self.cli.invoke(preprocess_notices.preprocess_notices,
+                            ['12', '1000'])
+            self.assertEqual(['222-22'], list(entry.Notice()))
+
+    @patch('regparser.commands.preprocess_notices.preprocess_notice')
+    @patch('regparser.commands.preprocess_notices.federalregister.meta_data')
+    def test_resolver_single(self, meta_data, preprocess_notice):
+        """By default, resolving a missing notice preprocesses only that
+        notice"""
+        resolver = preprocess_notices.NoticeResolver(
+            str(entry.Notice('222-22_20080808')))
+        self.assertFalse(resolver.SEQUENTIAL)
+        with self.cli.isolated_filesystem():
+            resolver.resolution()
+            self.assertFalse(meta_data.called)
+            self.assertFalse(self.fetch_notice_json.called)
+            preprocess_notice.main.assert_called_once_with(
+                ['222-22'], standalone_mode=False)
+
+    @patch('regparser.commands.preprocess_notices.preprocess_notice')
+    @patch('regparser.commands.preprocess_notices.federalregister.meta_data')
+    @patch.object(settings, 'BULK_NOTICE_WORKERS', 1)
+    def test_resolver(self, meta_data, preprocess_notice):
+        """If requested, resolving a missing notice should preprocess all of
+        the notices for the affected regulation"""
+        self.expect_notices('111-11', '222-22')
+        meta_data.return_value = {
+            'cfr_references': [{'title': 12, 'part': 1000}]}
+        resolver = preprocess_notices.NoticeResolver(
+            str(entry.Notice('222-22_20080808')))
+        self.assertTrue(resolver.has_resolution())
+        with self.cli.isolated_filesystem():
+            resolver.resolution()
+            self.assertEqual(['111-11', '222-22'], list(entry.Notice()))
+            self.assertEqual('222-22', meta_data.call_args[0][0])
+            self.assertEqual(12, self.fetch_notice_json.call_args[0][0])
+            self.assertTrue(preprocess_notice.main.called)
@@ -141,6 +141,7 @@ class CommandsVersionsTests(TestCase):
             self.assertFalse(write_to_disk.called)
 
             # Simulate a change to an input file
+            entry.Entry('notice_xml', '222').write('changed')
             os.utime(str(entry.Notice('222')),
                      (time() + 1000, time() + 1000))
             versions.write_if_needed(
@@ -1,23 +1,30 @@
 from datetime import date
+import json
 import os
+import re
 import tempfile
 import shutil
 from unittest import TestCase
 
 from click.testing import CliRunner
+import httpretty
+from mock import patch
 
-from regparser.commands.write_to import write_to
+from regparser.commands.write_to import derive_diffs, write_to
 from regparser.history.versions import Version
 from regparser.index import entry
 from regparser.tree.struct import Node
+from tests.http_mixin import HttpMixin
 
 
-class CommandsWriteToTests(TestCase):
+class CommandsWriteToTests(HttpMixin, TestCase):
     def setUp(self):
+        super(CommandsWriteToTests, self).setUp()
         self.cli = CliRunner()
         self.tmpdir = tempfile.mkdtemp()
 
     def tearDown(self):
+        super(CommandsWriteToTests, self).tearDown()
         shutil.rmtree(self.tmpdir)
 
     def add_versions(self):
@@ -93,3 +100,131 @@ class CommandsWriteToTests(TestCase):
             # v0 is skipped as there is no corresponding version
             self.assert_file_exists('notice', 'v1')
             self.assert_file_exists('notice', 'v2')
+
+    def test_derived_diffs(self):
+        """If only diffs between adjacent versions are present, the others
+        should be derived from them"""
+        with self.cli.isolated_filesystem():
+            self.add_versions()
+            entry.Tree('12', '1000', 'v1').write(Node('v1', label=['1000']))
+            self.add_trees()
+            diff_dir = entry.Diff('12', '1000')
+            (diff_dir / 'v1' / 'v2').write(
+                {'1000': {'op': 'modified', 'text': [('delete', 1, 2)]}})
+            (diff_dir / 'v2' / 'v3').write(
+                {'1000-a': {'op': 'deleted'}})
+            self.cli.invoke(write_to, ['12', '1000', self.tmpdir])
+
+            self.assert_file_exists('diff', '1000', 'v1', 'v2')
+            self.assert_file_exists('diff', '1000', 'v2', 'v3')
+            self.assert_file_exists('diff', '1000', 'v1', 'v3')
+            self.assert_file_exists('diff', '1000', 'v2', 'v2')
+            # reverse diffs are missing, so can't be derived
+            path = os.path.join(self.tmpdir, 'diff', '1000', 'v3', 'v1')
+            self.assertFalse(os.path.exists(path))
+
+            with open(os.path.join(self.tmpdir, 'diff', '1000', 'v1',
+                                   'v3')) as f:
+                self.assertEqual(
+                    json.load(f),
+                    {'1000': {'op': 'modified', 'text': [['delete', 1, 2]]},
+                     '1000-a': {'op': 'deleted'}})
+
+    def test_derive_diffs(self):
+        """Diffs should be derived in both directions, folding each link in
+        only once and stopping at the first missing link"""
+        diffs = {('v1', 'v2'): {'1000-a': {'op': 'deleted'}},
+                 ('v2', 'v3'): {'1000-b': {'op': 'deleted'}},
+                 ('v3', 'v4'): {'1000-c': {'op': 'deleted'}},
+                 ('v2', 'v1'): {'1000-d': {'op': 'deleted'}}}
+        requested = []
+
+        def adjacent_diff(lhs_id, rhs_id):
+            requested.append((lhs_id, rhs_id))
+            return diffs.get((lhs_id, rhs_id))
+
+        derived = derive_diffs('12', '1000', ['v1', 'v2', 'v3', 'v4'], 'v2',
+                               adjacent_diff)
+        self.assertEqual(
+            derived,
+            {'v1': {'1000-d': {'op': 'deleted'}},
+             'v2': {},
+             'v3': {'1000-b': {'op': 'deleted'}},
+             'v4': {'1000-b': {'op': 'deleted'},
+                    '1000-c': {'op': 'deleted'}}})
+        self.assertEqual(sorted(requested),
+                         [('v2', 'v1'), ('v2', 'v3'), ('v3', 'v4')])
+
+        requested[:] = []
+        derived = derive_diffs('12', '1000', ['v1', 'v2', 'v3', 'v4'], 'v4',
+                               adjacent_diff)
+        self.assertEqual(derived, {'v4': {}})
+        self.assertEqual(requested, [('v4', 'v3')])
+
+    def test_failures_reported(self):
+        """If any documents couldn't be written, we should say so and exit
+        with an error"""
+        with self.cli.isolated_filesystem():
+            self.add_versions()
+            with patch('regparser.commands.write_to.Client') as Client:
+                Client.return_value.finish.return_value = [
+                    ('http://example.com/notice/v1', 'Boom')]
+                result = self.cli.invoke(
+                    write_to, ['12', '1000', 'http://example.com'])
+            self.assertNotEqual(result.exit_code, 0)
+            self.assertIn('http://example.com/notice/v1', result.output)
+            self.assertIn('1 documents could not be written', result.output)
+
+    def test_unchanged_skipped(self):
+        """Documents which haven't changed since they were last sent to an
+        API needn't be sent again, unless requested"""
+        httpretty.register_uri(httpretty.POST, re.compile('.*'))
+        with self.cli.isolated_filesystem():
+            self.add_versions()
+            self.add_notices()
+            args = ['12', '1000', 'http://example.com', '--workers', '1']
+            result = self.cli.invoke(write_to, args)
+            self.assertIn('Writing notice v1', result.output)
+            self.assertIn('Writing notice v2', result.output)
+
+            entry.SxS('v2').write({'2': 'changed'})
+            result = self.cli.invoke(write_to, args)
+            self.assertNotIn('Writing notice v1', result.output)
+            self.assertIn('Writing notice v2', result.output)
+            self.assertIn('Skipped 1 unchanged', result.output)
+
+            result = self.cli.invoke(write_to, args + ['--all'])
+            self.assertIn('Writing notice v1', result.output)
+            self.assertIn('Writing notice v2', result.output)
+
+            request = httpretty.last_request()
+            self.assertEqual('/notice/v2', request.path)
+            self.assertEqual({'2': 'changed'}, json.loads(request.body))
+
+    def test_failures_not_recorded(self):
+        """Documents which failed to be written will be retried next time"""
+        httpretty.register_uri(httpretty.POST, re.compile('.*'))
+        with self.cli.isolated_filesystem():
+            self.add_versions()
+            self.add_notices()
+            args = ['12', '1000', 'http://example.com', '--workers', '1']
+            with patch('regparser.commands.write_to.Client.finish') as finish:
+                finish.return_value = [
+                    ('http://example.com/notice/v1', 'Boom')]
+                self.cli.invoke(write_to, args)
+            result = self.cli.invoke(write_to, args)
+            self.assertIn('Writing notice v1', result.output)
+            self.assertNotIn('Writing notice v2', result.output)
+
+    def test_files_always_written(self):
+        """Files on disk may have been removed since they were written, so
+        they are not skipped"""
+        with self.cli.isolated_filesystem():
+            self.add_versions()
+            self.add_notices()
+            args = ['12', '1000', self.tmpdir]
+            self.cli.invoke(write_to, args)
+            os.remove(os.path.join(self.tmpdir, 'notice', 'v1'))
+            result = self.cli.invoke(write_to, args)
+            self.assertIn('Writing notice v1', result.output)
+            self.assert_file_exists('notice', 'v1')
@@ -1,5 +1,6 @@
 from unittest import TestCase
 
+from lxml import etree
 from mock import patch
 
 from regparser import content
@@ -17,8 +18,10 @@ class ContentTests(TestCase):
 class MacrosTests(TestCase):
     def setUp(self):
         self._original_macros = getattr(settings, 'MACROS_SOURCES', None)
+        content.reload()
 
     def tearDown(self):
+        content.reload()
         if (self._original_macros is None and
                 hasattr(settings, 'MACROS_SOURCES')):
             del settings.MACROS_SOURCES
@@ -40,6 +43,24 @@ class MacrosTests(TestCase):
         self.assertEqual(pairs, [('a', 'b'), ('c', 'd'),    # source1
                                  ('a', 'b'), ('c', 'd')])   # source2
 
+    @patch('regparser.content._try_to_load')
+    def test_compiled(self, try_to_load):
+        """Macros should be parsed once and reloaded on request"""
+        try_to_load.return_value = [('//A', '<B/><C>c</C>')]
+        settings.MACROS_SOURCES = ['source']
+
+        ((xpath, replacement),) = content.Macros().compiled()
+        self.assertEqual(['B', 'C'], [el.tag for el in replacement])
+        xml = etree.fromstring('<ROOT><A/><D/></ROOT>')
+        self.assertEqual(['A'], [el.tag for el in xpath(xml)])
+        self.assertTrue(content.Macros().compiled() is
+                        content.Macros().compiled())
+        self.assertEqual(1, try_to_load.call_count)
+
+        content.reload()
+        content.Macros().compiled()
+        self.assertEqual(2, try_to_load.call_count)
+
 
 class GetterBase(object):
     """Shared base class for 'getter' content. See below for examples.
@@ -48,12 +69,14 @@ class GetterBase(object):
 
     def setUp(self):
         self._original = getattr(settings, self.settings_key, None)
+        content.reload()
 
     def content_obj(self):
         """Overridden in children"""
         raise NotImplemented
 
     def tearDown(self):
+        content.reload()
         if (self._original is None and hasattr(settings, self.settings_key)):
             delattr(settings, self.settings_key)
         else:
@@ -79,6 +102,24 @@ class GetterBase(object):
         self.assertEqual(None, overrides.get('other'))
         self.assertEqual('foo', overrides.get('other', 'foo'))
 
+    @patch('regparser.content._try_to_load')
+    def test_loaded_once(self, try_to_load):
+        """Sources should only be loaded once, unless the setting changes
+        or they are reloaded"""
+        try_to_load.return_value = {'a': 'b'}
+        setattr(settings, self.settings_key, ['source1', 'source2'])
+        for _ in range(3):
+            self.assertEqual('b', self.content_obj().get('a'))
+        self.assertEqual(2, try_to_load.call_count)
+
+        setattr(settings, self.settings_key, ['source1'])
+        self.assertEqual('b', self.content_obj().get('a'))
+        self.assertEqual(3, try_to_load.call_count)
+
+        content.reload()
+        self.assertEqual('b', self.content_obj().get('a'))
+        self.assertEqual(4, try_to_load.call_count)
+
 
 class ImageOverridesTests(GetterBase, TestCase):
     settings_key = 'OVERRIDES_SOURCES'
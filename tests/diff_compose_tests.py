@@ -0,0 +1,149 @@
+import json
+from unittest import TestCase
+
+from regparser.diff import compose
+from regparser.diff.text import get_opcodes
+from regparser.diff.tree import changes_between, label_opcodes
+from regparser.tree.struct import FrozenNode, walk
+
+
+class DiffComposeTests(TestCase):
+    def test_compose_text_opcodes(self):
+        """Composed opcodes should convert the first text into the last"""
+        texts = [u'Some text here', u'Some new text here',
+                 u'Other new text', u'', u'Fresh start']
+        for first, second, third in zip(texts, texts[1:], texts[2:]):
+            composed = compose.compose_text_opcodes(
+                get_opcodes(first, second), get_opcodes(second, third))
+            self.assertEqual(third, compose.apply_opcodes(first, composed))
+
+    def test_compose_text_opcodes_format(self):
+        """Replacements should be represented as delete-insert pairs, as in
+        get_opcodes"""
+        composed = compose.compose_text_opcodes(
+            get_opcodes('aaa bbb ccc', 'aaa xxx ccc'),
+            get_opcodes('aaa xxx ccc', 'aaa yyy ccc'))
+        self.assertEqual([[('delete', 4, 7), ('insert', 4, 'yyy')]],
+                         composed)
+
+    def test_compose_child_opcodes(self):
+        """Composed child opcodes should convert the first list of labels
+        into the last, covering the whole of the original"""
+        first, second, third = ['a', 'b', 'c'], ['a', 'c', 'd'], ['z', 'c']
+        composed = compose.compose_child_opcodes(
+            list(label_opcodes(first, second)),
+            list(label_opcodes(second, third)))
+        self.assertEqual(third, compose.apply_opcodes(first, composed))
+        self.assertEqual(
+            [('delete', 0, 2), ('insert', 0, ['z']), ('equal', 2, 3)],
+            composed)
+
+    def assert_chain_matches(self, *trees):
+        """Composing the diffs between adjacent trees should match the diff
+        between the first and last trees. Compare the serialized forms, as
+        the composition needn't preserve tuples vs. lists"""
+        chain = [dict(changes_between(lhs, rhs))
+                 for lhs, rhs in zip(trees, trees[1:])]
+        expected = dict(changes_between(trees[0], trees[-1]))
+        self.assertEqual(json.loads(json.dumps(expected)),
+                         json.loads(json.dumps(compose.compose_chain(chain))))
+
+    def test_compose_chain(self):
+        """Changes to different nodes, additions and deletions should all be
+        preserved"""
+        a = FrozenNode('a', label=['1', 'a'])
+        b = FrozenNode('b', label=['1', 'b'])
+        b2 = FrozenNode('b2', label=['1', 'b'])
+        c = FrozenNode('c', label=['1', 'c'])
+        self.assert_chain_matches(
+            FrozenNode('root', label=['1'], children=[a, b]),
+            FrozenNode('root', label=['1'], children=[a, b2]),
+            FrozenNode('root2', label=['1'], children=[b2, c]))
+
+    def test_compose_chain_appended(self):
+        """Labels inserted by adjacent diffs are merged; this should work
+        without a round trip through JSON (which converts tuples to
+        lists)"""
+        a, b, c, d = [FrozenNode(l, label=['1', l]) for l in 'abcd']
+        self.assert_chain_matches(
+            FrozenNode(label=['1'], children=[a]),
+            FrozenNode(label=['1'], children=[a, b]),
+            FrozenNode(label=['1'], children=[a, b, c]),
+            FrozenNode(label=['1'], children=[a, b, c, d]))
+
+    def test_compose_added_then_modified(self):
+        """If a node was added and then modified, we should see only the
+        final version as added"""
+        b = FrozenNode('b', label=['1', 'b'])
+        b2 = FrozenNode('b2', title='Title', label=['1', 'b'])
+        self.assert_chain_matches(
+            FrozenNode(label=['1']),
+            FrozenNode(label=['1'], children=[b]),
+            FrozenNode(label=['1'], children=[b2]))
+
+    def test_compose_reverted(self):
+        """A change composed with its revert should leave no trace"""
+        a = FrozenNode('a', label=['1', 'a'])
+        a2 = FrozenNode('a2', title='Title', label=['1', 'a'])
+        b = FrozenNode('b', label=['1', 'b'])
+        lhs = FrozenNode('root', label=['1'], children=[a, b])
+        rhs = FrozenNode('root2', label=['1'], children=[b, a2])
+        chain = [dict(changes_between(lhs, rhs)),
+                 dict(changes_between(rhs, lhs))]
+        originals = {}
+        walk(lhs, lambda node: originals.setdefault(node.label_id, node))
+        result = compose.compose_chain(chain, originals.get)
+        self.assertEqual(dict(changes_between(lhs, lhs)), result)
+
+        # Without the originals, we can still drop changes which are
+        # trivially undone
+        added = lhs.clone(children=[a, b, FrozenNode('c', label=['1', 'c'])])
+        result = compose.compose_chain([dict(changes_between(lhs, added)),
+                                        dict(changes_between(added, lhs))])
+        self.assertEqual({}, result)
+
+    def test_compose_added_then_modified_tagged_text(self):
+        """Tagged text which mirrors the text follows its modifications;
+        markup which can't be carried forward is dropped"""
+        root = FrozenNode(label=['1'])
+        b = FrozenNode('b', label=['1', 'b'], tagged_text='b')
+        b2 = FrozenNode('b2', label=['1', 'b'], tagged_text='b2')
+        self.assert_chain_matches(root, root.clone(children=[b]),
+                                  root.clone(children=[b2]))
+
+        b = FrozenNode('b', label=['1', 'b'], tagged_text='<E>b</E>')
+        result = compose.compose_chain([
+            dict(changes_between(root, root.clone(children=[b]))),
+            dict(changes_between(root.clone(children=[b]),
+                                 root.clone(children=[b2])))])
+        self.assertEqual('b2', result['1-b']['node']['text'])
+        self.assertIsNone(result['1-b']['node']['tagged_text'])
+
+    def test_compose_added_then_deleted(self):
+        """If a node was added and then deleted, it shouldn't appear"""
+        root = FrozenNode('root', label=['1'])
+        b = FrozenNode('b', label=['1', 'b'])
+        result = compose.compose_chain([
+            dict(changes_between(root, root.clone(children=[b]))),
+            dict(changes_between(root.clone(children=[b]), root))])
+        self.assertFalse('1-b' in result)
+
+    def test_compose_deleted_then_readded(self):
+        """If a node was deleted and re-added, we need the original to
+        determine the changes"""
+        b = FrozenNode('b', label=['1', 'b'])
+        b2 = FrozenNode('b2', label=['1', 'b'])
+        trees = [FrozenNode(label=['1'], children=[b]),
+                 FrozenNode(label=['1']),
+                 FrozenNode(label=['1'], children=[b2])]
+        chain = [dict(changes_between(lhs, rhs))
+                 for lhs, rhs in zip(trees, trees[1:])]
+
+        result = compose.compose_chain(chain, {'1-b': b}.get)
+        self.assertEqual(result['1-b'],
+                         {'op': 'modified',
+                          'text': get_opcodes('b', 'b2')})
+
+        # Without the original, the node appears as added
+        result = compose.compose_chain(chain)
+        self.assertEqual(result['1-b']['op'], 'added')
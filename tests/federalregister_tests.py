@@ -1,6 +1,8 @@
+import json
 import re
 from unittest import TestCase
 
+import httpretty
 from mock import patch
 
 from regparser import federalregister
@@ -8,6 +10,14 @@ from tests.http_mixin import HttpMixin
 
 
 class FederalRegisterTest(HttpMixin, TestCase):
+    def setUp(self):
+        super(FederalRegisterTest, self).setUp()
+        federalregister._known_meta_data.clear()
+
+    def tearDown(self):
+        super(FederalRegisterTest, self).tearDown()
+        federalregister._known_meta_data.clear()
+
     @patch('regparser.federalregister.build_notice')
     def test_fetch_notices(self, build_note):
         self.expect_json_http({"results": [{"some": "thing"},
@@ -43,3 +53,65 @@ class FederalRegisterTest(HttpMixin, TestCase):
         """If a document isn't present, expect an exception"""
         self.expect_json_http(status=404)
         self.assertRaises(Exception, federalregister.meta_data, 'doc-num')
+
+    def test_fetch_notice_json_pages(self):
+        """All pages of search results should be requested"""
+        self._expect_http(responses=[
+            httpretty.Response(json.dumps({
+                'results': [{'document_number': '1'}],
+                'next_page_url': 'http://example.com/page/2'})),
+            httpretty.Response(json.dumps({
+                'results': [{'document_number': '2'}]}))])
+
+        results = federalregister.fetch_notice_json(23, 1222)
+        self.assertEqual(['1', '2'], [r['document_number'] for r in results])
+        self.assertEqual(
+            ['1', '2'],
+            [r.querystring['page'][0]
+             for r in httpretty.httpretty.latest_requests])
+
+    def test_fetch_notice_json_empty_page(self):
+        """If a page is empty, we shouldn't continue requesting"""
+        self.expect_json_http({'results': [],
+                               'next_page_url': 'http://example.com/page/2'})
+        self.assertEqual([], federalregister.fetch_notice_json(23, 1222))
+        self.assertEqual(1, len(httpretty.httpretty.latest_requests))
+
+    def test_meta_data_from_search(self):
+        """Meta data found in search results shouldn't be requested again,
+        unless we need fields which weren't present"""
+        self.expect_json_http({'results': [
+            {'document_number': '1234-56', 'volume': 11, 'type': 'Rule'}]})
+        federalregister.fetch_notice_json(23, 1222)
+        self.assertEqual(1, len(httpretty.httpretty.latest_requests))
+
+        self.assertEqual({'volume': 11},
+                         federalregister.meta_data('1234-56', ['volume']))
+        self.assertEqual(1, len(httpretty.httpretty.latest_requests))
+
+        self.expect_json_http({'volume': 11, 'citation': 'cite'},
+                              uri=re.compile(".*/articles/1234-56"))
+        federalregister.meta_data('1234-56', ['volume', 'citation'])
+        self.assertEqual(2, len(httpretty.httpretty.latest_requests))
+
+    @patch('regparser.federalregister.META_DATA_CACHE_SIZE', 2)
+    def test_meta_data_from_search_bounded(self):
+        """Only the most recently used search results should be kept"""
+        self.expect_json_http({'results': [
+            {'document_number': '1', 'volume': 1},
+            {'document_number': '2', 'volume': 2}]})
+        federalregister.fetch_notice_json(23, 1222)
+        federalregister.meta_data('1', ['volume'])
+        self.expect_json_http({'results': [
+            {'document_number': '3', 'volume': 3}]})
+        federalregister.fetch_notice_json(23, 1223)
+        self.assertEqual(['1', '3'],
+                         list(federalregister._known_meta_data.keys()))
+
+    @patch('regparser.federalregister.API_BASE', 'http://localhost:8000/')
+    def test_api_base(self):
+        """Requests should be sent to the configured API"""
+        self.expect_json_http({"some": "value"},
+                              uri="http://localhost:8000/articles/1234-56")
+        self.assertEqual({"some": "value"},
+                         federalregister.meta_data("1234-56"))
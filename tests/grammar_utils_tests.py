@@ -32,3 +32,43 @@ class QuickSearchableTests(TestCase):
             "hey you there! do you see this? there is here youthere")
         self._compare_search(pyparsing.Regex(r'\d+'),
                              "this thing 123 more l337 h47p")
+
+
+class MultiSearchableTests(TestCase):
+    def test_scan(self):
+        """Expect the same results as searching for each grammar in turn,
+        including grammars which share an initial regex"""
+        grammars = [
+            utils.QuickSearchable(pyparsing.Literal("the")),
+            utils.QuickSearchable(pyparsing.Literal("the") + "term"),
+            utils.QuickSearchable(pyparsing.Regex(r'\d+')),
+            utils.QuickSearchable(pyparsing.Regex(r'\d+') + "CFR"),
+            utils.QuickSearchable(
+                pyparsing.WordStart() + pyparsing.Literal("term")),
+        ]
+        text = "the term 12 CFR 13 thermal the term 1 2 3 CFR midterm"
+        multi = utils.MultiSearchable(grammars)
+        self.assertEqual(
+            [[str(m) for m in gram.scanString(text)] for gram in grammars],
+            [[str(m) for m in matches] for matches in multi.scan(text)])
+
+    def test_scan_empty(self):
+        multi = utils.MultiSearchable([
+            utils.QuickSearchable(pyparsing.Literal("the"))])
+        self.assertEqual([[]], multi.scan(""))
+        self.assertEqual([[]], multi.scan("nothing here"))
+
+
+class KeepPosTests(TestCase):
+    def test_positions(self):
+        """The wrapped result should record where the match starts and ends,
+        excluding leading whitespace"""
+        grammar = (pyparsing.Literal("a") +
+                   utils.KeepPos(pyparsing.OneOrMore(pyparsing.Word("bc"))
+                                 ).setResultsName("bs") +
+                   pyparsing.Literal("d"))
+        match = grammar.parseString("a  bb cc d")
+        self.assertEqual((3, 8), match.bs.pos)
+        self.assertEqual(['bb', 'cc'], list(match.bs.tokens))
+        self.assertEqual(set(['a']), utils.QuickSearchable.initial_regex(
+            utils.KeepPos(pyparsing.Literal("a"))))
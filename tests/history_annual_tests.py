@@ -3,7 +3,8 @@ import re
 from unittest import TestCase
 
 from click.testing import CliRunner
-from mock import Mock, patch
+import httpretty
+from mock import patch
 
 from regparser.index import xml_sync
 from regparser.history import annual
@@ -157,30 +158,68 @@ class HistoryAnnualTests(TestCase):
             notice = {'effective_on': '2000-10-02'}
             self.assertEqual(annual.annual_edition_for(title, notice), 2001)
 
-    @patch('regparser.history.annual.Volume')
-    def test_find_volume(self, Volume):
-        v1 = Mock()
-        v1.exists = True
-        v1.should_contain.return_value = False
-
-        v2 = Mock()
-        v2.exists = True
-        v2.should_contain.return_value = True
-
-        v3 = Mock()
-        v3.exists = False
-
-        def side_effect(year, title, vol_num):
-            if vol_num > 3:
-                return v2
-            return v1
-        Volume.side_effect = side_effect
-
-        self.assertEqual(annual.find_volume(2000, 11, 3), v2)
-
-        def side_effect(year, title, vol_num):
-            if vol_num > 3:
-                return v3
-            return v1
-        Volume.side_effect = side_effect
-        self.assertEqual(annual.find_volume(2000, 11, 3), None)
+
+class HistoryAnnualFindVolumeTests(HttpMixin, TestCase):
+    def expect_volumes(self, *spans):
+        """Volumes with the provided <PARTS> text. Later volumes don't
+        exist"""
+        for vol_num, span in enumerate(spans, 1):
+            self.expect_xml_http(
+                "<CFRDOC><PARTS>{}</PARTS></CFRDOC>".format(span),
+                uri=re.compile(r".*vol{}\.xml".format(vol_num)))
+        self.expect_xml_http(
+            status=404,
+            uri=re.compile(r".*vol([{}-9]|\d\d+)\.xml".format(
+                len(spans) + 1)))
+
+    def requested_volumes(self):
+        return sorted(request.path.split('-vol')[1].split('.')[0]
+                      for request in httpretty.httpretty.latest_requests)
+
+    def test_find_volume(self):
+        """The volume containing the part should be found"""
+        self.expect_volumes("Parts 1 to 99", "Parts 100 to 199",
+                            "Parts 200 to End")
+        with CliRunner().isolated_filesystem():
+            volume = annual.find_volume(2000, 11, 150)
+            self.assertEqual(2, volume.vol_num)
+            self.assertEqual((100, 199), volume.part_span)
+            self.assertEqual(None, annual.find_volume(2000, 11, 0))
+
+    @patch('regparser.history.annual.settings.HTTP_WORKERS', 2)
+    def test_find_volume_missing(self):
+        """If no volume contains the part, we should stop probing once
+        volumes no longer exist"""
+        self.expect_volumes("Parts 1 to 99", "Parts 100 to 199")
+        with CliRunner().isolated_filesystem():
+            self.assertEqual(None, annual.find_volume(2000, 11, 500))
+            self.assertEqual(['1', '2', '3', '4'], self.requested_volumes())
+
+    def test_find_volume_head_only(self):
+        """Only the beginning of each volume should be requested"""
+        self.expect_volumes("Parts 1 to End")
+        with CliRunner().isolated_filesystem():
+            annual.find_volume(2000, 11, 10)
+            headers = httpretty.last_request().headers
+            self.assertEqual('bytes=0-{}'.format(annual.HEAD_BYTES - 1),
+                             headers['Range'])
+
+    @patch('regparser.history.annual.settings.HTTP_WORKERS', 1)
+    def test_find_volume_cached(self):
+        """Part spans should be remembered, so the volumes needn't be
+        requested again"""
+        self.expect_volumes("Parts 1 to 99", "Parts 100 to 199",
+                            "Parts 200 to End")
+        with CliRunner().isolated_filesystem():
+            annual.find_volume(2000, 11, 250)
+            self.assertEqual(['1', '2', '3'], self.requested_volumes())
+
+            httpretty.reset()
+            self.expect_volumes()
+            volume = annual.find_volume(2000, 11, 150)
+            self.assertEqual(2, volume.vol_num)
+            self.assertEqual([], self.requested_volumes())
+
+            # Volumes which weren't found are still probed
+            self.assertEqual(None, annual.find_volume(2000, 11, 0))
+            self.assertEqual(['4'], self.requested_volumes())
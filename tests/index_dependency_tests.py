@@ -1,9 +1,12 @@
 from contextlib import contextmanager
+from multiprocessing import Process
 import os
+import shelve
 from time import time
 from unittest import TestCase
 
 from click.testing import CliRunner
+from mock import patch
 
 from regparser.index import dependency, entry
 
@@ -15,7 +18,8 @@ class DependencyGraphTests(TestCase):
             path = entry.Entry('path')
             self.depender = path / 'depender'
             self.dependency = path / 'dependency'
-            yield dependency.Graph()
+            with dependency.Graph() as dgraph:
+                yield dgraph
 
     def test_nonexistent_files_are_stale(self):
         """By definition, if a file is not present, it needs to be rebuilt"""
@@ -46,13 +50,22 @@ class DependencyGraphTests(TestCase):
             self.assertFalse(dgraph.is_stale(self.dependency))
             self.assertFalse(dgraph.is_stale(self.depender))
 
-            # Set the update time of the dependency to the future
+            # Set the update time of the dependency to the future. As its
+            # contents haven't changed, the depender is still up to date
             os.utime(str(self.dependency),
                      (time()*1000 + 1000, time()*1000 + 1000))
-            dgraph.dag.run()
+            dgraph.refresh(self.dependency)
+            self.assertFalse(dgraph.is_stale(self.dependency))
+            self.assertFalse(dgraph.is_stale(self.depender))
+
+            self.dependency.write('new value')
             self.assertFalse(dgraph.is_stale(self.dependency))
             self.assertTrue(dgraph.is_stale(self.depender))
 
+            # Rebuilding the depender brings it up to date
+            self.depender.write('value2')
+            self.assertFalse(dgraph.is_stale(self.depender))
+
     def test_dependencies_serialized(self):
         """Every instance of dependency.Graph shares a serialized copy of the
         dependencies"""
@@ -65,8 +78,143 @@ class DependencyGraphTests(TestCase):
                 dependencies,
                 set([str(self.dependency / 1), str(self.dependency / 2)]))
 
-            with dependency.Graph().dependency_db() as db:
+            with dependency.Graph() as other, other.dependency_db() as db:
                 dependencies = db[str(self.depender)]
             self.assertEqual(
                 dependencies,
                 set([str(self.dependency / 1), str(self.dependency / 2)]))
+
+    def test_add_is_batched(self):
+        """Dependencies are buffered until the graph is next queried"""
+        with self.dependency_graph() as dgraph:
+            dgraph.add(self.depender, self.dependency)
+            dgraph.add(self.depender, self.dependency)
+            self.assertEqual(dgraph._pending,
+                             [(str(self.depender), str(self.dependency))])
+            # A second connection doesn't see the buffered dependencies...
+            with dependency.Graph() as other:
+                with other.dependency_db() as db:
+                    self.assertEqual(db, {})
+            # ...until they are flushed
+            dgraph.is_stale(self.depender)
+            self.assertEqual(dgraph._pending, [])
+            with dependency.Graph() as other:
+                with other.dependency_db() as db:
+                    self.assertEqual(db, {str(self.depender):
+                                          set([str(self.dependency)])})
+
+    def test_context_manager_flushes(self):
+        """Exiting the context saves any remaining dependencies"""
+        with self.dependency_graph() as dgraph:
+            with dgraph:
+                dgraph.add(self.depender, self.dependency)
+            with dependency.Graph() as other:
+                self.assertTrue(other.is_stale(self.depender))
+                with self.assertRaises(dependency.Missing):
+                    other.validate_for(self.depender)
+
+    def test_legacy_db_imported(self):
+        """Dependencies stored in the old shelve format are carried over"""
+        with CliRunner().isolated_filesystem():
+            os.makedirs(entry.ROOT)
+            legacy = shelve.open(dependency.Graph.LEGACY_DB_FILE)
+            legacy['a'] = set(['b', 'c'])
+            legacy.close()
+            with dependency.Graph() as dgraph:
+                with dgraph.dependency_db() as db:
+                    self.assertEqual(db, {'a': set(['b', 'c'])})
+
+    def test_only_upstream_files_inspected(self):
+        """Determining staleness shouldn't look at unrelated files, and file
+        information is cached"""
+        with self.dependency_graph() as dgraph:
+            self.dependency.write('value')
+            self.depender.write('value2')
+            dgraph.add(self.depender, self.dependency)
+            dgraph.add(entry.Entry('other'), entry.Entry('unrelated'))
+            with patch('regparser.index.dependency.os.path.getmtime') as mt:
+                mt.return_value = 1000
+                self.assertFalse(dgraph.is_stale(self.depender))
+                self.assertFalse(dgraph.is_stale(self.depender))
+                self.assertEqual(
+                    set(call[0][0] for call in mt.call_args_list),
+                    set([str(self.depender), str(self.dependency)]))
+                self.assertEqual(mt.call_count, 2)
+
+    def test_add_invalidates_downstream(self):
+        """Adding a dependency affects the staleness of everything which
+        depends on it"""
+        with self.dependency_graph() as dgraph:
+            final = entry.Entry('path') / 'final'
+            self.dependency.write('value')
+            self.depender.write('value2')
+            final.write('value3')
+            dgraph.add(final, self.depender)
+            dgraph.add(self.depender, self.dependency)
+            self.assertFalse(dgraph.is_stale(final))
+
+            dgraph.add(self.depender, entry.Entry('path') / 'missing')
+            self.assertTrue(dgraph.is_stale(self.depender))
+            self.assertTrue(dgraph.is_stale(final))
+            with self.assertRaises(dependency.Missing):
+                dgraph.validate_for(final)
+
+    def test_digests_persist(self):
+        """Digests are shared between instances of dependency.Graph, so
+        rewriting an input with identical content doesn't cause a rebuild"""
+        with self.dependency_graph() as dgraph:
+            self.dependency.write('value')
+            self.depender.write('value2')
+            dgraph.add(self.depender, self.dependency)
+            self.assertFalse(dgraph.is_stale(self.depender))
+            dgraph.close()
+
+            later = time() + 1000
+            os.utime(str(self.dependency), (later, later))
+            with dependency.Graph() as dgraph:
+                self.assertFalse(dgraph.is_stale(self.depender))
+
+            with open(str(self.dependency), 'w') as f:
+                f.write('changed')
+            os.utime(str(self.dependency), (later, later))
+            with dependency.Graph() as dgraph:
+                self.assertTrue(dgraph.is_stale(self.depender))
+
+    def test_removed_dependency(self):
+        """Files removed after being inspected shouldn't cause errors when
+        recording digests"""
+        with self.dependency_graph() as dgraph:
+            self.dependency.write('value')
+            self.depender.write('value2')
+            dgraph.add(self.depender, self.dependency)
+            self.assertFalse(dgraph.is_stale(self.depender))
+            os.remove(str(self.dependency))
+            self.depender.write('value3')
+            dgraph.refresh()
+            self.assertTrue(dgraph.is_stale(self.depender))
+
+    def test_identical_rewrite_in_worker(self):
+        """Rebuilding an entry with identical content in a worker process
+        leaves both it and its dependents up to date for later graphs"""
+        with self.dependency_graph() as dgraph:
+            middle = entry.Entry('path', 'middle')
+            self.dependency.write('value')
+            middle.write('middle')
+            self.depender.write('value2')
+            dgraph.add(middle, self.dependency)
+            dgraph.add(self.depender, middle)
+            self.assertFalse(dgraph.is_stale(self.depender))
+
+            later = time() + 1000
+            self.dependency.write('changed')
+            os.utime(str(self.dependency), (later, later))
+            dgraph.refresh()
+            self.assertTrue(dgraph.is_stale(middle))
+
+            worker = Process(target=middle.write, args=('middle',))
+            worker.start()
+            worker.join()
+
+            with dependency.Graph() as other:
+                self.assertFalse(other.is_stale(middle))
+                self.assertFalse(other.is_stale(self.depender))
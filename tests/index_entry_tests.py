@@ -2,9 +2,12 @@ from datetime import date
 from unittest import TestCase
 
 from click.testing import CliRunner
+from lxml import etree
+from mock import patch
 
 from regparser.history.versions import Version
 from regparser.index import entry
+from regparser.tree.struct import FrozenNode, FullNodeEncoder, Node
 
 
 class VersionEntryTests(TestCase):
@@ -23,3 +26,124 @@ class VersionEntryTests(TestCase):
             (path / '3333').write(v3)
 
             self.assertEqual(['2222', '3333', '1111'], list(path))
+
+
+class EntryTests(TestCase):
+    def test_write_atomic(self):
+        """Writes should go through a hidden temporary file, which is not
+        listed as a sub-entry"""
+        with CliRunner().isolated_filesystem():
+            path = entry.Entry('some', 'dir')
+            (path / 'file').write('content')
+            self.assertEqual('content', (path / 'file').read())
+            (path / '.in-progress.tmp').write('partial')
+            self.assertEqual(['file'], list(path))
+
+    def test_write_unchanged(self):
+        """Writing identical contents shouldn't replace the file"""
+        with CliRunner().isolated_filesystem():
+            path = entry.Entry('some', 'file')
+            path.write('content')
+            with patch('regparser.index.entry.os.rename') as rename:
+                path.write('content')
+                self.assertFalse(rename.called)
+                path.write('other content')
+                self.assertTrue(rename.called)
+
+
+class TreeEntryTests(TestCase):
+    def tree(self, text):
+        child = Node('child', label=['1000', '1'],
+                     source_xml=etree.fromstring('<P>child</P>'))
+        child.tagged_text = 'tagged'
+        return Node(text, label=['1000'], children=[child])
+
+    def test_round_trip(self):
+        """Nodes should be stored in the node_record store and restored with
+        all of their fields"""
+        with CliRunner().isolated_filesystem():
+            entry.Tree('12', '1000', 'v1').write(self.tree('root'))
+            tree = entry.Tree('12', '1000', 'v1').read()
+            self.assertEqual(self.tree('root'), tree)
+            child = tree.children[0]
+            self.assertEqual('tagged', child.tagged_text)
+            self.assertEqual('<P>child</P>', etree.tostring(child.source_xml))
+
+            frozen = entry.FrozenTree('12', '1000', 'v1').read()
+            self.assertEqual(FrozenNode.from_node(self.tree('root')), frozen)
+
+    def test_shared_records(self):
+        """Unchanged nodes should be stored once and, when frozen, shared
+        between versions"""
+        with CliRunner().isolated_filesystem():
+            entry.Tree('12', '1000', 'v1').write(self.tree('root1'))
+            entry.Tree('12', '1000', 'v2').write(self.tree('root2'))
+            record_count = sum(len(entry.NodeRecord(prefix))
+                               for prefix in entry.NodeRecord())
+            self.assertEqual(3, record_count)
+
+            v1 = entry.FrozenTree('12', '1000', 'v1').read()
+            v2 = entry.FrozenTree('12', '1000', 'v2').read()
+            self.assertTrue(v1.children[0] is v2.children[0])
+
+    def test_legacy_format(self):
+        """Trees stored as full JSON documents should still be readable"""
+        with CliRunner().isolated_filesystem():
+            content = FullNodeEncoder().encode(self.tree('root'))
+            entry.Entry('tree', '12', '1000', 'v1').write(content)
+            self.assertEqual(self.tree('root'),
+                             entry.Tree('12', '1000', 'v1').read())
+            self.assertEqual(FrozenNode.from_node(self.tree('root')),
+                             entry.FrozenTree('12', '1000', 'v1').read())
+            self.assertIsNone(entry.Tree('12', '1000', 'v1').root_hash())
+
+    def test_root_hash(self):
+        """Identical trees share a root hash"""
+        with CliRunner().isolated_filesystem():
+            for version_id, text in (('v1', 'root'), ('v2', 'root'),
+                                     ('v3', 'other')):
+                entry.Tree('12', '1000', version_id).write(self.tree(text))
+            hashes = [entry.Tree('12', '1000', version_id).root_hash()
+                      for version_id in ('v1', 'v2', 'v3')]
+            self.assertEqual(hashes[0], hashes[1])
+            self.assertNotEqual(hashes[0], hashes[2])
+
+    def test_json_records(self):
+        """Records written in JSON should be readable in compact mode"""
+        with CliRunner().isolated_filesystem():
+            with patch('regparser.index.entry.settings') as settings:
+                settings.INDEX_FORMAT = 'json'
+                entry.Tree('12', '1000', 'v1').write(self.tree('root'))
+            tree = entry.Tree('12', '1000', 'v1').read()
+            self.assertEqual(self.tree('root'), tree)
+            self.assertEqual('<P>child</P>',
+                             etree.tostring(tree.children[0].source_xml))
+
+    def test_lazy_source_xml(self):
+        """XML shouldn't be parsed when reading trees, nor when writing them
+        again"""
+        with CliRunner().isolated_filesystem():
+            entry.Tree('12', '1000', 'v1').write(self.tree('root'))
+            with patch('regparser.tree.struct.etree') as etree_mock:
+                tree = entry.Tree('12', '1000', 'v1').read()
+                entry.Tree('12', '1000', 'v2').write(tree)
+                self.assertFalse(etree_mock.fromstring.called)
+            self.assertEqual('<P>child</P>',
+                             etree.tostring(tree.children[0].source_xml))
+
+
+class JSONEntryTests(TestCase):
+    def test_formats(self):
+        """Entries can be written in either format and read regardless of
+        the current setting"""
+        with CliRunner().isolated_filesystem():
+            layer = entry.Layer('12', '1000', 'v1', 'layer')
+            for index_format in ('json', 'compact'):
+                with patch('regparser.index.formats.settings') as settings:
+                    settings.INDEX_FORMAT = index_format
+                    layer.write({'1000-1': [{'key': 'value'}]})
+                with open(str(layer)) as f:
+                    self.assertEqual(f.read().startswith('{'),
+                                     index_format == 'json')
+                self.assertEqual(layer.read(),
+                                 {'1000-1': [{'key': 'value'}]})
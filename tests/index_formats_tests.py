@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from json import JSONEncoder
+from unittest import TestCase
+
+from mock import patch
+
+from regparser.index import formats
+
+
+class SetEncoder(JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, set):
+            return sorted(obj)
+        return super(SetEncoder, self).default(obj)
+
+
+class FormatsTests(TestCase):
+    def test_round_trip(self):
+        """Both formats should decode to the same structures JSON does"""
+        content = {'a': [1, (2, 3)], 'b': {'c': None, 'd': u'§ 2'},
+                   'e': 1.5, 'f': True, 'g': set(['x', 'y'])}
+        expected = {u'a': [1, [2, 3]], u'b': {u'c': None, u'd': u'§ 2'},
+                    u'e': 1.5, u'f': True, u'g': [u'x', u'y']}
+        for index_format in ('json', 'compact'):
+            with patch('regparser.index.formats.settings') as settings:
+                settings.INDEX_FORMAT = index_format
+                serialized = formats.dumps(content, SetEncoder)
+            self.assertEqual(formats.is_compact(serialized),
+                             index_format == 'compact')
+            decoded = formats.loads(serialized)
+            self.assertEqual(decoded, expected)
+            self.assertTrue(all(isinstance(key, unicode) for key in decoded))
+
+    def test_object_hook(self):
+        """The object hook should be applied to every decoded map"""
+        serialized = formats.CompactFormat.dumps({'a': {'b': 1}})
+        self.assertEqual(
+            formats.loads(serialized, object_hook=lambda d: len(d)), 1)
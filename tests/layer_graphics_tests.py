@@ -1,18 +1,27 @@
+import json
+import re
+import time
 from unittest import TestCase
 
-from mock import patch, Mock
+from click.testing import CliRunner
+import httpretty
+from mock import patch
 
+from regparser.layer import graphics
 from regparser.layer.graphics import Graphics
 from regparser.tree.struct import Node
+from tests.http_mixin import HttpMixin
 import settings
 
 
-class LayerGraphicsTest(TestCase):
+class LayerGraphicsTest(HttpMixin, TestCase):
 
     def setUp(self):
+        super(LayerGraphicsTest, self).setUp()
         self.default_url = settings.DEFAULT_IMAGE_URL
 
     def tearDown(self):
+        super(LayerGraphicsTest, self).tearDown()
         settings.DEFAULT_IMAGE_URL = self.default_url
 
     def test_process(self):
@@ -20,7 +29,8 @@ class LayerGraphicsTest(TestCase):
                     "some more ![222](XXX) followed by ![ex](ABCD) and XXX " +
                     "and ![](NOTEXT)")
         g = Graphics(None)
-        with patch('regparser.layer.graphics.requests'):
+        with patch('regparser.layer.graphics.find_thumbs') as find_thumbs:
+            find_thumbs.return_value = {}
             result = g.process(node)
         self.assertEqual(3, len(result))
         found = [False, False, False]
@@ -46,7 +56,8 @@ class LayerGraphicsTest(TestCase):
     def test_process_format(self):
         node = Node("![A88 Something](ER22MY13.257-1)")
         g = Graphics(None)
-        with patch('regparser.layer.graphics.requests'):
+        with patch('regparser.layer.graphics.find_thumbs') as find_thumbs:
+            find_thumbs.return_value = {}
             self.assertEqual(1, len(g.process(node)))
 
     @patch('regparser.layer.graphics.content')
@@ -56,7 +67,8 @@ class LayerGraphicsTest(TestCase):
 
         node = Node("![Alt1](img1)   ![Alt2](f)  ![Alt3](a)")
         g = Graphics(None)
-        with patch('regparser.layer.graphics.requests'):
+        with patch('regparser.layer.graphics.find_thumbs') as find_thumbs:
+            find_thumbs.return_value = {}
             results = g.process(node)
         self.assertEqual(3, len(results))
         found = [False, False, False]
@@ -71,28 +83,137 @@ class LayerGraphicsTest(TestCase):
 
     def test_find_thumb1(self):
         node = Node("![alt1](img1)")
-        settings.DEFAULT_IMAGE_URL = "%s.png"
+        settings.DEFAULT_IMAGE_URL = "http://example.com/%s.png"
         g = Graphics(None)
-        with patch('regparser.layer.graphics.requests') as requests:
-            response = Mock()
-            requests.head.return_value = response
-            requests.codes.not_implemented = 501
-            requests.codes.ok = 200
-            response.status_code = 200
+        self._expect_http(method=httpretty.HEAD, uri=re.compile('.*'),
+                          body='')
+        with CliRunner().isolated_filesystem():
             results = g.process(node)
 
         for result in results:
-            self.assertEqual(result['thumb_url'], 'img1.thumb.png')
+            self.assertEqual(result['thumb_url'],
+                             'http://example.com/img1.thumb.png')
 
     def test_find_thumb2(self):
         node = Node("![alt2](img2)")
         settings.DEFAULT_IMAGE_URL = "%s.png"
         g = Graphics(None)
-        with patch('regparser.layer.graphics.requests') as requests:
-            response = Mock()
-            requests.head.return_value = response
-            response.status_code = 404
+        self._expect_http(method=httpretty.HEAD, uri=re.compile('.*'),
+                          body='', status=404)
+        with CliRunner().isolated_filesystem():
             results = g.process(node)
 
         for result in results:
             self.assertTrue('thumb_url' not in result)
+
+    def test_check_for_thumb(self):
+        """The layer's check_for_thumb should remember its results"""
+        self._expect_http(method=httpretty.HEAD, uri=re.compile('.*'),
+                          body='')
+        g = Graphics(None)
+        with CliRunner().isolated_filesystem():
+            self.assertEqual('http://example.com/img.thumb.png',
+                             g.check_for_thumb('http://example.com/img.png'))
+            self.assertEqual('http://example.com/img.thumb.png',
+                             g.check_for_thumb('http://example.com/img.png'))
+        self.assertEqual(1, len(httpretty.httpretty.latest_requests))
+
+    def test_find_thumb_not_implemented(self):
+        """If HEAD requests aren't supported, we should use GET"""
+        self._expect_http(method=httpretty.HEAD, uri=re.compile('.*'),
+                          body='', status=501)
+        self._expect_http(uri=re.compile('.*'), body='image')
+        with CliRunner().isolated_filesystem():
+            self.assertEqual(
+                {'http://example.com/img.gif':
+                 'http://example.com/img.thumb.gif'},
+                graphics.find_thumbs(['http://example.com/img.gif']))
+
+    def test_pre_process(self):
+        """All of the images in the tree should be checked up front. Results
+        should be remembered for other versions"""
+        settings.DEFAULT_IMAGE_URL = "http://example.com/%s.png"
+        self._expect_http(method=httpretty.HEAD,
+                          uri=re.compile('.*/img1.thumb.png'), body='')
+        self._expect_http(method=httpretty.HEAD,
+                          uri=re.compile('.*/img2.thumb.png'), body='',
+                          status=404)
+        tree = Node(children=[Node("![alt1](img1)", label=['1']),
+                              Node("![alt2](img2) ![alt1](img1)",
+                                   label=['2'])])
+        with CliRunner().isolated_filesystem():
+            layer = Graphics(tree).build()
+            self.assertEqual(2, len(httpretty.httpretty.latest_requests))
+            self.assertEqual('http://example.com/img1.thumb.png',
+                             layer['1'][0]['thumb_url'])
+
+            httpretty.reset()
+            Graphics(tree).build()
+            self.assertEqual([], httpretty.httpretty.latest_requests)
+
+            # Expired records should be checked again
+            next_year = time.time() + 60*60*24*365
+            with patch('regparser.layer.graphics.time.time') as now:
+                now.return_value = next_year
+                self._expect_http(method=httpretty.HEAD, uri=re.compile('.*'),
+                                  body='')
+                Graphics(tree).build()
+                self.assertEqual(2, len(httpretty.httpretty.latest_requests))
+
+    def test_find_thumbs_offline(self):
+        """If a manifest is configured, no requests should be made"""
+        with CliRunner().isolated_filesystem():
+            with open('manifest.json', 'w') as f:
+                json.dump({'a.png': 'a.thumb.png', 'b.png': None}, f)
+            with patch.object(settings, 'THUMBNAIL_MANIFEST',
+                              'manifest.json'):
+                self.assertEqual(
+                    {'a.png': 'a.thumb.png', 'b.png': None, 'c.png': None},
+                    graphics.find_thumbs(['a.png', 'b.png', 'c.png']))
+            self.assertEqual([], httpretty.httpretty.latest_requests)
+
+    @patch('regparser.layer.graphics.check_for_thumb')
+    def test_find_thumbs_network_down(self, check_for_thumb):
+        """If we can't check for thumbnails, we should continue without them
+        and not remember the failure"""
+        check_for_thumb.side_effect = graphics.requests.ConnectionError
+        with CliRunner().isolated_filesystem():
+            self.assertEqual({'a.png': None}, graphics.find_thumbs(['a.png']))
+            check_for_thumb.side_effect = None
+            check_for_thumb.return_value = 'a.thumb.png'
+            self.assertEqual({'a.png': 'a.thumb.png'},
+                             graphics.find_thumbs(['a.png']))
+
+    @patch.object(graphics.ThumbnailCache, 'CHUNK_SIZE', 2)
+    def test_thumbnail_cache_get_many(self):
+        """Only the requested, unexpired records should be returned, however
+        many are requested"""
+        with CliRunner().isolated_filesystem():
+            cache = graphics.ThumbnailCache()
+            cache.set_many({'a.png': 'a.thumb.png', 'b.png': None,
+                            'c.png': 'c.thumb.png', 'd.png': None})
+            self.assertEqual(
+                {'a.png': 'a.thumb.png', 'b.png': None,
+                 'c.png': 'c.thumb.png'},
+                cache.get_many(['a.png', 'b.png', 'c.png', 'e.png']))
+            next_year = time.time() + 60*60*24*365
+            with patch('regparser.layer.graphics.time.time') as now:
+                now.return_value = next_year
+                self.assertEqual({}, cache.get_many(['a.png']))
+            cache.close()
+
+    def test_cache_shared(self):
+        """Images found outside of pre-processing should be looked up with
+        the layer's cache, rather than opening a new one each time"""
+        settings.DEFAULT_IMAGE_URL = "http://example.com/%s.png"
+        self._expect_http(method=httpretty.HEAD, uri=re.compile('.*'),
+                          body='')
+        tree = Node("![alt1](img1)", label=['1'])
+        with CliRunner().isolated_filesystem():
+            with patch.object(graphics, 'ThumbnailCache',
+                              wraps=graphics.ThumbnailCache) as cache_cls:
+                layer = Graphics(tree)
+                layer.pre_process()
+                layer.process(Node("![alt2](img2)"))
+                layer.process(Node("![alt3](img3)"))
+                self.assertEqual(1, cache_cls.call_count)
@@ -3,7 +3,8 @@ from unittest import TestCase
 
 from mock import patch
 
-from regparser.layer.terms import ParentStack, Terms
+from regparser.layer.terms import (
+    OffsetIntervals, ParentStack, ScopeIndex, TermMatcher, Terms)
 from regparser.layer.def_finders import Ref
 from regparser.tree.struct import Node
 import settings
@@ -383,6 +384,28 @@ class LayerTermTest(TestCase):
             [('act', 'a', [(29, 32)])],
             t.calculate_offsets(text, applicable_terms, [(1, 5)]))
 
+    def test_calculate_offsets_shared_form(self):
+        """If two terms share an inflected form, the form should belong to
+        the term it matches exactly"""
+        applicable_terms = [('bands', 'plural'), ('band', 'singular')]
+        text = "A band, two bands"
+        t = Terms(None)
+        self.assertItemsEqual(
+            t.calculate_offsets(text, applicable_terms),
+            [('band', 'singular', [(2, 6)]), ('bands', 'plural', [(12, 17)])])
+
+    def test_calculate_offsets_touching_exclusion(self):
+        """Terms which start or end within an exclusion (or a larger
+        term) are skipped, but those which contain one are not"""
+        applicable_terms = [('act', 'a'), ('the act', 'b')]
+        text = "the act act"
+        t = Terms(None)
+        self.assertEqual(
+            [('the act', 'b', [(0, 7)]), ('act', 'a', [(8, 11)])],
+            t.calculate_offsets(text, applicable_terms, [(1, 2)]))
+        self.assertEqual(
+            [], t.calculate_offsets(text, applicable_terms, [(7, 8)]))
+
     def test_process(self):
         t = Terms(Node(children=[
             Node("ABC5", children=[Node("child")], label=['ref1']),
@@ -436,3 +459,98 @@ class LayerTermTest(TestCase):
         #   Term is defined in the first child
         self.assertEqual([], t.process(tree.children[0]))
         self.assertEqual(1, len(t.process(tree.children[1])))
+
+
+class TermMatcherTests(TestCase):
+    def test_occurrences(self):
+        """All occurrences of each form should be found, even when they
+        overlap, so long as they are bounded by word boundaries"""
+        matcher = TermMatcher([('rock band', 'a'), ('band', 'b'),
+                               ('band member', 'c'), ('act', 'd')])
+        self.assertEqual(
+            {'rock band': [(0, 9)], 'band': [(5, 9)], 'bands': [(31, 36)],
+             'band members': [(5, 17)], 'act': [(45, 48)]},
+            dict(matcher.occurrences(
+                'rock band members: bandsbands, bands, factor act')))
+        self.assertEqual({}, dict(matcher.occurrences('')))
+
+    def test_refs(self):
+        matcher = TermMatcher([('activity', 'a'), ('person', 'p')])
+        self.assertEqual(
+            {'activity': 'a', 'activities': 'a', 'person': 'p',
+             'persons': 'p'},
+            matcher.refs)
+
+
+class OffsetIntervalsTests(TestCase):
+    def test_contains(self):
+        intervals = OffsetIntervals([(10, 20), (5, 8), (30, 30), (9, 3)])
+        for offset in (5, 8, 10, 15, 20, 30):
+            self.assertTrue(offset in intervals)
+        for offset in (0, 4, 9, 21, 29, 31):
+            self.assertFalse(offset in intervals)
+
+    def test_add_merges(self):
+        intervals = OffsetIntervals([(10, 20), (5, 8), (30, 40)])
+        intervals.add(7, 12)
+        intervals.add(20, 30)
+        self.assertEqual([5], intervals.starts)
+        self.assertEqual([40], intervals.ends)
+        intervals.add(50, 55)
+        intervals.add(0, 1)
+        self.assertEqual([0, 5, 50], intervals.starts)
+        self.assertEqual([1, 40, 55], intervals.ends)
+
+
+class ScopeIndexTests(TestCase):
+    def setUp(self):
+        self.abc1, self.abc3 = Ref('abc', '101-22-b-2', 1), Ref('abc', '3', 3)
+        self.aaa = Ref('aaa', '101-22-b-2', 4)
+        self.zzz = Ref('zzz', '7', 7)
+        self.scoped_terms = {
+            ('101', '22', 'b', '2', 'ii'): [self.abc1],
+            ('101', '22', 'b'): [self.abc3, self.aaa],
+            ('101', '22', 'b', '2', 'iii'): [self.zzz],
+            'EXCLUDED': [Ref('abc', '7', 12)]}
+        self.index = ScopeIndex(self.scoped_terms)
+
+    def test_applicable_terms(self):
+        """Should match Terms.applicable_terms"""
+        terms = Terms(None)
+        terms.scoped_terms = self.scoped_terms
+        for label in (['101'], ['101', '22', 'b'], ['101', '22', 'b', '2'],
+                      ['101', '22', 'b', '2', 'ii', 'A'],
+                      ['101', '22', 'b', '2', 'iii'], ['101', '23'], []):
+            self.assertEqual(terms.applicable_terms(label),
+                             self.index.applicable_terms(label))
+
+    def test_definition_positions(self):
+        self.assertEqual([(1, 4), (4, 7)],
+                         self.index.definition_positions('101-22-b-2'))
+        self.assertItemsEqual([(7, 10), (12, 15)],
+                              self.index.definition_positions('7'))
+        self.assertEqual([], self.index.definition_positions('8'))
+
+    def test_term_matcher(self):
+        """Terms defined in a paragraph don't apply to it. Matchers should be
+        shared between nodes with the same terms"""
+        label = ['101', '22', 'b', '2', 'ii']
+        matcher = self.index.term_matcher(label, '101-22-b-2-ii')
+        self.assertEqual({'abc': self.abc1, 'abcs': self.abc1,
+                          'aaa': self.aaa, 'aaas': self.aaa}, matcher.refs)
+        self.assertTrue(matcher is self.index.term_matcher(
+            label + ['A'], '101-22-b-2-ii-A'))
+        # abc3 doesn't apply, as abc1 overrides it
+        self.assertTrue(matcher is self.index.term_matcher(label, '3'))
+
+        matcher = self.index.term_matcher(label, '101-22-b-2')
+        self.assertEqual({}, matcher.refs)
+        matcher = self.index.term_matcher(['101', '22', 'b', '2'],
+                                          '101-22-b-2')
+        self.assertEqual({'abc': self.abc3, 'abcs': self.abc3},
+                         matcher.refs)
+        matcher = self.index.term_matcher(['101', '22', 'b', '2', 'iii'],
+                                          '101-22-b-2')
+        self.assertEqual({'abc': self.abc3, 'abcs': self.abc3,
+                          'zzz': self.zzz, 'zzzs': self.zzz}, matcher.refs)
+        self.assertEqual({}, self.index.term_matcher(['9'], '9').refs)
@@ -3,7 +3,7 @@ from random import randint
 from unittest import TestCase
 
 from regparser.notice import compiler
-from regparser.tree.struct import Node, find
+from regparser.tree.struct import Node, find, walk
 
 
 class CompilerTests(TestCase):
@@ -950,3 +950,112 @@ class CompilerTests(TestCase):
         sect5, sect7 = find(tree.tree, '111-5'), find(tree.tree, '111-7')
         self.assertEqual([sub_b], tree.tree.children)
         self.assertEqual([sect5, sect7], sub_b.children)
+
+    def test_move_to_subpart_same_subpart(self):
+        """Designating a section into the subpart it already lives in
+        shouldn't change the tree"""
+        sub_a = Node(label=['111', 'Subpart', 'A'], node_type=Node.SUBPART,
+                     children=[Node(label=['111', '5'])])
+        root = Node(children=[sub_a], label=['111'])
+        before = repr(root)
+        tree = compiler.RegulationTree(root)
+        tree.move_to_subpart('111-5', sub_a.label)
+        self.assertEqual(before, repr(tree.tree))
+        self.assertEqual(sub_a.label,
+                         tree.get_parent(Node(label=['111', '5'])).label)
+
+    def assert_lookups_match_tree(self, reg_tree):
+        """The label indexes should agree with a full walk of the tree"""
+        nodes, parents = {}, {}
+
+        def per_node(node):
+            nodes.setdefault(node.label_id(), node)
+            for child in node.children:
+                parents.setdefault(child.label_id(), node)
+        walk(reg_tree.tree, per_node)
+
+        self.assertEqual(nodes, reg_tree._by_label)
+        self.assertEqual(parents, reg_tree._parent_of)
+        for label_id, node in nodes.items():
+            self.assertTrue(reg_tree.find_node(label_id) is node)
+        for label_id, parent in parents.items():
+            self.assertTrue(reg_tree._parent_of[label_id] is parent)
+
+    def test_lookups_stay_in_sync(self):
+        """Each of the tree-modifying operations should keep the label and
+        parent lookups consistent"""
+        root = self.tree_with_paragraphs()
+        root.children = [Node(label=['205', 'Subpart', 'A'],
+                              node_type=Node.SUBPART,
+                              children=root.children)]
+        reg_tree = compiler.RegulationTree(root)
+        self.assert_lookups_match_tree(reg_tree)
+
+        reg_tree.add_node(Node('(1) n2a1', label=['205', '2', 'a', '1']))
+        self.assert_lookups_match_tree(reg_tree)
+        reg_tree.move('205-2-a', ['205', '4', 'c'])
+        self.assert_lookups_match_tree(reg_tree)
+        self.assertEqual(None, reg_tree.find_node('205-2-a'))
+        self.assertEqual(['205', '4'],
+                         reg_tree.get_parent(Node(label=['205', '4', 'c'])
+                                             ).label)
+        reg_tree.replace_node_and_subtree(
+            Node('n2', label=['205', '2'],
+                 children=[Node('n2z', label=['205', '2', 'z'])]))
+        self.assert_lookups_match_tree(reg_tree)
+        self.assertEqual(None, reg_tree.find_node('205-2-b'))
+        reg_tree.create_empty_node('205-9-a')
+        self.assert_lookups_match_tree(reg_tree)
+        reg_tree.move_to_subpart('205-9', ['205', 'Subpart', 'B'])
+        self.assert_lookups_match_tree(reg_tree)
+        self.assertEqual(['205', 'Subpart', 'B'],
+                         reg_tree.get_parent(Node(label=['205', '9'])).label)
+        reg_tree.delete('205-4')
+        self.assert_lookups_match_tree(reg_tree)
+        self.assertEqual(None, reg_tree.find_node('205-2-a-1'))
+
+    def test_compile_regulation_copy_on_write(self):
+        """The previous tree should not be modified; unchanged subtrees
+        should be shared with the new tree"""
+        root = self.tree_with_paragraphs()
+        before = repr(root)
+        notice_changes = {
+            '205-2-a': [{'action': 'PUT', 'field': '[text]',
+                         'node': {'text': 'new text'}}],
+            '205-4-a': [{'action': 'POST',
+                         'node': {'text': 'n4a', 'label': ['205', '4', 'a'],
+                                  'node_type': 'regtext'}}],
+            '205-1': [{'action': 'MOVE', 'destination': ['205', '3']}]}
+
+        reg = compiler.compile_regulation(root, notice_changes)
+        self.assertEqual(before, repr(root))
+
+        self.assertEqual('new text', find(reg, '205-2-a').text)
+        self.assertEqual('n4a', find(reg, '205-4-a').text)
+        self.assertEqual(None, find(reg, '205-1'))
+        self.assertNotEqual(None, find(reg, '205-3'))
+        # Unchanged nodes are shared; modified ones (and their ancestors)
+        # are not
+        self.assertTrue(find(reg, '205-2-b') is find(root, '205-2-b'))
+        self.assertFalse(find(reg, '205-2') is find(root, '205-2'))
+        self.assertFalse(find(reg, '205-4') is find(root, '205-4'))
+        self.assertFalse(reg is root)
+
+    def test_compile_regulation_keep_copy_on_write(self):
+        """Kept nodes should reflect later modifications without altering
+        the previous tree"""
+        root = self.tree_with_paragraphs()
+        notice_changes = {
+            '205-2': [{'action': 'PUT',
+                       'node': {'text': 'new n2', 'label': ['205', '2'],
+                                'node_type': 'regtext'}}],
+            '205-2-a': [{'action': 'KEEP'},
+                        {'action': 'PUT', 'field': '[text]',
+                         'node': {'text': 'new n2a'}}]}
+
+        reg = compiler.compile_regulation(root, notice_changes)
+        self.assertEqual('n2a', find(root, '205-2-a').text)
+        self.assertEqual('new n2', find(reg, '205-2').text)
+        self.assertEqual(['205-2-a'],
+                         [c.label_id() for c in find(reg, '205-2').children])
+        self.assertEqual('new n2a', find(reg, '205-2-a').text)
@@ -1,6 +1,8 @@
 import json
 from unittest import TestCase
 
+from mock import patch
+
 from regparser.tree import struct
 
 
@@ -284,3 +286,17 @@ class NodeTests(TestCase):
         self.assertIsNone(struct.Node.is_markerless_label(None))
         self.assertTrue(struct.Node.is_markerless_label(['134', 'p33']))
         self.assertIsNone(struct.Node.is_markerless_label(['245', '23']))
+
+    def test_lazy_source_xml(self):
+        """LazyXML is only parsed when source_xml is accessed, and needn't be
+        parsed to be serialized"""
+        node = struct.Node('text', source_xml=struct.LazyXML('<P>Text</P>'))
+        with patch('regparser.tree.struct.etree') as etree:
+            self.assertEqual(struct.serialized_source_xml(node),
+                             '<P>Text</P>')
+            self.assertFalse(etree.fromstring.called)
+        self.assertEqual(node.source_xml.tag, 'P')
+        self.assertIs(node.source_xml, node.source_xml)
+        self.assertEqual(struct.serialized_source_xml(node), '<P>Text</P>')
+        self.assertIsNone(
+            struct.serialized_source_xml(struct.FrozenNode('text')))
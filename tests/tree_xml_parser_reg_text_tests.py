@@ -5,11 +5,13 @@ from unittest import TestCase
 from lxml import etree
 from mock import patch
 
+from regparser import content
 from regparser.tree.depth import markers as mtypes
 from regparser.tree.struct import Node
 from regparser.tree.xml_parser import reg_text
 from tests.xml_builder import XMLBuilderMixin
 from tests.node_accessor import NodeAccessorMixin
+import settings
 
 
 class RegTextTest(XMLBuilderMixin, NodeAccessorMixin, TestCase):
@@ -590,20 +592,27 @@ class RegTextTest(XMLBuilderMixin, NodeAccessorMixin, TestCase):
                          ['a', '1', 'i'])
         self.assertEqual(reg_text.get_markers(text, '2'), ['a', '1'])
 
-    @patch('regparser.tree.xml_parser.reg_text.content')
-    def test_preprocess_xml(self, content):
+    @patch('regparser.content._try_to_load')
+    def test_preprocess_xml(self, try_to_load):
         with self.tree.builder("CFRGRANULE") as root:
             with root.PART() as part:
                 with part.APPENDIX() as appendix:
                     appendix.TAG("Other Text")
                     with appendix.GPH(DEEP=453, SPAN=2) as gph:
                         gph.GID("ABCD.0123")
-        content.Macros.return_value = [
+        try_to_load.return_value = [
             ("//GID[./text()='ABCD.0123']/..",
              """<HD SOURCE="HD1">Some Title</HD><GPH DEEP="453" SPAN="2">"""
              """<GID>EFGH.0123</GID></GPH>""")]
         orig_xml = self.tree.render_xml()
-        reg_text.preprocess_xml(orig_xml)
+        with patch.object(settings, 'MACROS_SOURCES', ['macros']):
+            content.reload()
+            reg_text.preprocess_xml(orig_xml)
+            # Macros are parsed once, but each use receives a copy
+            second_xml = self.tree.render_xml()
+            reg_text.preprocess_xml(second_xml)
+        content.reload()
+        self.assertEqual(1, try_to_load.call_count)
 
         self.setUp()
         with self.tree.builder("CFRGRANULE") as root:
@@ -615,6 +624,8 @@ class RegTextTest(XMLBuilderMixin, NodeAccessorMixin, TestCase):
                         gph.GID("EFGH.0123")
 
         self.assertEqual(etree.tostring(orig_xml), self.tree.render_string())
+        self.assertEqual(etree.tostring(second_xml),
+                         self.tree.render_string())
 
     def test_build_from_section_double_alpha(self):
         # Ensure we match a hierarchy like (x), (y), (z), (aa), (bb)…
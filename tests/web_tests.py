@@ -0,0 +1,40 @@
+from unittest import TestCase
+
+from mock import patch
+
+from regparser import web
+
+
+class WebTests(TestCase):
+    def test_session_shared(self):
+        """The same session should be used until the process changes"""
+        session = web.session()
+        self.assertIs(session, web.session())
+        with patch('regparser.web.os.getpid') as getpid:
+            getpid.return_value = -1
+            self.assertIsNot(session, web.session())
+
+    def test_session_uncached(self):
+        """Uncached sessions shouldn't use a replaced Session class"""
+        with patch('regparser.web.requests.Session') as Session:
+            with patch('regparser.web.os.getpid') as getpid:
+                getpid.return_value = -2
+                self.assertEqual(Session.return_value, web.session())
+                self.assertNotEqual(Session.return_value,
+                                    web.session(cached=False))
+
+    def test_map_concurrently(self):
+        """Results should be in the same order as the inputs"""
+        self.assertEqual(range(0, 40, 2),
+                         web.map_concurrently(lambda x: x * 2, range(20),
+                                              workers=4))
+        self.assertEqual([], web.map_concurrently(lambda x: x, []))
+
+    def test_map_concurrently_exception(self):
+        """Exceptions should be re-raised"""
+        def fail(x):
+            if x == 3:
+                raise ValueError(x)
+            return x
+        self.assertRaises(ValueError, web.map_concurrently, fail, range(5),
+                          workers=2)